@@ -9,11 +9,15 @@ import schedule
 from pymongo import MongoClient, UpdateOne, ReplaceOne
 import urllib3
 
-load_dotenv(verbose=True)
-mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') 
-client = MongoClient(mongoConnectionString)
+from addressKeys import bridgeAddressKey, bridgeKeyField
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+
+client = getClient("sync") # Our database connector
 db = client["housing-prices"]
 Collection = db["bridge"]
+limiter = getLimiter("BRIDGE")
 
 
 def uploadListings(listings, skip):
@@ -21,6 +25,7 @@ def uploadListings(listings, skip):
     for doc in listings:
         # doc.pop("@odata.context") 
         doc.pop("@odata.id")
+        doc[bridgeKeyField] = bridgeAddressKey(doc) # propertyTaxApi looks listings up by address
         bulkRequests.append(
             ReplaceOne(
                 {"ListingKeyNumeric": doc["ListingKeyNumeric"]}, 
@@ -29,19 +34,20 @@ def uploadListings(listings, skip):
             )
         )
     replacementResult = Collection.bulk_write(bulkRequests, ordered=False)
+    listingsWritten(Collection, listings) # Clean the listings for the dashboard and tell it its caches are stale
     latestTime = listings[-1]['ModificationTimestamp']
     logging.error(latestTime)
     logging.info(f'    BRIDGE: Inserted: {replacementResult.inserted_count}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings for skip {skip} with most recent time {latestTime}')
     return latestTime
 
 def getRequest(query):
-    # A wrapper around requests.get in order to catch errors
+    # A wrapper around requests.get in order to catch errors. Throttled requests are waited out by the limiter
     try:
-        return requests.get(query)
+        return limiter.get(query)
     except (urllib3.exceptions.MaxRetryError, requests.exceptions.ConnectionError):
         logging.info(f"Max retries exceeded for query {query}. Waiting 10 seconds and trying again...")
-        time.sleep(10)
-        return requests.get(query)
+        limiter.backoff(10)
+        return limiter.get(query)
 
 def seedBridge(skip=None, oldestTimestamp="2005-07-29T02:25:16.000Z"):
     """Request listings from Bridge Analytics RETS API and upload those 
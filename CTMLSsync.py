@@ -1,12 +1,10 @@
 # Developed by Andrew Pantera for TLCengine
 # Download CTMLS data and upload to MongoDB on TFS
 # Each resource of the API will be a Collection in Mongo
-from bson.decimal128 import Decimal128
 from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 import concurrent.futures
 import collections
 import datetime
-from decimal import Decimal
 from dotenv import load_dotenv
 import json
 import logging
@@ -25,21 +23,22 @@ import time
 import sys
 import urllib3
 
-def convert_decimal(dict_item):
-    # function adapted from: https://stackoverflow.com/questions/61456784/pymongo-cannot-encode-object-of-type-decimal-decimal
-    # This function iterates a dictionary looking for types of Decimal and converts them to Decimal128
-    # Embedded dictionaries and lists are called recursively.
-    if dict_item is None: return None
-    if not (isinstance(dict_item, dict) or isinstance(dict_item, collections.OrderedDict)): return dict_item
-    for k, v in list(dict_item.items()):
-        if isinstance(v, dict):
-            convert_decimal(v)
-        elif isinstance(v, list):
-            for l in v:
-                convert_decimal(l)
-        elif isinstance(v, Decimal):
-            dict_item[k] = Decimal128(str(v))
-    return dict_item
+from decimalCodec import convert_decimal
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+from retry import RetryExecutor, RetryPolicy
+from retsSessions import RetsSession, RetsSessionPool, isUnauthorized, keysetSearch
+from stagedSeed import insertStaged, stagingCollection, swapIn
+from writerPool import getWriterPool, waitFor
+
+failedQueries = []
+limiter = getLimiter("CTMLS")
+retsPool = RetsSessionPool("CTMLS")
+retsRetry = RetryExecutor("CTMLS", {
+    requests.exceptions.HTTPError: RetryPolicy(baseDelay=.2),
+    rets.errors.RetsApiError: RetryPolicy(baseDelay=10, maxDelay=120),
+})
 
 def seed(retsClient, dbCursor, skipResources={'office', 'memberassociation', 'virtualtour', 'member', 'comm', 'oh', 'officeassociation', 'memberlicense'}, skipClasses={}):
     for resource in retsClient.resources:
@@ -80,119 +79,68 @@ def uploadListings(docs, collection):
             )
         )
     replacementResult = collection.bulk_write(requests, ordered=False)
+    listingsWritten(collection, docs) # Clean the listings for the dashboard and tell it its caches are stale
     logging.info(f'    CTMLS: Listings returned: {len(docs)}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings')
 
-def getListings(rClass, query, collection, LastUpdatedID=None):
-    queryWithID = query
-    if LastUpdatedID is not None:
-        if query:
-            queryWithID = query + f", (Matrix_Unique_ID={LastUpdatedID}+)"
+def getListings(rClass, query, collection, session: RetsSession, LastUpdatedID=None, upload=uploadListings):
+    def search(queryWithID):
+        limiter.acquire()
+        return [convert_decimal(record.data) for record in rClass.search(query=queryWithID).data] # Decimal values become Decimal128, which pymongo can encode
+
+    def logIn(exc, attempt):
+        # if "Too many outstanding queries" is recieved, the retry waits 10 seconds before trying again. We only log in again if the session expired
+        nonlocal rClass
+        if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+            limiter.record(exc.response) # a 429 backs off for its Retry-After
+        if isUnauthorized(exc):
+            session.logIn()
+            rClass = session.getClass('Property', 'Listing')
+
+    def searchPage(queryWithID):
+        return retsRetry.run(search, queryWithID, onRetry=logIn)
+
+    st = time.time()
+    resultsCount = 0
+    futures = []
+    # The MLS returns at most 5000 listings per search, so we page through the results by Matrix_Unique_ID. The next page downloads while the shared writers upload this one
+    for page in keysetSearch(searchPage, query, start=LastUpdatedID or 0):
+        futures += getWriterPool().submit("CTMLS", upload, page, collection)
+        resultsCount += len(page)
+        logging.info(f"    CTMLS: Max Matrix_Unique_ID reached: {page[-1]['Matrix_Unique_ID']}")
+    if waitFor(futures, "CTMLS"):
+        failedQueries.append(query)
+    logging.info(f"    CTMLS: Searching and inserting {resultsCount} docs from query {query} took {round(time.time()-st, 1)} seconds.")
+    return rClass
+
+def seedProperty(dbCollection, staged=False):
+    # Seed just the listing resource of the property class. A staged seed inserts into a staging collection that replaces dbCollection once every listing is written, see stagedSeed
+    collection = stagingCollection(dbCollection) if staged else dbCollection
+    failures = len(failedQueries)
+    started = datetime.datetime.now(datetime.timezone.utc)
+    with retsPool.session() as session:
+        rClass = session.getClass('Property', 'Listing')
+        getListings(rClass, "", collection, session, LastUpdatedID=0, upload=insertStaged if staged else uploadListings)
+    if staged:
+        if len(failedQueries) > failures:
+            logging.info("    CTMLS: Some listings failed to write, the staged seed was not swapped in")
         else:
-            queryWithID = f"(Matrix_Unique_ID={LastUpdatedID}+)"
-        
-    try:
-        st = time.time()
-        search_result = list(map( 
-            lambda x: convert_decimal(x.data), 
-            rClass.search(query=queryWithID).data)
-        )
-        st = time.time()-st
-    except requests.exceptions.HTTPError:
-        logging.info("    CTMLS: failed, requests.exceptions.HTTPError, retrying...")
-        time.sleep(.2)
-        retsClient =  RetsClient(
-            login_url=os.getenv("CTMLS_LOGIN_URL"),
-            username=os.getenv("CTMLS_USERNAME"),
-            password=os.getenv("CTMLS_PASSWORD"),
-        )
-        rClass = retsClient.get_resource('Property').get_class('Listing')
-        return getListings(rClass, query, collection, LastUpdatedID)
-    except rets.errors.RetsApiError as exc:
-        # if "Too many outstanding queries" is recieved, wait 10 seconds, log in again, and try again
-        logging.info(f"    CTMLS: failed, {exc}, retrying...")
-        time.sleep(10)
-        retsClient =  RetsClient(
-            login_url=os.getenv("CTMLS_LOGIN_URL"),
-            username=os.getenv("CTMLS_USERNAME"),
-            password=os.getenv("CTMLS_PASSWORD"),
-        )
-        rClass = retsClient.get_resource('Property').get_class('Listing')
-        return getListings(rClass, query, collection, LastUpdatedID)
-    except TypeError as exc:
-        # Every once in a while an entire batch fails because the rets connector library doesn't like the format of some of the data returned. When this happens, we should process the data in smaller batches so that we don't lose 5000 listings all because 1 is bad
-        logging.info("    CTMLS: failed", exc)
-        traceback.print_exc()
-        if LastUpdatedID:
-            logging.info("    CTMLS: Skipping 5000 IDs and trying again...")
-            # Because of the density of IDs within this MLS, 5000 Ids will likely contain less than 500 listings, but at max 5000 listings
-            return getListings(rClass, query, collection, LastUpdatedID+5000)
-        return rClass
-    else:
-        if search_result:
-            batchSize = 1000
-            resultsCount = len(search_result)
-            if resultsCount == 5000:
-                LastUpdatedID = search_result[-1]['Matrix_Unique_ID']
-            it = time.time()
-            with ThreadPoolExecutor(max_workers=16) as executor:
-                futures = {}
-                while len(search_result) != 0:
-                    futures[executor.submit(
-                        uploadListings,
-                        search_result[:batchSize],
-                        collection
-                    )] = len(search_result[:batchSize])
-                    search_result = search_result[batchSize:]
-                # with tqdm(total=resultsCount, desc="Pushing batches of max size " + str(batchSize), ncols=100) as pbar:
-                for future in concurrent.futures.as_completed(futures):
-                    # pbar.update(futures[future])
-                    try:
-                        future.result()
-                    except Exception as exc:
-                        logging.info('    CTMLS: Exception: %s' % exc)
-            it = time.time()-it
-            logging.info(f"    CTMLS: Inserting {resultsCount} docs from query {queryWithID} took {round(st, 1)} seconds to search and {round(it, 1)} seconds to insert.")
-            if resultsCount == 5000:
-                return getListings(rClass, query, collection, LastUpdatedID)
-        return rClass
-
-def seedProperty(dbCollection):
-    # Seed just the listing resource of the property class
-    retsClient =  RetsClient(
-        login_url=os.getenv("CTMLS_LOGIN_URL"),
-        username=os.getenv("CTMLS_USERNAME"),
-        password=os.getenv("CTMLS_PASSWORD"),
-    )
-    rClass = retsClient.get_resource('Property').get_class('Listing')
-    getListings(rClass, "", dbCollection, LastUpdatedID=0)
-
-def update(timeDelta: datetime.timedelta) -> None:
-    load_dotenv(verbose=True)
-    mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-    mongoClient = MongoClient(mongoConnectionString) # Our database connector
-    dbCollection = mongoClient["ctmls"]["Property"]
+            swapIn(collection, dbCollection, "Matrix_Unique_ID", started, lambda timeDelta: update(timeDelta, dbCollection))
+
+def update(timeDelta: datetime.timedelta, dbCollection=None) -> None:
+    if dbCollection is None:
+        mongoClient = getClient("sync") # Our database connector
+        dbCollection = mongoClient["ctmls"]["Property"]
 
-    try:
-        retsClient =  RetsClient(
-            login_url=os.getenv("CTMLS_LOGIN_URL"),
-            username=os.getenv("CTMLS_USERNAME"),
-            password=os.getenv("CTMLS_PASSWORD"),
-        )
-    except requests.exceptions.HTTPError as exc:
-        logging.info("    CTMLS: failed, requests.exceptions.HTTPError, retrying...")
-        logging.info(exc)
-        time.sleep(15)
-        retsClient =  RetsClient(
-            login_url=os.getenv("CTMLS_LOGIN_URL"),
-            username=os.getenv("CTMLS_USERNAME"),
-            password=os.getenv("CTMLS_PASSWORD"),
-        )
-        
     utcMinusFour = datetime.timezone(datetime.timedelta(0, -4*3600))
     oldestTimestamp = (datetime.datetime.now(tz=utcMinusFour) - timeDelta).isoformat().split('.')[0]
-    rClass = retsClient.get_resource('Property').get_class('Listing')
     query = f"(MatrixModifiedDT={oldestTimestamp}+)"
-    getListings(rClass, query, dbCollection, LastUpdatedID=118791173)
+    # Logging in is retried like a search, the session is kept for the next update
+    session = retsRetry.run(retsPool.acquire)
+    try:
+        rClass = session.getClass('Property', 'Listing')
+        getListings(rClass, query, dbCollection, session, LastUpdatedID=118791173)
+    finally:
+        retsPool.release(session)
 
 
 
@@ -21,14 +21,9 @@ import os
 import time
 import schedule
 
+from retry import runUpdate
 
 
-def updateOne(updateMethod, timeDelta):
-    try:
-        updateMethod(timeDelta)
-    except Exception as e:
-        logging.error(f'Exception in ETL.py: {e}')
-        updateOne(updateMethod, timeDelta)
 
 def updateAll(timeDelta: datetime.timedelta) -> None:
     logging.info(f"\nStarting All MLS updates for timedelta of: {timeDelta}\n")
@@ -36,7 +31,7 @@ def updateAll(timeDelta: datetime.timedelta) -> None:
 
     updateMethods = (BRIDGEsync.update, TRESTLEsync.update)
     for updateMethod in updateMethods:
-        updateMethod(timeDelta)
+        runUpdate(updateMethod.__module__.replace('sync', ''), updateMethod, timeDelta)
     
     
     elapsedTime = time.time()-st
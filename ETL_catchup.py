@@ -20,11 +20,7 @@ import os
 import time
 import schedule
 
-def updateOne(updateMethod, timeDelta):
-    try:
-        updateMethod(timeDelta)
-    except Exception:
-        updateOne(updateMethod, timeDelta)
+from retry import runUpdate
 
 def updateAll(timeDelta: datetime.timedelta) -> None:
     logging.info(f"\nStarting All MLS updates for timedelta of: {timeDelta}\n")
@@ -32,7 +28,7 @@ def updateAll(timeDelta: datetime.timedelta) -> None:
 
     updateMethods = (BRIDGEsync.update, MLSPINsync.update, CTMLSsync.update, MLSGRIDsync.update, MLSMATRIXsync.update)
     for updateMethod in updateMethods:
-        updateOne(updateMethod, timeDelta)
+        runUpdate(updateMethod.__module__.replace('sync', ''), updateMethod, timeDelta)
 
     elapsedTime = time.time()-st
     logging.info(f"\nAll MLS updates for timedelta of: {timeDelta} took {round(elapsedTime, 2)} seconds\n")
@@ -20,6 +20,8 @@ import os
 import time
 import schedule
 
+from retry import runUpdate
+
 import sys
 try:
     import socket
@@ -29,22 +31,13 @@ try:
 except socket.error as e:
     sys.exit (0)
 
-def updateOne(updateMethod, timeDelta):
-    failcount = 0
-    try:
-        updateMethod(timeDelta)
-    except Exception:
-        failcount += 1
-        if(failcount > 3):
-             logging.info(f"{updateMethod} failed more than 3 times. Skipping.\n")
-
 def updateAll(timeDelta: datetime.timedelta) -> None:
     logging.info(f"\nStarting All MLS updates for timedelta of: {timeDelta}\n")
     st = time.time()
 
     updateMethods = (BRIDGEsync.update, MLSPINsync.update, CTMLSsync.update, MLSGRIDsync.update, MLSMATRIXsync.update)
     for updateMethod in updateMethods:
-        updateOne(updateMethod, timeDelta)
+        runUpdate(updateMethod.__module__.replace('sync', ''), updateMethod, timeDelta)
 
     elapsedTime = time.time()-st
     logging.info(f"\nAll MLS updates for timedelta of: {timeDelta} took {round(elapsedTime, 2)} seconds\n")
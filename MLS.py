@@ -6,9 +6,11 @@
 # listings based on queries for Counties, Cities, and Zip Codes.
 # In the future, this might be used to inform ETL.py
 
+import collections
 import functools
 import json
 import os
+import threading
 import time
 from datetime import datetime, timedelta
 from typing import Callable, Sequence
@@ -18,10 +20,188 @@ import pandas as pd
 from dotenv import load_dotenv
 from pymongo import MongoClient
 
-cacheValidDays = 60 # Number of days before updating the cache
+from dataVersions import DataVersions, getDataVersions
+from geography import GeographyIndex, caCountyCities
+from mongoClients import getClient
+
+cacheValidDays = 60 # Number of days before updating the cache of an MLS whose syncs don't publish data versions
+listingsCacheSize = 16 # Number of listings queries remembered per MLS
+cleanDatabase = 'housing-prices'
+cleanCollection = 'listings' # Listings of every MLS, normalized into the compact schema below by the ETL as they are synced, see listingsClean
+cleanMLSField = 'm' # The state of the MLS a listing in cleanCollection comes from
+cleanBackfills = 'listingsBackfills' # One marker per MLS state, written once listingsClean.rebuild has cleaned every listing of the MLS
+cleanVersion = 1 # The version of the cleaning in the markers. Bump it when cleanListings or listingFields change, so the dashboard reads raw collections until each MLS is rebuilt
+# The compact schema of cleanCollection: every RESO field the dashboard uses, the short name it is stored under, and the type it is stored as.
+# Missing values aren't stored at all
+listingFields = {
+    "CountyOrParish": ("co", str),
+    "City": ("ci", str),
+    "PostalCode": ("z", str),
+    "StandardStatus": ("ss", str),
+    "PropertyType": ("pt", str),
+    "OnMarketDate": ("omd", datetime),
+    "CloseDate": ("cd", datetime),
+    "OffMarketDate": ("ofd", datetime),
+    "YearBuilt": ("yb", datetime),
+    "ListPrice": ("lp", float),
+    "OriginalListPrice": ("olp", float),
+    "LastListPrice": ("llp", float),
+    "ClosePrice": ("cp", float),
+    "ListPricePerSQFT": ("ppsf", float),
+    "Latitude": ("lat", float),
+    "Longitude": ("lng", float),
+    "BedroomsTotal": ("bd", float),
+    "BathroomsTotalDecimal": ("ba", float),
+    "BuildingAreaTotal": ("sqft", float),
+    "LotSizeSquareFeet": ("lot", float),
+    "DaysOnMarket": ("dom", float),
+}
+
+def typeListings(listings: pd.DataFrame) -> pd.DataFrame:
+    # Give the RESO fields the types the dashboard expects
+    if (listings is not None) and (not listings.empty):
+        # Make date fields datetimes
+        for field in ['OnMarketDate', 'CloseDate', 'OffMarketDate', 'YearBuilt']:
+            if field in listings.columns:
+                listings[field] = pd.to_datetime(listings[field], utc=True) # mabelo: added errors='coerce'
+                # mabelo edit 2024: astype does not work with datetime64, need to use tz_convert
+                #listings[field] = listings[field].astype('datetime64[ns]') # get rid of any timezone
+                listings[field] = listings[field].dt.tz_convert('UTC').dt.tz_localize(None)
+                listings[field].dt.tz_localize(None)
+        # Make Decimal128 fields floats
+        for field in ['ListPrice', 'ClosePrice', 'ListPricePerSQFT', 'Latitude', 'Longitude', 'LotSizeSquareFeet', 'OriginalListPrice', 'BuildingAreaTotal']:
+            if field in listings.columns:
+                listings[field] = listings[field].astype('str').replace("None", "nan").astype('float')
+    return listings
+
+# The statuses of listings that are off the market. Every other listing is still for sale
+offMarketStatuses = ("Closed", "Sold", "Expired", "Canceled", "Cancelled", "Killed", "Under Agreement", "Rented", "Deposit", "S-Closed/Rented", 'T-Temp Off Market', 'X-Expired', 'Sold-REO', 'Rented-Leased', 'Sold-Short Sale', 'Withdrawn')
+ratioBounds = (0.5, 2.0) # Ratios of prices outside these are left out of the ratio metrics, like missing prices
+# The monthly chart metrics aggregateMonthly computes: the date that puts a listing in a month, the statistic, the field it's taken
+# of (None for counts, a (numerator, denominator) pair for ratios), and the statuses a listing needs to be included (None for every
+# listing). An "active" metric counts a listing in every month from its date through the month of its field when its status is one
+# of the statuses, and through this month otherwise
+monthlyMetrics = {
+    "New Listings": ("OnMarketDate", "count", None, None),
+    "Homes for Sale": ("OnMarketDate", "active", "CloseDate", offMarketStatuses),
+    "Pending Sales": ("OnMarketDate", "count", None, ("Pending", "P-Pending Sale")),
+    "Closed Sales": ("CloseDate", "count", None, None),
+    "Dollar Volume": ("CloseDate", "sum", "ClosePrice", None),
+    "Sales Price": ("CloseDate", "median", "ClosePrice", None),
+    "Mean Sales Price": ("CloseDate", "mean", "ClosePrice", None),
+    "Sales Price Std": ("CloseDate", "std", "ClosePrice", None),
+    "Sales Price Count": ("CloseDate", "count", "ClosePrice", None),
+    "Days on Market": ("CloseDate", "median", "DaysOnMarket", None),
+    "Mean Days on Market": ("CloseDate", "mean", "DaysOnMarket", None),
+    "Days on Market Std": ("CloseDate", "std", "DaysOnMarket", None),
+    "Days on Market Count": ("CloseDate", "count", "DaysOnMarket", None),
+    "Original List Price": ("CloseDate", "median", "OriginalListPrice", None),
+    "Price Per Sq Ft": ("CloseDate", "median", "ListPricePerSQFT", None),
+    "Pct of Original Price": ("CloseDate", "mean", ("ClosePrice", "OriginalListPrice"), None),
+    "Pct of Last List Price": ("CloseDate", "mean", ("ClosePrice", "ListPrice"), None),
+}
+# The fields the dashboard's range filters start at the largest value of, see MLS.getFilterOptions
+rangeFilterFields = ("ListPrice", "LotSizeSquareFeet", "ListPricePerSQFT", "YearBuilt")
+dateTruncVersion = (5, 0) # The first MongoDB version with $dateTrunc, older servers get every metric from pandas
+medianVersion = (7, 0) # The first MongoDB version with $median, older servers get the medians from pandas
+
+def monthlyAccumulator(metric: str) -> dict:
+    # The $group accumulator of a metric over the compact schema. Infinite values (a price per square foot of a listing without a building area) are left out like missing ones
+    _, statistic, field, statuses = monthlyMetrics[metric]
+    if field is None:
+        value = 1
+    elif isinstance(field, tuple):
+        numerator, denominator = (f"${listingFields[part][0]}" for part in field)
+        value = {"$cond": [{"$and": [{"$gt": [numerator, 0]}, {"$gt": [denominator, 0]}]}, {"$divide": [numerator, denominator]}, None]}
+        value = {"$cond": [{"$and": [{"$gte": [value, ratioBounds[0]]}, {"$lte": [value, ratioBounds[1]]}]}, value, None]}
+    else:
+        value = f"${listingFields[field][0]}"
+        value = {"$cond": [{"$and": [{"$gt": [value, float("-inf")]}, {"$lt": [value, float("inf")]}]}, value, None]}
+    if statuses:
+        value = {"$cond": [{"$in": [f"${listingFields['StandardStatus'][0]}", list(statuses)]}, value, None]}
+    if statistic == "median":
+        return {"$median": {"input": value, "method": "approximate"}}
+    if statistic == "count" and field is not None:
+        return {"$sum": {"$cond": [{"$eq": [value, None]}, 0, 1]}} # The listings that have the field
+    return {"mean": {"$avg": value}, "std": {"$stdDevSamp": value}}.get(statistic, {"$sum": value})
+
+def monthlyValues(listings: pd.DataFrame, field) -> pd.Series:
+    # The values of a metric's field in pandas, left out the same way monthlyAccumulator leaves them out
+    if isinstance(field, tuple):
+        numerator, denominator = listings[field[0]], listings[field[1]]
+        ratio = (numerator / denominator).where((numerator > 0) & (denominator > 0))
+        return ratio.where((ratio >= ratioBounds[0]) & (ratio <= ratioBounds[1]))
+    return listings[field].replace([np.inf, -np.inf], np.nan)
+
+def countActive(spans: pd.DataFrame, metric: str) -> pd.DataFrame:
+    """The number of listings active each month, from the month each span starts through the month it ends, or through this month
+    when it hasn't ended
+
+    Args:
+        spans (pd.DataFrame): 'start' and 'end' months, whether the listings 'ended', and the 'count' of listings with those
+        metric (str): The name of the count's column
+
+    Returns:
+        pd.DataFrame: A 'Month' column with every month from the first start through this month, and the metric's column
+    """
+    spans = spans.assign(start=pd.to_datetime(spans["start"]), end=pd.to_datetime(spans["end"])).dropna(subset=["start"])
+    spans = spans.loc[~spans["ended"].astype(bool) | (spans["end"] >= spans["start"])] # Ended listings without an end date aren't counted in any month
+    thisMonth = pd.Timestamp.today().to_period("M").to_timestamp()
+    months = pd.date_range(spans["start"].min(), thisMonth, freq="MS", name="Month") if not spans.empty else pd.DatetimeIndex([], name="Month")
+    ended = spans.loc[spans["ended"].astype(bool)]
+    starts = spans.groupby("start")["count"].sum().reindex(months, fill_value=0)
+    ends = ended.groupby(ended["end"] + pd.DateOffset(months=1))["count"].sum().reindex(months, fill_value=0)
+    return (starts - ends).cumsum().rename(metric).reset_index()
+
+def applyFilters(listings: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    # The listings that pass aggregateMonthly's filters
+    for field, allowed in filters.items():
+        if isinstance(allowed, tuple):
+            listings = listings.loc[(listings[field] >= allowed[0]) & (listings[field] <= allowed[1])]
+        else:
+            listings = listings.loc[listings[field].isin(allowed)]
+    return listings
+
+def monthlyFromListings(listings: pd.DataFrame, metrics: Sequence[str]) -> pd.DataFrame:
+    # The monthly metrics computed in pandas, for servers and collections the database can't compute them from
+    if listings is None or listings.empty:
+        return pd.DataFrame(columns=["Month", *metrics])
+    columns = []
+    for metric in metrics:
+        dateField, statistic, field, statuses = monthlyMetrics[metric]
+        if statistic == "active":
+            spans = pd.DataFrame({
+                "start": listings[dateField].dt.to_period("M").dt.to_timestamp(),
+                "end": listings[field].dt.to_period("M").dt.to_timestamp(),
+                "ended": listings["StandardStatus"].isin(statuses),
+                "count": 1,
+            })
+            columns.append(countActive(spans, metric).set_index("Month")[metric])
+            continue
+        selected = listings.loc[listings["StandardStatus"].isin(statuses)] if statuses else listings
+        months = selected[dateField].dt.to_period("M").dt.to_timestamp().rename("Month")
+        if field is None:
+            column = selected.groupby(months).size()
+        else:
+            column = getattr(monthlyValues(selected, field).groupby(months), statistic)()
+        columns.append(column.rename(metric))
+    return pd.concat(columns, axis=1).rename_axis("Month").reset_index()
+
+def expandListings(listings: pd.DataFrame) -> pd.DataFrame:
+    # Listings read from cleanCollection with their RESO field names, and every field, even the ones none of them had
+    listings = listings.rename(columns={short: field for field, (short, _) in listingFields.items()})
+    for field, (_, kind) in listingFields.items():
+        if field not in listings:
+            listings[field] = np.nan if kind is float else None
+    return listings
 
 class MLS:
-    def __init__(self, state: str, stateMLSName: str, fieldConversions: dict, database: str, collection: str, client: MongoClient, counties: Sequence = None, cities: Sequence = None, zips: Sequence = None, fixListings: Callable = None):
+    # Whether the listings' county field can be used to build the geography index. When it can, county queries go straight to
+    # that field: it's indexed and exact, while the geography index only knows the cities and zip codes of its last build.
+    # Only CaliforniaMLS resolves county queries through the index, because Paragon listings have no county to query
+    countyFieldReliable = True
+
+    def __init__(self, state: str, stateMLSName: str, fieldConversions: dict, database: str, collection: str, client: MongoClient, counties: Sequence = None, cities: Sequence = None, zips: Sequence = None, fixListings: Callable = None, geography: GeographyIndex = None, versions: DataVersions = None, keyField: str = None, metadata: bool = True):
         """Construct an MLS object with all the functionality to return what State, Counties, Cities, and Zip Codes
             this MLS covers, as well as return standardized listings based on queries for County, City, or Zip Code
 
@@ -36,6 +216,10 @@ class MLS:
             cities (Sequence, optional): Default list of cities to return
             zips (Sequence, optional): Default list of zip codes to return
             fixListings (Callable, optional): A function that takes a Sequence of listings and returns the same Sequence of listings with fields filled in and erronius fields nullified, on an MLS specific basis
+            geography (GeographyIndex, optional): The County -> City -> Zip code hierarchy for this MLS. Defaults to the one stored in the 'geography' collection for this state
+            versions (DataVersions, optional): Tracks when the collection changes, the caches of this MLS are keyed on its version. Defaults to the one shared by every MLS using client
+            keyField (str, optional): The field the sync identifies listings by, which the cleaned listings are identified by too. Defaults to None, listings of this MLS aren't cleaned by the ETL.
+            metadata (bool, optional): Read the counties, cities and zip codes now. The ETL only cleans listings with its MLSs, so it skips this. Defaults to True.
         """
         startTime = time.time()
         self.state = state
@@ -43,31 +227,49 @@ class MLS:
         self.counties = counties
         self.cities = cities
         self.zips = zips
+        self.defaultCounties = counties
+        self.defaultZips = zips
         self.fieldConversions = fieldConversions
         self.database = database
         self.collection = collection
         self.fixListings = fixListings
         self.client = client
+        self.geography = geography if geography else GeographyIndex(client, state)
+        self.versions = versions if versions else getDataVersions(client)
+        self.cachedVersion = None # The published data version the counties, cities and zip codes were read at
+        self.listingsCache = collections.OrderedDict()
+        self.listingsLock = threading.Lock()
+        self.keyField = keyField
+        self.cleanAvailable = False # Whether cleanCollection has all of this MLS's listings, checked with the metadata
+        self.serverVersion = None # The MongoDB server's version, read the first time a monthly aggregation needs it
 
         self.fieldConversionsReversed = {v: k for k, v in fieldConversions.items()}
         self.requestFields = tuple(set(fieldConversions.values())) #Convert to set first to cull diplicates
-        self.checkCache()
+        if metadata:
+            self.checkCache()
         print(f"Initializing {self.state} took {round(time.time()-startTime, 5)} seconds.")
 
+    def dataVersion(self) -> tuple:
+        # Changes whenever the ETL writes to this MLS's collection
+        return self.versions.version(self.database, self.collection)
+
     def checkCache(self):
-        # See if cache exists for this state and if it is recent enough to be valid , cacheValidDays = 60 days
+        # See if cache exists for this state and if it was made from the current version of the data. MLSs whose syncs don't publish versions fall back to cacheValidDays = 60 days
+        published = self.dataVersion()[0]
         try:
             with open(f'{self.state}.json') as json_file:
                 cache = json.load(json_file)
-                if not cache.get("timestamp") or not datetime.fromtimestamp(cache.get("timestamp")) > (datetime.today() - timedelta(cacheValidDays)):
+                if cache.get("version", 0) != published or (not published and (not cache.get("timestamp") or not datetime.fromtimestamp(cache.get("timestamp")) > (datetime.today() - timedelta(cacheValidDays)))):
                     cache = None
-        except FileNotFoundError:
+        except (FileNotFoundError, ValueError):
             cache = None
 
         # Populate fields either from cache or database
-        self.counties = self.counties if self.counties else cache.get("counties") if cache and "counties" in cache else self.getCounties()
+        self.counties = self.defaultCounties if self.defaultCounties else cache.get("counties") if cache and "counties" in cache else self.getCounties()
         self.citiesCount = cache.get("citiesCount") if cache and "citiesCount" in cache else self.getCitiesCount()
-        self.zips = self.zips if self.zips else cache.get("zips") if cache and "zips" in cache else self.getZipCodes()
+        self.zips = self.defaultZips if self.defaultZips else cache.get("zips") if cache and "zips" in cache else self.getZipCodes()
+        self.cachedVersion = published
+        self.cleanAvailable = self.backfilled()
 
         # Update Cache
         with open(f'{self.state}.json', 'w') as outfile:
@@ -75,6 +277,7 @@ class MLS:
             json.dump(
                 {
                     'timestamp': timestamp,
+                    'version': published,
                     'counties': self.counties,
                     'citiesCount': self.citiesCount,
                     'zips': self.zips
@@ -91,10 +294,183 @@ class MLS:
                 tuple(daysOnMarket)
         ))
 
+    def refresh(self) -> None:
+        # Read the counties, cities and zip codes again if the ETL published a new version of the data since they were read
+        if self.dataVersion()[0] != self.cachedVersion:
+            self.checkCache()
+
+    def cached(self, key: tuple, fetch: Callable) -> pd.DataFrame:
+        # Results are remembered until the collection changes. Callers get a copy, so filtering them doesn't change the cache
+        key = (*key, self.dataVersion())
+        with self.listingsLock: # Every streamlit session shares the MLS objects
+            cached = key in self.listingsCache
+            if cached:
+                self.listingsCache.move_to_end(key)
+                result = self.listingsCache[key]
+        if not cached:
+            result = fetch()
+            with self.listingsLock:
+                self.listingsCache[key] = result
+                while len(self.listingsCache) > listingsCacheSize:
+                    self.listingsCache.popitem(last=False)
+        return result.copy() if result is not None else None
+
     def getListings(self, queryField: str, targetUnits: Sequence[str]) -> pd.DataFrame:
+        return self.cached(
+            (queryField, tuple(targetUnits) if targetUnits else None),
+            lambda: self.fetchListings(queryField, targetUnits)
+        )
+
+    def aggregateMonthly(self, queryField: str, targetUnits: Sequence[str], filters: dict = None, metrics: Sequence[str] = None) -> pd.DataFrame:
+        """Chart metrics per month of the listings in targetUnits. The database groups the listings by month when it can,
+            so only a row per month comes back instead of every listing
+
+        Args:
+            queryField (str): 'CountyOrParish', 'City' or 'PostalCode'
+            targetUnits (Sequence[str]): The counties, cities or zip codes to include
+            filters (dict, optional): RESO fields keyed to a list of values the field has to be one of, or a (min, max) tuple the field has to be between. Defaults to None.
+            metrics (Sequence[str], optional): Keys of monthlyMetrics. Defaults to every metric.
+
+        Returns:
+            pd.DataFrame: A 'Month' column with the first day of each month, and a column for each metric
+        """
+        filters = filters if filters else {}
+        metrics = tuple(metrics) if metrics else tuple(monthlyMetrics)
+        return self.cached(
+            ("monthly", queryField, tuple(targetUnits), tuple(sorted((field, tuple(allowed), isinstance(allowed, tuple)) for field, allowed in filters.items())), metrics),
+            lambda: self.fetchMonthly(queryField, targetUnits, filters, metrics)
+        )
+
+    def getFilterOptions(self, queryField: str, targetUnits: Sequence[str]) -> dict:
+        """The values the dashboard's filters can take for the listings in targetUnits. The database finds them when it has the
+            listings cleaned, so the listings aren't loaded to build the filters
+
+        Args:
+            queryField (str): 'CountyOrParish', 'City' or 'PostalCode'
+            targetUnits (Sequence[str]): The counties, cities or zip codes to include
+
+        Returns:
+            dict: The 'count' of listings, the 'PropertyType' and 'StandardStatus' values present, and the largest value of each of rangeFilterFields, None when no listing has one. YearBuilt is a year
+        """
+        return self.cached(
+            ("filterOptions", queryField, tuple(targetUnits)),
+            lambda: self.fetchFilterOptions(queryField, targetUnits)
+        )
+
+    def fetchFilterOptions(self, queryField: str, targetUnits: Sequence[str]) -> dict:
+        if self.cleanAvailable:
+            group = {"_id": None, "count": {"$sum": 1}}
+            for field in ("PropertyType", "StandardStatus"):
+                group[field] = {"$addToSet": f"${listingFields[field][0]}"}
+            for field in rangeFilterFields:
+                value = f"${listingFields[field][0]}"
+                group[field] = {"$max": value if listingFields[field][1] is datetime else {"$cond": [{"$lt": [value, float("inf")]}, value, None]}}
+            rows = list(self.client[cleanDatabase][cleanCollection].aggregate([
+                {"$match": {cleanMLSField: self.state, listingFields[queryField][0]: {"$in": list(targetUnits)}}},
+                {"$group": group}
+            ]))
+            options = rows[0] if rows else {"count": 0}
+            options.pop("_id", None)
+        else:
+            listings = self.getListings(queryField, targetUnits)
+            if listings is None or listings.empty:
+                options = {"count": 0}
+            else:
+                options = {"count": len(listings)}
+                for field in ("PropertyType", "StandardStatus"):
+                    options[field] = list(listings[field].dropna().unique())
+                for field in rangeFilterFields:
+                    largest = listings[field].replace([np.inf, -np.inf], np.nan).max()
+                    options[field] = None if pd.isna(largest) else largest
+        for field in ("PropertyType", "StandardStatus"):
+            options[field] = sorted(filter(bool, options.get(field, [])))
+        for field in rangeFilterFields:
+            options.setdefault(field, None)
+        if isinstance(options["YearBuilt"], datetime):
+            options["YearBuilt"] = options["YearBuilt"].year
+        return options
+
+    def backfilled(self) -> bool:
+        # Whether a rebuild with the current cleaning finished for this MLS. The syncs clean each batch they write, so before that cleanCollection only has the listings synced since the ETL started cleaning
+        if not self.keyField:
+            return False
+        marker = self.client[cleanDatabase][cleanBackfills].find_one({"_id": self.state})
+        return marker is not None and marker.get("version") == cleanVersion
+
+    def fetchMonthly(self, queryField: str, targetUnits: Sequence[str], filters: dict, metrics: Sequence[str]) -> pd.DataFrame:
+        startTime = time.time()
+        if self.cleanAvailable and self.serverVersion is None:
+            self.serverVersion = tuple(self.client.server_info().get("versionArray", (0,)))
+        version = self.serverVersion if self.cleanAvailable else (0,) # Raw collections don't have the dates as dates to group by
+        inDatabase = [metric for metric in metrics if version >= dateTruncVersion and (monthlyMetrics[metric][1] != "median" or version >= medianVersion)]
+        inPandas = [metric for metric in metrics if metric not in inDatabase]
+        monthly = []
+        if inDatabase:
+            monthly.append(self.aggregateInDatabase(queryField, targetUnits, filters, inDatabase))
+        if inPandas:
+            monthly.append(monthlyFromListings(applyFilters(self.getListings(queryField, targetUnits), filters), inPandas))
+        monthly = functools.reduce(lambda left, right: left.merge(right, on="Month", how="outer"), monthly)
+        print("Monthly aggregation took", time.time()-startTime, "seconds.")
+        return monthly.sort_values("Month").reset_index(drop=True)
+
+    def aggregateInDatabase(self, queryField: str, targetUnits: Sequence[str], filters: dict, metrics: Sequence[str]) -> pd.DataFrame:
+        # One $match + $group by month per date field the metrics are grouped by
+        match = {cleanMLSField: self.state, listingFields[queryField][0]: {"$in": list(targetUnits)}}
+        for field, allowed in filters.items():
+            match[listingFields[field][0]] = {"$gte": allowed[0], "$lte": allowed[1]} if isinstance(allowed, tuple) else {"$in": list(allowed)}
+        byDate = collections.defaultdict(list)
+        monthly = []
+        for metric in metrics:
+            if monthlyMetrics[metric][1] == "active":
+                monthly.append(self.aggregateActive(match, metric))
+            else:
+                byDate[monthlyMetrics[metric][0]].append(metric)
+        for dateField, dateMetrics in byDate.items():
+            date = listingFields[dateField][0]
+            group = {"_id": {"$dateTrunc": {"date": f"${date}", "unit": "month"}}}
+            group.update({metric: monthlyAccumulator(metric) for metric in dateMetrics})
+            rows = list(self.client[cleanDatabase][cleanCollection].aggregate([
+                {"$match": {**match, date: {"$type": "date"}}},
+                {"$group": group}
+            ]))
+            monthly.append(pd.DataFrame(rows, columns=["_id", *dateMetrics]).rename(columns={"_id": "Month"}))
+        monthly = functools.reduce(lambda left, right: left.merge(right, on="Month", how="outer"), monthly)
+        monthly["Month"] = pd.to_datetime(monthly["Month"])
+        return monthly
+
+    def aggregateActive(self, match: dict, metric: str) -> pd.DataFrame:
+        # The database counts the listings of each start and end month, and countActive spreads each count over its months
+        dateField, _, field, statuses = monthlyMetrics[metric]
+        date, end = listingFields[dateField][0], listingFields[field][0]
+        rows = self.client[cleanDatabase][cleanCollection].aggregate([
+            {"$match": {**match, date: {"$type": "date"}}},
+            {"$group": {
+                "_id": {
+                    "start": {"$dateTrunc": {"date": f"${date}", "unit": "month"}},
+                    "end": {"$cond": [{"$eq": [{"$type": f"${end}"}, "date"]}, {"$dateTrunc": {"date": f"${end}", "unit": "month"}}, None]},
+                    "ended": {"$in": [f"${listingFields['StandardStatus'][0]}", list(statuses)]},
+                },
+                "count": {"$sum": 1}
+            }}
+        ])
+        spans = pd.DataFrame([{**row["_id"], "count": row["count"]} for row in rows], columns=["start", "end", "ended", "count"])
+        return countActive(spans, metric)
+
+    def fetchListings(self, queryField: str, targetUnits: Sequence[str]) -> pd.DataFrame:
         startTime = time.time() # So that we can display the amount of time this method takes to run
 
         if queryField and targetUnits:
+            if self.cleanAvailable:
+                # The ETL already normalized these listings into the compact schema
+                listings = pd.DataFrame(iter(self.client[cleanDatabase][cleanCollection].find(filter={
+                    cleanMLSField: self.state,
+                    listingFields[queryField][0]: {"$in": list(targetUnits)}
+                }, projection={cleanMLSField: 0})))
+                if not listings.empty:
+                    listings = typeListings(expandListings(listings))
+                    print("Listings fetch took", time.time()-startTime, "seconds.")
+                return listings
+
             filter = {
                 self.fieldConversions["StateOrProvince"]: self.stateMLSName,
                 self.fieldConversions[queryField]: {"$in": targetUnits}
@@ -105,56 +481,47 @@ class MLS:
 
             listings = pd.DataFrame(iter(self.client[self.database][self.collection].find(filter=filter, projection=projection)))
             if not listings.empty:
-                # Translate columns to RESO format
-                listings.rename(columns=self.fieldConversionsReversed, inplace=True)
-                # Clean the listings (MLS non-specific)
-                for field in tuple(self.fieldConversions):
-                    if field not in listings:
-                        listings[field] = None
-                listings.loc[listings["OnMarketDate"].isin(("1800-01-01", "1900-01-01")), "OnMarketDate"] = pd.to_datetime(listings["CloseDate"]) - pd.to_timedelta(listings["DaysOnMarket"]) # CJMLS Specific but won't affect other MLSs
-                listings.loc[listings["OffMarketDate"].isna(), "OffMarketDate"] = listings["CloseDate"] 
-                listings.loc[listings["CloseDate"].isna(), "CloseDate"] = listings["OffMarketDate"]
-                if "ExpirationDate" in listings:
-                    listings.loc[listings["CloseDate"].isna(), "CloseDate"] = listings["ExpirationDate"] 
-                listings.loc[lambda listings: listings["CloseDate"].isna() & ~listings["OnMarketDate"].isna() & ~listings["DaysOnMarket"].isna(), "CloseDate"] = pd.to_datetime(listings["OnMarketDate"], utc=True) + pd.to_timedelta(listings["DaysOnMarket"]) # Using utc=True is not correct for some of the MLSs, but for the streamlit dashboard this isn't important
-                listings.loc[lambda listings: listings["OnMarketDate"].isna() & ~listings["CloseDate"].isna() & ~listings["DaysOnMarket"].isna(), "OnMarketDate"] = pd.to_datetime(listings["CloseDate"], utc=True) - pd.to_timedelta(listings["DaysOnMarket"])
-                listings.loc[lambda listings: listings["DaysOnMarket"].isna() & ~listings["OnMarketDate"].isna() & ~listings["CloseDate"].isna(), "DaysOnMarket"] = pd.to_timedelta(pd.to_datetime(listings["CloseDate"], utc=True) - pd.to_datetime(listings["OnMarketDate"], utc=True)).dt.days
-                listings.DaysOnMarket = listings.DaysOnMarket.astype(float)
-                
-                listings.loc[listings["BuildingAreaTotal"] == 0, "BuildingAreaTotal"] = np.nan # Replace 0 values with None
-                if "ListPricePerSQFT" in listings:
-                    listings.loc[lambda l: l["ListPricePerSQFT"].isna() & ~l["ListPrice"].isna() & ~l["BuildingAreaTotal"].isna(), "ListPricePerSQFT"] = listings["ListPrice"].astype('str').replace("None", "nan").astype('float') / listings["BuildingAreaTotal"].astype('str').replace("None", "nan").astype('float')
-                else:
-                    listings["ListPricePerSQFT"] = listings["ListPrice"].astype('str').replace("None", "nan").astype('float') / listings["BuildingAreaTotal"].astype('str').replace("None", "nan").astype('float')
-                if "LotSizeSquareFeet" in listings:
-                    listings.loc[lambda l: l["LotSizeSquareFeet"].isna() & ~l["BuildingAreaTotal"].isna() , "LotSizeSquareFeet"] = listings["BuildingAreaTotal"]
-                else:   
-                    listings["LotSizeSquareFeet"] = listings["BuildingAreaTotal"]
-                if "BathroomsFull" in listings and "BathroomsHalf" in listings:
-                    if "BathroomsTotalDecimal" in listings:
-                        listings.loc[lambda l: l["BathroomsTotalDecimal"].isna() & ~l["BathroomsFull"].isna() & ~l["BathroomsHalf"].isna(), "BathroomsTotalDecimal"] = listings["BathroomsFull"] + .5 * listings["BathroomsHalf"]
-                    else:
-                        listings["BathroomsTotalDecimal"] = listings["BathroomsFull"] + .5 * listings["BathroomsHalf"]
-                # Clean the listings (MLS specific)
-                listings = self.fixListings(listings) if self.fixListings else listings
-                
-                # Fix field formatting
-                if (listings is not None) and (not listings.empty):
-                    # Make date fields datetimes
-                    for field in ['OnMarketDate', 'CloseDate', 'OffMarketDate', 'YearBuilt']:
-                        if field in listings.columns:
-                            listings[field] = pd.to_datetime(listings[field], utc=True) # mabelo: added errors='coerce'
-                            # mabelo edit 2024: astype does not work with datetime64, need to use tz_convert
-                            #listings[field] = listings[field].astype('datetime64[ns]') # get rid of any timezone
-                            listings[field] = listings[field].dt.tz_convert('UTC').dt.tz_localize(None)
-                            listings[field].dt.tz_localize(None)
-                    # Make Decimal128 fields floats
-                    for field in ['ListPrice', 'ClosePrice', 'ListPricePerSQFT', 'Latitude', 'Longitude', 'LotSizeSquareFeet', 'OriginalListPrice', 'BuildingAreaTotal']:
-                        if field in listings.columns:
-                            listings[field] = listings[field].astype('str').replace("None", "nan").astype('float')
+                listings = self.cleanListings(listings)
                 print("Listings fetch took", time.time()-startTime, "seconds.")
             return listings
 
+    def cleanListings(self, listings: pd.DataFrame) -> pd.DataFrame:
+        # Normalize listings as they are stored by this MLS's sync into RESO fields with consistent types. Used on read, and by the ETL to fill cleanCollection
+        # Translate columns to RESO format
+        listings.rename(columns=self.fieldConversionsReversed, inplace=True)
+        # Clean the listings (MLS non-specific)
+        for field in tuple(self.fieldConversions):
+            if field not in listings:
+                listings[field] = None
+        listings.loc[listings["OnMarketDate"].isin(("1800-01-01", "1900-01-01")), "OnMarketDate"] = pd.to_datetime(listings["CloseDate"]) - pd.to_timedelta(listings["DaysOnMarket"]) # CJMLS Specific but won't affect other MLSs
+        listings.loc[listings["OffMarketDate"].isna(), "OffMarketDate"] = listings["CloseDate"] 
+        listings.loc[listings["CloseDate"].isna(), "CloseDate"] = listings["OffMarketDate"]
+        if "ExpirationDate" in listings:
+            listings.loc[listings["CloseDate"].isna(), "CloseDate"] = listings["ExpirationDate"] 
+        listings.loc[lambda listings: listings["CloseDate"].isna() & ~listings["OnMarketDate"].isna() & ~listings["DaysOnMarket"].isna(), "CloseDate"] = pd.to_datetime(listings["OnMarketDate"], utc=True) + pd.to_timedelta(listings["DaysOnMarket"]) # Using utc=True is not correct for some of the MLSs, but for the streamlit dashboard this isn't important
+        listings.loc[lambda listings: listings["OnMarketDate"].isna() & ~listings["CloseDate"].isna() & ~listings["DaysOnMarket"].isna(), "OnMarketDate"] = pd.to_datetime(listings["CloseDate"], utc=True) - pd.to_timedelta(listings["DaysOnMarket"])
+        listings.loc[lambda listings: listings["DaysOnMarket"].isna() & ~listings["OnMarketDate"].isna() & ~listings["CloseDate"].isna(), "DaysOnMarket"] = pd.to_timedelta(pd.to_datetime(listings["CloseDate"], utc=True) - pd.to_datetime(listings["OnMarketDate"], utc=True)).dt.days
+        listings.DaysOnMarket = listings.DaysOnMarket.astype(float)
+        
+        listings.loc[listings["BuildingAreaTotal"] == 0, "BuildingAreaTotal"] = np.nan # Replace 0 values with None
+        if "ListPricePerSQFT" in listings:
+            listings.loc[lambda l: l["ListPricePerSQFT"].isna() & ~l["ListPrice"].isna() & ~l["BuildingAreaTotal"].isna(), "ListPricePerSQFT"] = listings["ListPrice"].astype('str').replace("None", "nan").astype('float') / listings["BuildingAreaTotal"].astype('str').replace("None", "nan").astype('float')
+        else:
+            listings["ListPricePerSQFT"] = listings["ListPrice"].astype('str').replace("None", "nan").astype('float') / listings["BuildingAreaTotal"].astype('str').replace("None", "nan").astype('float')
+        if "LotSizeSquareFeet" in listings:
+            listings.loc[lambda l: l["LotSizeSquareFeet"].isna() & ~l["BuildingAreaTotal"].isna() , "LotSizeSquareFeet"] = listings["BuildingAreaTotal"]
+        else:   
+            listings["LotSizeSquareFeet"] = listings["BuildingAreaTotal"]
+        if "BathroomsFull" in listings and "BathroomsHalf" in listings:
+            if "BathroomsTotalDecimal" in listings:
+                listings.loc[lambda l: l["BathroomsTotalDecimal"].isna() & ~l["BathroomsFull"].isna() & ~l["BathroomsHalf"].isna(), "BathroomsTotalDecimal"] = listings["BathroomsFull"] + .5 * listings["BathroomsHalf"]
+            else:
+                listings["BathroomsTotalDecimal"] = listings["BathroomsFull"] + .5 * listings["BathroomsHalf"]
+        # Clean the listings (MLS specific)
+        listings = self.fixListings(listings) if self.fixListings else listings
+        
+        return typeListings(listings)
+
     def getCounties(self) -> Sequence[str]:
         return sorted(filter(bool, list(self.client[self.database][self.collection].distinct(
             self.fieldConversions["CountyOrParish"],
@@ -177,27 +544,23 @@ class MLS:
         return sorted(list(filter(lambda x: x and len(x) == 5 and x.isnumeric(), zipCodes)))
 
 class CaliforniaMLS(MLS):
-    caCounties = {'San Bernardino': ['Adelanto', 'Apple Valley', 'Barstow', 'Big Bear Lake', 'Chino', 'Chino Hills', 'Colton', 'Fontana', 'Grand Terrace', 'Hesperia', 'Highland', 'Loma Linda', 'Montclair', 'Needles', 'Ontario', 'Rancho Cucamonga', 'Redlands', 'Rialto', 'San Bernardino', 'Twentynine Palms', 'Upland', 'Victorville', 'Yucaipa', 'Yucca Valley'], 'Los Angeles': ['Agoura Hills', 'Alhambra', 'Arcadia', 'Artesia', 'Avalon', 'Azusa', 'Baldwin Park', 'Bell', 'Bell Gardens', 'Bellflower', 'Beverly Hills', 'Bradbury', 'Burbank', 'Calabasas', 'Carson', 'Cerritos', 'Claremont', 'Commerce', 'Compton', 'Covina', 'Cudahy', 'Culver City', 'Diamond Bar', 'Downey', 'Duarte', 'El Monte', 'El Segundo', 'Gardena', 'Glendale', 'Glendora', 'Hawaiian Gardens', 'Hawthorne', 'Hermosa Beach', 'Hidden Hills', 'Huntington Park', 'Industry', 'Inglewood', 'Irwindale', 'La Cañada Flintridge', 'La Habra Heights', 'La Mirada', 'La Puente', 'La Verne', 'Lakewood', 'Lancaster', 'Lawndale', 'Lomita', 'Long Beach', 'Los Angeles', 'Lynwood', 'Malibu', 'Manhattan Beach', 'Maywood', 'Monrovia', 'Montebello', 'Monterey Park', 'Norwalk', 'Palmdale', 'Palos Verdes Estates', 'Paramount', 'Pasadena', 'Pico Rivera', 'Pomona', 'Rancho Palos Verdes', 'Redondo Beach', 'Rolling Hills', 'Rolling Hills Estates', 'Rosemead', 'San Dimas', 'San Fernando', 'San Gabriel', 'San Marino', 'Santa Clarita', 'Santa Fe Springs', 'Santa Monica', 'Sierra Madre', 'Signal Hill', 'South El Monte', 'South Gate', 'South Pasadena', 'Temple City', 'Torrance', 'Vernon', 'Walnut', 'West Covina', 'West Hollywood', 'Westlake Village', 'Whittier'], 'Alameda': ['Alameda', 'Albany', 'Berkeley', 'Dublin', 'Emeryville', 'Fremont', 'Hayward', 'Livermore', 'Newark', 'Oakland', 'Piedmont', 'Pleasanton', 'San Leandro', 'Union City'], 'Orange': ['Aliso Viejo', 'Anaheim', 'Brea', 'Buena Park', 'Costa Mesa', 'Cypress', 'Dana Point', 'Fountain Valley', 'Fullerton', 'Garden Grove', 'Huntington Beach', 'Irvine', 'La Habra', 'La Palma', 'Laguna Beach', 'Laguna Hills', 'Laguna Niguel', 'Laguna Woods', 'Lake Forest', 'Los Alamitos', 'Mission Viejo', 'Newport Beach', 'Orange', 'Placentia', 'Rancho Santa Margarita', 'San Clemente', 'San Juan Capistrano', 'Santa Ana', 'Seal Beach', 'Stanton', 'Tustin', 'Villa Park', 'Westminster', 'Yorba Linda'], 'Modoc': ['Alturas'], 'Amador': ['Amador City', 'Ione', 'Jackson', 'Plymouth', 'Sutter Creek'], 'Napa': ['American Canyon', 'Calistoga', 'Napa', 'St. Helena', 'Yountville'], 'Shasta': ['Anderson', 'Redding', 'Shasta Lake'], 'Calaveras': ['Angels Camp'], 'Contra Costa': ['Antioch', 'Brentwood', 'Clayton', 'Concord', 'Danville', 'El Cerrito', 'Hercules', 'Lafayette', 'Martinez', 'Moraga', 'Oakley', 'Orinda', 'Pinole', 'Pittsburg', 'Pleasant Hill', 'Richmond', 'San Pablo', 'San Ramon', 'Walnut Creek'], 'Humboldt': ['Arcata', 'Blue Lake', 'Eureka', 'Ferndale', 'Fortuna', 'Rio Dell', 'Trinidad'], 'San Luis Obispo': ['Arroyo Grande', 'Atascadero', 'Grover Beach', 'Morro Bay', 'Paso Robles', 'Pismo Beach', 'San Luis Obispo'], 'Kern': ['Arvin', 'Bakersfield', 'California City', 'Delano', 'Maricopa', 'McFarland', 'Ridgecrest', 'Shafter', 'Taft', 'Tehachapi', 'Wasco'], 'San Mateo': ['Atherton', 'Belmont', 'Brisbane', 'Burlingame', 'Colma', 'Daly City', 'East Palo Alto', 'Foster City', 'Half Moon Bay', 'Hillsborough', 'Menlo Park', 'Millbrae', 'Pacifica', 'Portola Valley', 'Redwood City', 'San Bruno', 'San Carlos', 'San Mateo', 'South San Francisco', 'Woodside'], 'Merced': ['Atwater', 'Dos Palos', 'Gustine', 'Livingston', 'Los Banos', 'Merced'], 'Placer': ['Auburn', 'Colfax', 'Lincoln', 'Loomis', 'Rocklin', 'Roseville'], 'Kings': ['Avenal', 'Corcoran', 'Hanford', 'Lemoore'], 'Riverside': ['Banning', 'Beaumont', 'Blythe', 'Calimesa', 'Canyon Lake', 'Cathedral City', 'Coachella', 'Corona', 'Desert Hot Springs', 'Eastvale', 'Hemet', 'Indian Wells', 'Indio', 'Jurupa Valley', 'La Quinta', 'Lake Elsinore', 'Menifee', 'Moreno Valley', 'Murrieta', 'Norco', 'Palm Desert', 'Palm Springs', 'Perris', 'Rancho Mirage', 'Riverside', 'San Jacinto', 'Temecula', 'Wildomar'], 'Marin': ['Belvedere', 'Corte Madera', 'Fairfax', 'Larkspur', 'Mill Valley', 'Novato', 'Ross', 'San Anselmo', 'San Rafael', 'Sausalito', 'Tiburon'], 'Solano': ['Benicia', 'Dixon', 'Fairfield', 'Rio Vista', 'Suisun City', 'Vacaville', 'Vallejo'], 'Butte': ['Biggs', 'Chico', 'Gridley', 'Oroville', 'Paradise'], 'Inyo': ['Bishop'], 'Imperial': ['Brawley', 'Calexico', 'Calipatria', 'El Centro', 'Holtville', 'Imperial', 'Westmorland'], 'Santa Barbara': ['Buellton', 'Carpinteria', 'Goleta', 'Guadalupe', 'Lompoc', 'Santa Barbara', 'Santa Maria', 'Solvang'], 'Ventura': ['Camarillo', 'Fillmore', 'Moorpark', 'Ojai', 'Oxnard', 'Port Hueneme', 'Santa Paula', 'Simi Valley', 'Thousand Oaks', 'Ventura'], 'Santa Clara': ['Campbell', 'Cupertino', 'Gilroy', 'Los Altos', 'Los Altos Hills', 'Los Gatos', 'Milpitas', 'Monte Sereno', 'Morgan Hill', 'Mountain View', 'Palo Alto', 'San Jose', 'Santa Clara', 'Saratoga', 'Sunnyvale'], 'Santa Cruz': ['Capitola', 'Santa Cruz', 'Scotts Valley', 'Watsonville'], 'San Diego': ['Carlsbad', 'Chula Vista', 'Coronado', 'Del Mar', 'El Cajon', 'Encinitas', 'Escondido', 'Imperial Beach', 'La Mesa', 'Lemon Grove', 'National City', 'Oceanside', 'Poway', 'San Diego', 'San Marcos', 'Santee', 'Solana Beach', 'Vista'], 'Monterey': ['Carmel-by-the-Sea', 'Del Rey Oaks', 'Gonzales', 'Greenfield', 'King City', 'Marina', 'Monterey', 'Pacific Grove', 'Salinas', 'Sand City', 'Seaside', 'Soledad'], 'Stanislaus': ['Ceres', 'Hughson', 'Modesto', 'Newman', 'Oakdale', 'Patterson', 'Riverbank', 'Turlock', 'Waterford'], 'Madera': ['Chowchilla', 'Madera'], 'Sacramento': ['Citrus Heights', 'Elk Grove', 'Folsom', 'Galt', 'Isleton', 'Rancho Cordova', 'Sacramento'], 'Lake': ['Clearlake', 'Lakeport'], 'Sonoma': ['Cloverdale', 'Cotati', 'Healdsburg', 'Petaluma', 'Rohnert Park', 'Santa Rosa', 'Sebastopol', 'Sonoma', 'Windsor'], 'Fresno': ['Clovis', 'Coalinga', 'Firebaugh', 'Fowler', 'Fresno', 'Huron', 'Kerman', 'Kingsburg', 'Mendota', 'Orange Cove', 'Parlier', 'Reedley', 'San Joaquin', 'Sanger', 'Selma'], 'Colusa': ['Colusa', 'Williams'], 'Tehama': ['Corning', 'Red Bluff', 'Tehama'], 'Del Norte': ['Crescent City'], 'Yolo': ['Davis', 'West Sacramento', 'Winters', 'Woodland'], 'Tulare': ['Dinuba', 'Exeter', 'Farmersville', 'Lindsay', 'Porterville', 'Tulare', 'Visalia', 'Woodlake'], 'Siskiyou': ['Dorris', 'Dunsmuir', 'Etna', 'Fort Jones', 'Montague', 'Mount Shasta', 'Tulelake', 'Weed', 'Yreka'], 'San Joaquin': ['Escalon', 'Lathrop', 'Lodi', 'Manteca', 'Ripon', 'Stockton', 'Tracy'], 'Mendocino': ['Fort Bragg', 'Point Arena', 'Ukiah', 'Willits'], 'Nevada': ['Grass Valley', 'Nevada City', 'Truckee'], 'San Benito': ['Hollister', 'San Juan Bautista'], 'Sutter': ['Live Oak', 'Yuba City'], 'Sierra': ['Loyalton'], 'Mono': ['Mammoth Lakes'], 'Yuba': ['Marysville', 'Wheatland'], 'Glenn': ['Orland', 'Willows'], 'El Dorado': ['Placerville', 'South Lake Tahoe'], 'Plumas': ['Portola'], 'San Francisco': ['San Francisco'], 'Tuolumne': ['Sonora'], 'Lassen': ['Susanville']}
+    countyFieldReliable = False # Paragon listings have no usable county field, so counties are resolved through the geography index
     def getListings(self, queryField: str, targetUnits: Sequence[str]) -> pd.DataFrame:
-        # If california is queried by county we just translate the counties to a sequence of cities within those counties, because the listings don't have a reliable county field
-        startTime = time.time()
-        if queryField == "CountyOrParish":
-            cities = []
-            for county in targetUnits:
-                cities += self.caCounties[county]
-            cities = tuple(map(
-                lambda x: x.upper(),
-                cities
-            ))
-            queryField = "City"
-            targetUnits = cities
+        # If california is queried by county we translate the counties to the zip codes (or cities) within those counties, because the listings don't have a reliable county field
+        queryField, targetUnits = self.geography.resolve(queryField, targetUnits)
         return super().getListings(queryField, targetUnits)
 
-def getMLSs() -> dict:
+    def aggregateMonthly(self, queryField: str, targetUnits: Sequence[str], filters: dict = None, metrics: Sequence[str] = None) -> pd.DataFrame:
+        queryField, targetUnits = self.geography.resolve(queryField, targetUnits)
+        return super().aggregateMonthly(queryField, targetUnits, filters, metrics)
+
+    def getFilterOptions(self, queryField: str, targetUnits: Sequence[str]) -> dict:
+        queryField, targetUnits = self.geography.resolve(queryField, targetUnits)
+        return super().getFilterOptions(queryField, targetUnits)
+
+def getMLSs(client: MongoClient = None, metadata: bool = True) -> dict:
     MLSDict = {} # A dictionary of all the MLS objects to be used by streamlit
-    load_dotenv(verbose=True) 
-    mongoString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-    client = MongoClient(mongoString, connect=False)
+    client = client if client else getClient("dashboard")
 
     # CJMLS fields are already in RESO format
     MLSDict["New Jersey"] = MLS(
@@ -230,7 +593,9 @@ def getMLSs() -> dict:
         },
         'housing-prices',
         'bridge',
-        client
+        client,
+        keyField = 'ListingKeyNumeric',
+        metadata = metadata
     )
 
     MLSDict["Massachusetts"] = MLS(
@@ -263,7 +628,9 @@ def getMLSs() -> dict:
         },
         'mlspin',
         'RESI',
-        client
+        client,
+        keyField = 'LIST_NO',
+        metadata = metadata
     )
 
     def fixListingsAcresToSqft(listings: pd.DataFrame) -> pd.DataFrame:
@@ -304,6 +671,8 @@ def getMLSs() -> dict:
         'ctmls',
         'Property',
         client,
+        keyField = 'Matrix_Unique_ID',
+        metadata = metadata,
         fixListings = fixListingsAcresToSqft
     )
 
@@ -340,6 +709,8 @@ def getMLSs() -> dict:
         'mlsgrid',
         'Property',
         client,
+        keyField = '_id',
+        metadata = metadata,
         fixListings = fixListingsAcresToSqft
     )
 
@@ -376,11 +747,12 @@ def getMLSs() -> dict:
         },
         'mlsmatrix',
         'Property',
-        client
+        client,
+        keyField = 'Matrix_Unique_ID',
+        metadata = metadata
     )
 
 
-    caCounties = {'San Bernardino': ['Adelanto', 'Apple Valley', 'Barstow', 'Big Bear Lake', 'Chino', 'Chino Hills', 'Colton', 'Fontana', 'Grand Terrace', 'Hesperia', 'Highland', 'Loma Linda', 'Montclair', 'Needles', 'Ontario', 'Rancho Cucamonga', 'Redlands', 'Rialto', 'San Bernardino', 'Twentynine Palms', 'Upland', 'Victorville', 'Yucaipa', 'Yucca Valley'], 'Los Angeles': ['Agoura Hills', 'Alhambra', 'Arcadia', 'Artesia', 'Avalon', 'Azusa', 'Baldwin Park', 'Bell', 'Bell Gardens', 'Bellflower', 'Beverly Hills', 'Bradbury', 'Burbank', 'Calabasas', 'Carson', 'Cerritos', 'Claremont', 'Commerce', 'Compton', 'Covina', 'Cudahy', 'Culver City', 'Diamond Bar', 'Downey', 'Duarte', 'El Monte', 'El Segundo', 'Gardena', 'Glendale', 'Glendora', 'Hawaiian Gardens', 'Hawthorne', 'Hermosa Beach', 'Hidden Hills', 'Huntington Park', 'Industry', 'Inglewood', 'Irwindale', 'La Cañada Flintridge', 'La Habra Heights', 'La Mirada', 'La Puente', 'La Verne', 'Lakewood', 'Lancaster', 'Lawndale', 'Lomita', 'Long Beach', 'Los Angeles', 'Lynwood', 'Malibu', 'Manhattan Beach', 'Maywood', 'Monrovia', 'Montebello', 'Monterey Park', 'Norwalk', 'Palmdale', 'Palos Verdes Estates', 'Paramount', 'Pasadena', 'Pico Rivera', 'Pomona', 'Rancho Palos Verdes', 'Redondo Beach', 'Rolling Hills', 'Rolling Hills Estates', 'Rosemead', 'San Dimas', 'San Fernando', 'San Gabriel', 'San Marino', 'Santa Clarita', 'Santa Fe Springs', 'Santa Monica', 'Sierra Madre', 'Signal Hill', 'South El Monte', 'South Gate', 'South Pasadena', 'Temple City', 'Torrance', 'Vernon', 'Walnut', 'West Covina', 'West Hollywood', 'Westlake Village', 'Whittier'], 'Alameda': ['Alameda', 'Albany', 'Berkeley', 'Dublin', 'Emeryville', 'Fremont', 'Hayward', 'Livermore', 'Newark', 'Oakland', 'Piedmont', 'Pleasanton', 'San Leandro', 'Union City'], 'Orange': ['Aliso Viejo', 'Anaheim', 'Brea', 'Buena Park', 'Costa Mesa', 'Cypress', 'Dana Point', 'Fountain Valley', 'Fullerton', 'Garden Grove', 'Huntington Beach', 'Irvine', 'La Habra', 'La Palma', 'Laguna Beach', 'Laguna Hills', 'Laguna Niguel', 'Laguna Woods', 'Lake Forest', 'Los Alamitos', 'Mission Viejo', 'Newport Beach', 'Orange', 'Placentia', 'Rancho Santa Margarita', 'San Clemente', 'San Juan Capistrano', 'Santa Ana', 'Seal Beach', 'Stanton', 'Tustin', 'Villa Park', 'Westminster', 'Yorba Linda'], 'Modoc': ['Alturas'], 'Amador': ['Amador City', 'Ione', 'Jackson', 'Plymouth', 'Sutter Creek'], 'Napa': ['American Canyon', 'Calistoga', 'Napa', 'St. Helena', 'Yountville'], 'Shasta': ['Anderson', 'Redding', 'Shasta Lake'], 'Calaveras': ['Angels Camp'], 'Contra Costa': ['Antioch', 'Brentwood', 'Clayton', 'Concord', 'Danville', 'El Cerrito', 'Hercules', 'Lafayette', 'Martinez', 'Moraga', 'Oakley', 'Orinda', 'Pinole', 'Pittsburg', 'Pleasant Hill', 'Richmond', 'San Pablo', 'San Ramon', 'Walnut Creek'], 'Humboldt': ['Arcata', 'Blue Lake', 'Eureka', 'Ferndale', 'Fortuna', 'Rio Dell', 'Trinidad'], 'San Luis Obispo': ['Arroyo Grande', 'Atascadero', 'Grover Beach', 'Morro Bay', 'Paso Robles', 'Pismo Beach', 'San Luis Obispo'], 'Kern': ['Arvin', 'Bakersfield', 'California City', 'Delano', 'Maricopa', 'McFarland', 'Ridgecrest', 'Shafter', 'Taft', 'Tehachapi', 'Wasco'], 'San Mateo': ['Atherton', 'Belmont', 'Brisbane', 'Burlingame', 'Colma', 'Daly City', 'East Palo Alto', 'Foster City', 'Half Moon Bay', 'Hillsborough', 'Menlo Park', 'Millbrae', 'Pacifica', 'Portola Valley', 'Redwood City', 'San Bruno', 'San Carlos', 'San Mateo', 'South San Francisco', 'Woodside'], 'Merced': ['Atwater', 'Dos Palos', 'Gustine', 'Livingston', 'Los Banos', 'Merced'], 'Placer': ['Auburn', 'Colfax', 'Lincoln', 'Loomis', 'Rocklin', 'Roseville'], 'Kings': ['Avenal', 'Corcoran', 'Hanford', 'Lemoore'], 'Riverside': ['Banning', 'Beaumont', 'Blythe', 'Calimesa', 'Canyon Lake', 'Cathedral City', 'Coachella', 'Corona', 'Desert Hot Springs', 'Eastvale', 'Hemet', 'Indian Wells', 'Indio', 'Jurupa Valley', 'La Quinta', 'Lake Elsinore', 'Menifee', 'Moreno Valley', 'Murrieta', 'Norco', 'Palm Desert', 'Palm Springs', 'Perris', 'Rancho Mirage', 'Riverside', 'San Jacinto', 'Temecula', 'Wildomar'], 'Marin': ['Belvedere', 'Corte Madera', 'Fairfax', 'Larkspur', 'Mill Valley', 'Novato', 'Ross', 'San Anselmo', 'San Rafael', 'Sausalito', 'Tiburon'], 'Solano': ['Benicia', 'Dixon', 'Fairfield', 'Rio Vista', 'Suisun City', 'Vacaville', 'Vallejo'], 'Butte': ['Biggs', 'Chico', 'Gridley', 'Oroville', 'Paradise'], 'Inyo': ['Bishop'], 'Imperial': ['Brawley', 'Calexico', 'Calipatria', 'El Centro', 'Holtville', 'Imperial', 'Westmorland'], 'Santa Barbara': ['Buellton', 'Carpinteria', 'Goleta', 'Guadalupe', 'Lompoc', 'Santa Barbara', 'Santa Maria', 'Solvang'], 'Ventura': ['Camarillo', 'Fillmore', 'Moorpark', 'Ojai', 'Oxnard', 'Port Hueneme', 'Santa Paula', 'Simi Valley', 'Thousand Oaks', 'Ventura'], 'Santa Clara': ['Campbell', 'Cupertino', 'Gilroy', 'Los Altos', 'Los Altos Hills', 'Los Gatos', 'Milpitas', 'Monte Sereno', 'Morgan Hill', 'Mountain View', 'Palo Alto', 'San Jose', 'Santa Clara', 'Saratoga', 'Sunnyvale'], 'Santa Cruz': ['Capitola', 'Santa Cruz', 'Scotts Valley', 'Watsonville'], 'San Diego': ['Carlsbad', 'Chula Vista', 'Coronado', 'Del Mar', 'El Cajon', 'Encinitas', 'Escondido', 'Imperial Beach', 'La Mesa', 'Lemon Grove', 'National City', 'Oceanside', 'Poway', 'San Diego', 'San Marcos', 'Santee', 'Solana Beach', 'Vista'], 'Monterey': ['Carmel-by-the-Sea', 'Del Rey Oaks', 'Gonzales', 'Greenfield', 'King City', 'Marina', 'Monterey', 'Pacific Grove', 'Salinas', 'Sand City', 'Seaside', 'Soledad'], 'Stanislaus': ['Ceres', 'Hughson', 'Modesto', 'Newman', 'Oakdale', 'Patterson', 'Riverbank', 'Turlock', 'Waterford'], 'Madera': ['Chowchilla', 'Madera'], 'Sacramento': ['Citrus Heights', 'Elk Grove', 'Folsom', 'Galt', 'Isleton', 'Rancho Cordova', 'Sacramento'], 'Lake': ['Clearlake', 'Lakeport'], 'Sonoma': ['Cloverdale', 'Cotati', 'Healdsburg', 'Petaluma', 'Rohnert Park', 'Santa Rosa', 'Sebastopol', 'Sonoma', 'Windsor'], 'Fresno': ['Clovis', 'Coalinga', 'Firebaugh', 'Fowler', 'Fresno', 'Huron', 'Kerman', 'Kingsburg', 'Mendota', 'Orange Cove', 'Parlier', 'Reedley', 'San Joaquin', 'Sanger', 'Selma'], 'Colusa': ['Colusa', 'Williams'], 'Tehama': ['Corning', 'Red Bluff', 'Tehama'], 'Del Norte': ['Crescent City'], 'Yolo': ['Davis', 'West Sacramento', 'Winters', 'Woodland'], 'Tulare': ['Dinuba', 'Exeter', 'Farmersville', 'Lindsay', 'Porterville', 'Tulare', 'Visalia', 'Woodlake'], 'Siskiyou': ['Dorris', 'Dunsmuir', 'Etna', 'Fort Jones', 'Montague', 'Mount Shasta', 'Tulelake', 'Weed', 'Yreka'], 'San Joaquin': ['Escalon', 'Lathrop', 'Lodi', 'Manteca', 'Ripon', 'Stockton', 'Tracy'], 'Mendocino': ['Fort Bragg', 'Point Arena', 'Ukiah', 'Willits'], 'Nevada': ['Grass Valley', 'Nevada City', 'Truckee'], 'San Benito': ['Hollister', 'San Juan Bautista'], 'Sutter': ['Live Oak', 'Yuba City'], 'Sierra': ['Loyalton'], 'Mono': ['Mammoth Lakes'], 'Yuba': ['Marysville', 'Wheatland'], 'Glenn': ['Orland', 'Willows'], 'El Dorado': ['Placerville', 'South Lake Tahoe'], 'Plumas': ['Portola'], 'San Francisco': ['San Francisco'], 'Tuolumne': ['Sonora'], 'Lassen': ['Susanville']}
 
     # L_ContractDate, L_SystemPrice, L_UpdateDate
     # County could be LM_Char10_11, LM_char10_49, or LO1_board_id. L_Area could also contain county information
@@ -426,7 +798,9 @@ def getMLSs() -> dict:
         'paragon',
         'Property',
         client,
-        counties = tuple(caCounties),
+        keyField = 'L_ListingID',
+        metadata = metadata,
+        counties = tuple(caCountyCities),
         fixListings = fixListingsAcresToSqft
     )
 
@@ -467,7 +841,9 @@ def getMLSs() -> dict:
         },
         'rebny',
         'Property',
-        client
+        client,
+        keyField = 'ListingKey',
+        metadata = metadata
     )
 
     return MLSDict
@@ -8,6 +8,7 @@ from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 import concurrent.futures
 import collections
 import datetime
+import functools
 from decimal import Decimal
 from dotenv import load_dotenv
 import json
@@ -27,6 +28,11 @@ import sys
 import urllib3
 import urllib
 
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+from writerPool import getWriterPool
+
 def SentenceCase(s):
     return " ".join(map(
         lambda x: x[0].upper() + x[1:].lower() if x else '', 
@@ -41,7 +47,9 @@ def transformListing(listing: dict) -> dict:
             listing[key] = SentenceCase(listing[key])
     return listing
 
-async def uploadListings(jsonValueField: Iterable[dict], collection) -> None:
+mlsgridLimiter = getLimiter("MLSGRID") # MLS Grid allows at most 2 requests per second and 4GB per hour
+
+def writeListings(jsonValueField: Iterable[dict], collection) -> None:
     # Takes an iterable of listings, scrubs their id, and updates them in the supplied mongo collection
     listings = tuple(map(
         transformListing,
@@ -56,16 +64,36 @@ async def uploadListings(jsonValueField: Iterable[dict], collection) -> None:
                 upsert=True # if no listing with _id of _id exists in the db, a new one will be added
             )
         )
+    if not requests:
+        return
     replacementResult = collection.bulk_write(requests, ordered=False)
+    listingsWritten(collection, listings) # Clean the listings for the dashboard and tell it its caches are stale
     logging.info(f'    MLSGRID: Listings returned: {len(listings)}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings')
 
+async def uploadListings(jsonValueField: Iterable[dict], collection) -> None:
+    # pymongo blocks, so the bulk writes run on the shared writers to let the next page download at the same time
+    # submit blocks while the writer queue is full, so it runs in a thread to keep the event loop fetching pages
+    futures = await asyncio.get_running_loop().run_in_executor(None, getWriterPool().submit, "MLSGRID", writeListings, list(jsonValueField), collection)
+    await asyncio.gather(*map(asyncio.wrap_future, futures))
+
+async def getPage(session: requests.Session, url: str, params: str = None):
+    # Request one page of listings once the rate limit allows it, and parse its json once. Returns (status code, json or None)
+    for _ in range(5):
+        await mlsgridLimiter.acquireAsync()
+        response = await asyncio.get_running_loop().run_in_executor(None, functools.partial(session.get, url, params=params))
+        if not mlsgridLimiter.record(response): # Throttled responses are waited out and requested again
+            break
+    try:
+        return response.status_code, response.json()
+    except ValueError:
+        return response.status_code, None
+
 async def seed(skip: str = "0", filter: str = None) -> None:
-    load_dotenv(verbose=True) # Load db credentials from .env
-    mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-    mongoClient = MongoClient(mongoConnectionString) # Our database connector
+    mongoClient = getClient("sync") # Our database connector
     dbCursor = mongoClient["mlsgrid"]["Property"]
 
-    headers = {"Authorization": "Bearer " + os.getenv("MLSGRID_TOKEN")} 
+    session = requests.Session() # Reuse the connection for every page
+    session.headers.update({"Authorization": "Bearer " + os.getenv("MLSGRID_TOKEN")})
     payload = {
         "$filter": "OriginatingSystemName eq 'mred'",
     }
@@ -74,32 +102,29 @@ async def seed(skip: str = "0", filter: str = None) -> None:
     if skip != "0":
         payload["$skip"] = skip
 
-    response = requests.get(os.getenv("MLSGRID_URL"), headers=headers, params=urllib.parse.urlencode(payload))
+    status, body = await getPage(session, os.getenv("MLSGRID_URL"), urllib.parse.urlencode(payload))
 
     startTime = time.time()
     iterations = 0
-    if (response.status_code == 200) and response.json() and ('@odata.nextLink' not in response.json()) and not response.json()['value']:
+    if status == 200 and body and ('@odata.nextLink' not in body) and not body['value']:
         logging.info(f"    MLSGRID: No listings found for filter {filter}")
         return None
-    while (response.status_code == 200) and response.json() and ('@odata.nextLink' in response.json()):
-        listings = response.json()['value']
-        task = asyncio.create_task(uploadListings(listings, dbCursor))
+    while status == 200 and body and ('@odata.nextLink' in body):
+        # here we upload the current batch of listings to the database and get the next batch concurrently
+        _, (status, body) = await asyncio.gather(
+            uploadListings(body['value'], dbCursor),
+            getPage(session, body['@odata.nextLink'])
+        )
 
         iterations += 1
         timeElapsed = time.time() - startTime
         logging.info(f"    MLSGRID: {round(iterations/timeElapsed, 3)} iterations per second.")
 
-        response = requests.get(response.json()['@odata.nextLink'], headers=headers)
-        # here we upload the previous batch of listings to the database and get the new batch concurrently
-        await asyncio.sleep(2)
-        await task
-
-    if response.status_code == 200 and response.json():
-        await uploadListings(response.json()['value'], dbCursor)
+    if status == 200 and body:
+        await uploadListings(body['value'], dbCursor)
     else:
-        
-        logging.info(f"     MLSGRID: last request returned status code: {response.status_code}")
-        logging.info(response.json())
+        logging.info(f"     MLSGRID: last request returned status code: {status}")
+        logging.info(body)
 
 
 def update(timeDelta: datetime.timedelta) -> None:
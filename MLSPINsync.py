@@ -2,12 +2,10 @@
 # Download MLSPIN data and upload to MongoDB on TFS
 # Each resource of the API will be a Collection in Mongo
 from bson.code import Code
-from bson.decimal128 import Decimal128
 from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 import concurrent.futures
 import collections
 import datetime
-from decimal import Decimal
 from dotenv import load_dotenv
 import json
 import logging
@@ -25,24 +23,23 @@ import time
 import sys
 import urllib3
 
+from decimalCodec import convert_decimal
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+from retry import RetryExecutor, RetryPolicy
+from retsSessions import RetsSession, RetsSessionPool, isUnauthorized, streamSearch
+from stagedSeed import insertStaged, stagingCollection, swapIn
+from writerPool import getWriterPool, waitFor
+
 failedQueries = []
 lastSuccessfulQuery = ""
-
-def convert_decimal(dict_item):
-    # function adapted from: https://stackoverflow.com/questions/61456784/pymongo-cannot-encode-object-of-type-decimal-decimal
-    # This function iterates a dictionary looking for types of Decimal and converts them to Decimal128
-    # Embedded dictionaries and lists are called recursively.
-    if dict_item is None: return None
-    if not (isinstance(dict_item, dict) or isinstance(dict_item, collections.OrderedDict)): return dict_item
-    for k, v in list(dict_item.items()):
-        if isinstance(v, dict):
-            convert_decimal(v)
-        elif isinstance(v, list):
-            for l in v:
-                convert_decimal(l)
-        elif isinstance(v, Decimal):
-            dict_item[k] = Decimal128(str(v))
-    return dict_item
+limiter = getLimiter("MLSPIN")
+retsPool = RetsSessionPool("MLSPIN", auth_type='basic')
+retsRetry = RetryExecutor("MLSPIN", {
+    requests.exceptions.HTTPError: RetryPolicy(baseDelay=.2),
+    urllib3.exceptions.MaxRetryError: RetryPolicy(baseDelay=1),
+})
 
 def uploadMany(docs, collection, className):
     requests = []
@@ -57,44 +54,44 @@ def uploadMany(docs, collection, className):
         )
     try:
         replacementResult = collection.bulk_write(requests, ordered=False)
+        listingsWritten(collection, docs) # Clean the listings for the dashboard and tell it its caches are stale
         logging.info(f'    MLSPIN: Listings returned: {len(docs)}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings')
     except BulkWriteError as bwe:
         logging.info(bwe.details)
 
-def getAndUpload(rClass, query, collection):
+def stageMany(docs, staging, className):
+    # The upload for staged seeds, inserting into the staging collection without looking the listings up
+    for doc in docs:
+        doc["MLSPIN_CLASS"] = className
+    insertStaged(docs, staging)
+
+def getAndUpload(rClass, query, collection, session: RetsSession, upload=uploadMany):
+    def search(limit, offset):
+        limiter.acquire()
+        return rClass.search(query=query, limit=limit, offset=offset)
+
+    def logIn(exc, attempt):
+        # The session has expired when we get requests.exceptions.HTTPError: 401 Client Error: Unauthorized for url: https://bridge-rets.mlspin.com:12109/rets/search
+        nonlocal rClass
+        if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+            limiter.record(exc.response) # a 429 backs off for its Retry-After
+        if isUnauthorized(exc):
+            session.logIn()
+            rClass = session.getClass('RESI', rClass.name)
+
+    def searchPage(limit, offset):
+        return retsRetry.run(search, limit, offset, onRetry=logIn)
+
+    st = time.time()
+    resultsCount = 0
     try:
-        st = time.time()
-        search_result = list(map( 
-            lambda x: convert_decimal(x.data), 
-            rClass.search(query=query).data)
-        )
-        st = time.time()-st
-    except requests.exceptions.HTTPError as exc:
-        logging.info("    MLSPIN: failed, requests.exceptions.HTTPError, retrying...")
-        traceback.print_exc()
-        time.sleep(.2)
-        retsClient =  RetsClient( # An attempt to fix requests.exceptions.HTTPError: 401 Client Error: Unauthorized for url: https://bridge-rets.mlspin.com:12109/rets/search
-            login_url=os.getenv("MLSPIN_LOGIN_URL"),
-            username=os.getenv("MLSPIN_USERNAME"),
-            password=os.getenv("MLSPIN_PASSWORD"),
-            auth_type='basic',
-        )
-        rClass = retsClient.get_resource('RESI').get_class(rClass.name)
-        return getAndUpload(rClass, query, collection)
-    except urllib3.exceptions.MaxRetryError as exc:
-        logging.info("    MLSPIN: failed")
-        logging.info(exc)
-        traceback.print_exc()
-        failedQueries.append(query)
-        time.sleep(1)
-        retsClient =  RetsClient(
-            login_url=os.getenv("MLSPIN_LOGIN_URL"),
-            username=os.getenv("MLSPIN_USERNAME"),
-            password=os.getenv("MLSPIN_PASSWORD"),
-            auth_type='basic',
-        )
-        rClass = retsClient.get_resource('RESI').get_class(rClass.name)
-        return getAndUpload(rClass, query, collection)
+        # The data comes back from the API as pages of rets.client.record.Record objects. Their .data is uploaded by the shared writers while the next page downloads
+        # Submitting waits while the writers' queue is full, so we don't download faster than we can upload
+        futures = []
+        for page in streamSearch(searchPage, batchSize=5000, convert=convert_decimal): # Decimal values become Decimal128, which pymongo can encode
+            futures += getWriterPool().submit("MLSPIN", upload, page, collection, rClass.name)
+            resultsCount += len(page)
+        failedWrites = waitFor(futures, "MLSPIN")
     except AttributeError as exc:
         logging.info("    MLSPIN: failed")
         logging.info(exc)
@@ -103,67 +100,58 @@ def getAndUpload(rClass, query, collection):
         return rClass
     except Exception as exc:
         # AttributeError is not a result of the query coming back empty, this needs to be fixed
+        # This includes HTTP and connection errors that ran out of retries, and searches skipped because MLSPIN keeps failing
         logging.info("    MLSPIN: failed")
         logging.info(exc)
         traceback.print_exc()
         failedQueries.append(query)
-        time.sleep(.5)
+        limiter.backoff(.5)
         return rClass
     else:
+        if failedWrites:
+            failedQueries.append(query)
         lastSuccessfulQuery = query
-        batchSize = 1000
-        resultsCount = len(search_result)
-        it = time.time()
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            futures = {}
-            while len(search_result) != 0:
-                futures[executor.submit(
-                    uploadMany,
-                    search_result[:batchSize],
-                    collection,
-                    rClass.name
-                )] = len(search_result[:batchSize])
-                search_result = search_result[batchSize:]
-            # with tqdm(total=resultsCount, desc="Pushing batches of max size " + str(batchSize), ncols=100) as pbar:
-            for future in concurrent.futures.as_completed(futures):
-                # pbar.update(futures[future])
-                try:
-                    future.result()
-                except Exception as exc:
-                    logging.info(f'    MLSPIN: Exception: {exc}')
-        it = time.time()-it
-        logging.info(f"    MLSPIN: Inserting {resultsCount} docs from query {query} took {round(st, 1)} seconds to search and {round(it, 1)} seconds to insert.")
+        logging.info(f"    MLSPIN: Searching and inserting {resultsCount} docs from query {query} took {round(time.time()-st, 1)} seconds.")
         return rClass
 
-def seedRESI(skipClasses={}, skipRESI=0):
+def seedRESI(skipClasses={}, skipRESI=0, dbCollection=None, staged=False):
     """Seed the database with all the listings from the API
 
     Args:
         skipClasses (dict, optional): Classes to not seed. MLSPIN RESI classes is one of [CC, MH, MF, RN, SF, LD]. Defaults to {}.
         skipRESI (int, optional): The number of iterations to skip. Used to resume after failure. Defaults to 0.
+        dbCollection (pymongo.collection.Collection, optional): The collection to seed. Defaults to mlspin.RESI.
+        staged (bool, optional): Insert into a staging collection that replaces dbCollection when the seed finishes, see stagedSeed. Defaults to False.
     """
-    retsClient =  RetsClient(
-        login_url=os.getenv("MLSPIN_LOGIN_URL"),
-        username=os.getenv("MLSPIN_USERNAME"),
-        password=os.getenv("MLSPIN_PASSWORD"),
-        auth_type='basic',
-    )
-    resource = retsClient.get_resource('RESI')
-    collection = dbCursor[resource.name]
-    for rClass in resource.classes:
-        if rClass.name not in skipClasses:
-            logging.info("Syncing class:", rClass.name)
-            skipped = 0
-            for maxListNo in tqdm(range(100000, 100100000, 100000), desc="Syncing batches of 100k", ncols=120): # Ive seen list numbers has high as 30 million and as low as 4, so we check every 10k chunk from 0 to 100 million. This is 10 thousand total searches
-                skipped += 1
-                if skipped > skipRESI:
-                    query = f"(LIST_NO={maxListNo-100000}+), (LIST_NO={maxListNo-1}-)"
-                    # logging.info("    Syncing class:", rClass.name, "queried by", query) # Too many messages
-                    # The data comes back from the API as a tuple of objects of type rets.client.record.Record. we call .data on these objects to get them to type collections.OrderedDict, which Mongo accepts
-                    # pymongo doesn't like decimals, they need to be cast to Decimal128 from bson, so take care of that here aswell
-                    rClass = getAndUpload(rClass, query, collection)
-            query = f"(LIST_NO={100000000-1}+)"
-            getAndUpload(rClass, query, collection)
+    if dbCollection is None:
+        dbCollection = getClient("seed")["mlspin"]['RESI']
+    upload = uploadMany
+    collection = dbCollection
+    if staged:
+        upload = stageMany
+        collection = stagingCollection(dbCollection, fresh=not skipClasses and not skipRESI) # A resumed seed keeps what it already staged
+    failures = len(failedQueries)
+    started = datetime.datetime.now(datetime.timezone.utc)
+    with retsPool.session() as session:
+        for rClass in session.getClasses('RESI'):
+            if rClass.name not in skipClasses:
+                logging.info("Syncing class:", rClass.name)
+                skipped = 0
+                for maxListNo in tqdm(range(100000, 100100000, 100000), desc="Syncing batches of 100k", ncols=120): # Ive seen list numbers has high as 30 million and as low as 4, so we check every 10k chunk from 0 to 100 million. This is 10 thousand total searches
+                    skipped += 1
+                    if skipped > skipRESI:
+                        query = f"(LIST_NO={maxListNo-100000}+), (LIST_NO={maxListNo-1}-)"
+                        # logging.info("    Syncing class:", rClass.name, "queried by", query) # Too many messages
+                        # The data comes back from the API as a tuple of objects of type rets.client.record.Record. we call .data on these objects to get them to type collections.OrderedDict, which Mongo accepts
+                        # pymongo doesn't like decimals, they need to be cast to Decimal128 from bson, so take care of that here aswell
+                        rClass = getAndUpload(rClass, query, collection, session, upload)
+                query = f"(LIST_NO={100000000-1}+)"
+                getAndUpload(rClass, query, collection, session, upload)
+    if staged:
+        if len(failedQueries) > failures:
+            logging.info(f"    MLSPIN: {len(failedQueries) - failures} searches failed, the staged seed was not swapped in")
+        else:
+            swapIn(collection, dbCollection, "LIST_NO", started, lambda timeDelta: update(timeDelta, dbCollection))
             
 def updateLongTerm(dbCollection, timeDelta: datetime.timedelta) -> None:
     """Updates the collection in MongoDB with all the listings modified after oldestTimestamp
@@ -173,24 +161,18 @@ def updateLongTerm(dbCollection, timeDelta: datetime.timedelta) -> None:
         oldestTimestamp (datetime.datetime): All listings modified at 
         or after this time will be requested from the API and uploaded
     """
-    retsClient =  RetsClient(
-        login_url=os.getenv("MLSPIN_LOGIN_URL"),
-        username=os.getenv("MLSPIN_USERNAME"),
-        password=os.getenv("MLSPIN_PASSWORD"),
-        auth_type='basic',
-    )
-    resource = retsClient.get_resource('RESI')
-    utcMinusFour = datetime.timezone(datetime.timedelta(0, -4*3600))
-    oldestTime = (datetime.datetime.now(tz=utcMinusFour) - timeDelta).isoformat().split('.')[0]
-    for rClass in resource.classes:
-        logging.info(f"    MLSPIN: Updating class: {rClass.name}")
-        for maxListNo in range(100000, 100100000, 100000): 
-            query = f"(LIST_NO={maxListNo-100000}+), (LIST_NO={maxListNo-1}-), (UPDATE_DATE={oldestTime}+)"
-            rClass = getAndUpload(rClass, query, dbCollection)
-        query = f"(LIST_NO={100000000-1}+), (UPDATE_DATE={oldestTime}+)"
-        getAndUpload(rClass, query, dbCollection)
-        query = f"(LIST_NO={100000}-), (UPDATE_DATE={oldestTime}+)"
-        getAndUpload(rClass, query, dbCollection)
+    with retsPool.session() as session:
+        utcMinusFour = datetime.timezone(datetime.timedelta(0, -4*3600))
+        oldestTime = (datetime.datetime.now(tz=utcMinusFour) - timeDelta).isoformat().split('.')[0]
+        for rClass in session.getClasses('RESI'):
+            logging.info(f"    MLSPIN: Updating class: {rClass.name}")
+            for maxListNo in range(100000, 100100000, 100000): 
+                query = f"(LIST_NO={maxListNo-100000}+), (LIST_NO={maxListNo-1}-), (UPDATE_DATE={oldestTime}+)"
+                rClass = getAndUpload(rClass, query, dbCollection, session)
+            query = f"(LIST_NO={100000000-1}+), (UPDATE_DATE={oldestTime}+)"
+            getAndUpload(rClass, query, dbCollection, session)
+            query = f"(LIST_NO={100000}-), (UPDATE_DATE={oldestTime}+)"
+            getAndUpload(rClass, query, dbCollection, session)
 
 def updateShortTerm(dbCollection, timeDelta: datetime.timedelta) -> None:
     """Updates the collection in MongoDB with all the listings modified after oldestTimestamp
@@ -201,27 +183,35 @@ def updateShortTerm(dbCollection, timeDelta: datetime.timedelta) -> None:
         oldestTimestamp (datetime.datetime): All listings modified at 
         or after this time will be requested from the API and uploaded
     """
-    retsClient =  RetsClient(
-        login_url=os.getenv("MLSPIN_LOGIN_URL"),
-        username=os.getenv("MLSPIN_USERNAME"),
-        password=os.getenv("MLSPIN_PASSWORD"),
-        auth_type='basic',
-    )
-    resource = retsClient.get_resource('RESI')
-
     # It looks like MLSPIN uses UCT-4
     utcMinusFour = datetime.timezone(datetime.timedelta(0, -4*3600))
     oldestTime = (datetime.datetime.now(tz=utcMinusFour) - timeDelta).isoformat().split('.')[0]
-    for rClass in resource.classes:
-        logging.info(f"    MLSPIN: Updating class: {rClass.name}")
-        query = f"(LIST_NO=0+), (UPDATE_DATE={oldestTime}+)"
-        rClass = getAndUpload(rClass, query, dbCollection)
-
-def update(timeDelta: datetime.timedelta) -> None:
-    load_dotenv(verbose=True) # Load db credentials from .env
-    mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-    mongoClient = MongoClient(mongoConnectionString) # Our database connector
-    dbCollection = mongoClient["mlspin"]['RESI']
+    query = f"(LIST_NO=0+), (UPDATE_DATE={oldestTime}+)"
+    with retsPool.session() as session:
+        classNames = [rClass.name for rClass in session.getClasses('RESI')]
+
+    def updateClass(className):
+        # Each class is searched on its own pooled session, and they all upsert into the same RESI collection
+        with retsPool.session() as session:
+            logging.info(f"    MLSPIN: Updating class: {className}")
+            getAndUpload(session.getClass('RESI', className), query, dbCollection, session)
+
+    # A short update is mostly waiting on one search per class, so the classes are searched at the same time
+    sessions = max(1, int(os.getenv("MLSPIN_SESSIONS", len(classNames)))) # A pool of no workers is an error, even when there are no classes
+    poolSize = retsPool.size
+    retsPool.resize(sessions)
+    try:
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            futures = [executor.submit(updateClass, className) for className in classNames]
+    finally:
+        retsPool.resize(poolSize) # The seed and long term update keep to the pool's own size
+    for future in futures:
+        future.result() # Logging in failing is raised once every class has finished, so the ETL retries the update
+
+def update(timeDelta: datetime.timedelta, dbCollection=None) -> None:
+    if dbCollection is None:
+        mongoClient = getClient("sync") # Our database connector
+        dbCollection = mongoClient["mlspin"]['RESI']
 
     if timeDelta < datetime.timedelta(35):
         updateShortTerm(dbCollection, timeDelta)
@@ -231,34 +221,36 @@ def update(timeDelta: datetime.timedelta) -> None:
 
 
 
-def seed(retsClient, skipResources={'office', 'memberassociation', 'virtualtour', 'member', 'comm', 'oh', 'officeassociation', 'memberlicense'}, skipClasses={}, skipRESI=0):
-    for resource in retsClient.resources:
-        if resource.name.lower() not in skipResources: # For re-running without duplicates
+def seed(skipResources={'office', 'memberassociation', 'virtualtour', 'member', 'comm', 'oh', 'officeassociation', 'memberlicense'}, skipClasses={}, skipRESI=0):
+    dbCursor = getClient("seed")["mlspin"]
+    with retsPool.session() as session:
+        for resource in session.client.resources:
+            if resource.name.lower() in skipResources: # For re-running without duplicates
+                logging.info(f"Skipping {resource.name}")
+                continue
+            if resource.name == "RESI": # We need to split up the queries for RESI because there's too much data, but we can't split up the queries in the same way for the other resources because they don't all have the same fields
+                continue
             # Each resource will be its own collection in the MongoDB
             collection = dbCursor[resource.name]
-            logging.info("Syncing resource:", resource.name)
+            logging.info(f"Syncing resource: {resource.name}")
             for rClass in resource.classes:
                 if rClass.name not in skipClasses:
-                    if resource.name == "RESI": # We need to split up the queries for RESI because there's too much data, but we can't split up the queries in the same way for the other resources because they don't all have the same fields
-                        seedRESI(skipResources, skipClasses, skipRESI)
-                    else:
-                        logging.info("    Syncing class:", rClass.name)
-                        search_result = tuple(map( 
-                            lambda x: convert_decimal(x.data), 
-                            rClass.search(query='').data))
-                        insert_result = collection.insert_many(search_result)
-                        filter = {"_id": {"$in": insert_result.inserted_ids}}
-                        update = {"$set": {"MLSPIN_CLASS": rClass.name}}
-                        collection.update_many(filter, update)
+                    logging.info(f"    Syncing class: {rClass.name}")
+                    search_result = tuple(map(
+                        lambda x: convert_decimal(x.data),
+                        rClass.search(query='').data))
+                    insert_result = collection.insert_many(search_result)
+                    filter = {"_id": {"$in": insert_result.inserted_ids}}
+                    update = {"$set": {"MLSPIN_CLASS": rClass.name}}
+                    collection.update_many(filter, update)
                 else:
-                    logging.info("    Skipping", rClass.name)
-        else:
-            logging.info("Skipping", resource.name)
+                    logging.info(f"    Skipping {rClass.name}")
+    # RESI is seeded once the session above is back in the pool, seedRESI takes its own
+    if "resi" not in skipResources:
+        seedRESI(skipClasses, skipRESI, dbCursor["RESI"])
 
 if __name__ == "__main__":
-    load_dotenv(verbose=True) # Load db credentials from .env
-    mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-    mongoClient = MongoClient(mongoConnectionString) # Our database connector
+    mongoClient = getClient("sync") # Our database connector
     dbCollection = mongoClient["mlspin"]['RESI']
 
     updateShortTerm(dbCollection, datetime.timedelta(30))
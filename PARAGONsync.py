@@ -1,10 +1,8 @@
 from bson.code import Code
-from bson.decimal128 import Decimal128
 from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 import concurrent.futures
 import collections
 import datetime
-from decimal import Decimal
 from dotenv import load_dotenv
 import json
 import logging
@@ -20,24 +18,27 @@ import traceback
 from tqdm import tqdm
 import time
 import sys
+import threading
 import urllib3
 
+from decimalCodec import convert_decimal
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+from retry import RetryExecutor, RetryPolicy
+from retsSessions import RetsSession, RetsSessionPool, isUnauthorized, streamSearch
+from stagedSeed import insertStaged, stagingCollection, swapIn
+from writerPool import getWriterPool, waitFor
 
-def convert_decimal(dict_item):
-    # function adapted from: https://stackoverflow.com/questions/61456784/pymongo-cannot-encode-object-of-type-decimal-decimal
-    # This function iterates a dictionary looking for types of Decimal and converts them to Decimal128
-    # Embedded dictionaries and lists are called recursively.
-    if dict_item is None: return None
-    if not (isinstance(dict_item, dict) or isinstance(dict_item, collections.OrderedDict)): return dict_item
-    for k, v in list(dict_item.items()):
-        if isinstance(v, dict):
-            convert_decimal(v)
-        elif isinstance(v, list):
-            for l in v:
-                convert_decimal(l)
-        elif isinstance(v, Decimal):
-            dict_item[k] = Decimal128(str(v))
-    return dict_item
+seedLedgerFile = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'paragonSeed.json')
+
+failedQueries = []
+limiter = getLimiter("PARAGON")
+retsPool = RetsSessionPool("PARAGON")
+retsRetry = RetryExecutor("PARAGON", {
+    requests.exceptions.HTTPError: RetryPolicy(baseDelay=.2),
+    urllib3.exceptions.MaxRetryError: RetryPolicy(baseDelay=1),
+})
 
 def uploadMany(docs, collection, className):
     requests = []
@@ -52,95 +53,154 @@ def uploadMany(docs, collection, className):
         )
     try:
         replacementResult = collection.bulk_write(requests, ordered=False)
+        listingsWritten(collection, docs) # Clean the listings for the dashboard and tell it its caches are stale
         print(f'    PARAGON: Listings returned: {len(docs)}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings')
     except BulkWriteError as bwe:
         print(bwe.details)
+        raise # waitFor counts the failed write, so the query is searched again instead of recorded as done
+
+def stageMany(docs, staging, className):
+    # The upload for staged seeds, inserting into the staging collection without looking the listings up
+    for doc in docs:
+        doc["PARAGON_CLASS"] = className
+    insertStaged(docs, staging)
+
+def getAndUpload(rClass, query, collection, session: RetsSession, upload=uploadMany) -> bool:
+    # Search the class and upload what it returns. Returns whether the search and every write succeeded, failed queries are also kept in failedQueries
+    def search(limit, offset):
+        limiter.acquire()
+        return rClass.search(query=query, limit=limit, offset=offset)
+
+    def logIn(exc, attempt):
+        # The session has expired when we get requests.exceptions.HTTPError: 401 Client Error: Unauthorized for url
+        nonlocal rClass
+        if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+            limiter.record(exc.response) # a 429 backs off for its Retry-After
+        if isUnauthorized(exc):
+            session.logIn()
+            rClass = session.getClass('Property', rClass.name)
 
-def getAndUpload(rClass, query, collection):
+    def searchPage(limit, offset):
+        return retsRetry.run(search, limit, offset, onRetry=logIn)
+
+    st = time.time()
+    resultsCount = 0
     try:
-        st = time.time()
-        search_result = list(map( 
-            lambda x: convert_decimal(x.data), 
-            rClass.search(query=query).data)
-        )
-        st = time.time()-st
-    except requests.exceptions.HTTPError as exc:
-        print("    PARAGON: failed, requests.exceptions.HTTPError, retrying...")
-        traceback.print_exc()
-        time.sleep(.2)
-        retsClient =  RetsClient( # An attempt to fix requests.exceptions.HTTPError: 401 Client Error: Unauthorized for url
-            login_url=os.getenv("PARAGON_LOGIN_URL"),
-            username=os.getenv("PARAGON_USERNAME"),
-            password=os.getenv("PARAGON_PASSWORD"),
-        )
-        rClass = retsClient.get_resource('Property').get_class(rClass.name)
-        return getAndUpload(rClass, query, collection)
-    except urllib3.exceptions.MaxRetryError as exc:
-        print("    PARAGON: failed", exc)
-        traceback.print_exc()
-        time.sleep(1)
-        retsClient =  RetsClient(
-            login_url=os.getenv("PARAGON_LOGIN_URL"),
-            username=os.getenv("PARAGON_USERNAME"),
-            password=os.getenv("PARAGON_PASSWORD"),
-        )
-        rClass = retsClient.get_resource('Property').get_class(rClass.name)
-        return getAndUpload(rClass, query, collection)
+        # Pages are uploaded by the shared writers while the next page of the search downloads, submitting waits while their queue is full
+        futures = []
+        for page in streamSearch(searchPage, batchSize=5000, convert=convert_decimal): # Decimal values become Decimal128, which pymongo can encode
+            futures += getWriterPool().submit("PARAGON", upload, page, collection, rClass.name)
+            resultsCount += len(page)
+        failedWrites = waitFor(futures, "PARAGON")
     except AttributeError as exc:
         print("    PARAGON: failed", exc)
         traceback.print_exc()
-        return rClass
+        failedQueries.append(query)
+        return False
     except Exception as exc:
         # AttributeError is not a result of the query coming back empty, this needs to be fixed
+        # This includes HTTP and connection errors that ran out of retries, and searches skipped because PARAGON keeps failing
         print("    PARAGON: failed", exc)
         traceback.print_exc()
-        time.sleep(.5)
-        return rClass
+        failedQueries.append(query)
+        limiter.backoff(.5)
+        return False
     else:
-        batchSize = 1000
-        resultsCount = len(search_result)
-        it = time.time()
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            futures = {}
-            while len(search_result) != 0:
-                futures[executor.submit(
-                    uploadMany,
-                    search_result[:batchSize],
-                    collection,
-                    rClass.name
-                )] = len(search_result[:batchSize])
-                search_result = search_result[batchSize:]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    future.result()
-                except Exception as exc:
-                    print('    PARAGON: Exception: %s' % exc)
-        it = time.time()-it
-        print(f"    PARAGON: Inserting {resultsCount} docs from query {query} took {round(st, 1)} seconds to search and {round(it, 1)} seconds to insert.")
-        return rClass
-
-def seed(batches:int = 1) -> None:
-    load_dotenv(verbose=True)
-    mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-    mongoClient = MongoClient(mongoConnectionString) # Our database connector
-    dbCollection = mongoClient["paragon"]['Property']
+        if failedWrites:
+            failedQueries.append(query)
+        print(f"    PARAGON: Searching and inserting {resultsCount} docs from query {query} took {round(time.time()-st, 1)} seconds.")
+        return not failedWrites
+
+class SeedLedger:
+    def __init__(self, batches: int, staged: bool = False):
+        """The work units of a seed that already finished, saved to paragonSeed.json after each one so that
+        a restarted seed skips them. A ledger from a seed with a different number of batches, or staged
+        differently, is started over"""
+        self.batches = batches
+        self.staged = staged
+        self.lock = threading.Lock()
+        try:
+            with open(seedLedgerFile) as json_file:
+                ledger = json.load(json_file)
+        except (FileNotFoundError, ValueError):
+            ledger = {}
+        resumable = ledger.get("batches") == batches and ledger.get("staged", False) == staged
+        self.done = set(ledger.get("done", [])) if resumable else set()
+
+    def finished(self, unit: str) -> bool:
+        return unit in self.done
+
+    def finish(self, unit: str) -> None:
+        with self.lock:
+            self.done.add(unit)
+            # Written to a temporary file and moved over the ledger, so a seed killed mid write doesn't lose every finished unit
+            temporary = seedLedgerFile + ".tmp"
+            with open(temporary, 'w') as outfile:
+                json.dump({"batches": self.batches, "staged": self.staged, "done": sorted(self.done)}, outfile)
+            os.replace(temporary, seedLedgerFile)
 
-    retsClient =  RetsClient(
-        login_url=os.getenv("PARAGON_LOGIN_URL"),
-        username=os.getenv("PARAGON_USERNAME"),
-        password=os.getenv("PARAGON_PASSWORD"),
-    )
+    def clear(self) -> None:
+        # The seed finished, the next one starts over
+        with self.lock:
+            self.done = set()
+            if os.path.exists(seedLedgerFile):
+                os.remove(seedLedgerFile)
 
-    for rClass in retsClient.get_resource('Property').classes:
-        print("    PARAGON: Updating class:", rClass.name)
-        maxID = 50000000
-        step = maxID // batches
+def seedUnit(className: str, query: str, collection, ledger: SeedLedger, upload=uploadMany) -> None:
+    # Search one class for one L_ListingID window on a pooled session, and record it in the ledger if nothing failed
+    unit = f"{className} {query}"
+    with retsPool.session() as session:
+        uploaded = getAndUpload(session.getClass('Property', className), query, collection, session, upload)
+    if uploaded:
+        ledger.finish(unit)
+
+def seed(batches: int = 1, sessions: int = None, staged: bool = False) -> None:
+    """Seed every Property class, split into batches L_ListingID windows. The (class, window) units are searched
+    on up to sessions RETS sessions at once, and units that finished in an earlier run are skipped
+
+    Args:
+        batches (int, optional): The number of L_ListingID windows per class. Defaults to 1.
+        sessions (int, optional): RETS sessions searched in parallel, keep it within the server's session limit. Defaults to PARAGON_SESSIONS in .env, or 1.
+        staged (bool, optional): Insert into a staging collection that replaces paragon.Property when every unit is done, see stagedSeed. Defaults to False.
+    """
+    mongoClient = getClient("seed") # Our database connector
+    dbCollection = mongoClient["paragon"]['Property']
+    sessions = sessions or int(os.getenv("PARAGON_SESSIONS", 1))
+    retsPool.resize(sessions)
+    ledger = SeedLedger(batches, staged)
+    upload = uploadMany
+    collection = dbCollection
+    if staged:
+        upload = stageMany
+        collection = stagingCollection(dbCollection, fresh=not ledger.done) # A resumed seed keeps what it already staged
+    started = datetime.datetime.now(datetime.timezone.utc)
+
+    with retsPool.session() as session:
+        classNames = [rClass.name for rClass in session.getClasses('Property')]
+    maxID = 50000000
+    step = maxID // batches
+    units = []
+    for className in classNames:
         for minID in range(0, maxID, step):
-            query = f"(L_ListingID={minID}-{minID+step})"
-            rClass = getAndUpload(rClass, query, dbCollection)
+            units.append((className, f"(L_ListingID={minID}-{minID+step})"))
         for query in ["(L_ListingID=0-)", "(L_ListingID=50000000+)"]:
-            rClass = getAndUpload(rClass, query, dbCollection)
+            units.append((className, query))
+    remaining = [(className, query) for className, query in units if not ledger.finished(f"{className} {query}")]
+    print(f"    PARAGON: Seeding {len(remaining)} of {len(units)} class and ID windows with {sessions} sessions")
+
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        futures = [executor.submit(seedUnit, className, query, collection, ledger, upload) for className, query in remaining]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as exc: # Logging in failed, the unit is left for the next run
+                print('    PARAGON: Exception: %s' % exc)
+    print(f"    PARAGON: Seed finished, {len(ledger.done)} of {len(units)} class and ID windows done")
+    if len(ledger.done) == len(units):
+        if staged:
+            swapIn(collection, dbCollection, "L_ListingID", started) # PARAGON has no update, nothing else writes paragon.Property during the seed
+        ledger.clear()
 
 
 if __name__ == "__main__":
-    seed(1000)
\ No newline at end of file
+    seed(1000)
@@ -10,10 +10,13 @@ from pymongo import MongoClient, UpdateOne, ReplaceOne
 import urllib3
 from pprint import pprint
 
-load_dotenv(verbose=True)
-mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') 
-mongoClient = MongoClient(mongoConnectionString)
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+
+mongoClient = getClient("sync") # Our database connector
 Collection = mongoClient["rebny"]["Property"]
+limiter = getLimiter("REBNY")
 
 def uploadListings(listings, skip):
     bulkRequests = []
@@ -28,22 +31,23 @@ def uploadListings(listings, skip):
             )
         )
     replacementResult = Collection.bulk_write(bulkRequests, ordered=False)
+    listingsWritten(Collection, listings) # Clean the listings for the dashboard and tell it its caches are stale
     latestTime = listings[-1]['ModificationTimestamp']
     logging.info(f'    REBNY: Inserted: {replacementResult.inserted_count}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings for skip {skip} with most recent time {latestTime}')
     return latestTime
 
 def getRequest(query, headers=None):
-    # A wrapper around requests.get in order to catch errors
+    # A wrapper around requests.get in order to catch errors. Throttled requests are waited out by the limiter
     try:
-        response = requests.get(query, headers=headers)
+        response = limiter.get(query, headers=headers)
     except (urllib3.exceptions.MaxRetryError, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
         logging.info(f"Max retries exceeded for query {query}. Waiting 10 seconds and trying again...")
-        time.sleep(10)
-        return requests.get(query, headers=headers)
+        limiter.backoff(10)
+        return limiter.get(query, headers=headers)
     if not response.ok:
         logging.warning(f"Response code {response.status_code} for query {query}. Waiting 10 seconds and trying again...")
-        time.sleep(10)
-        return requests.get(query, headers=headers)
+        limiter.backoff(10)
+        return limiter.get(query, headers=headers)
     return response
 
 def seedREBNY(skip=None, oldestTimestamp="2000-07-29T02:25:16.000Z"):
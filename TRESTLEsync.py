@@ -13,12 +13,15 @@ import urllib3
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth2Session
 
+from listingsClean import listingsWritten
+from mongoClients import getClient
+from rateLimiter import getLimiter
+
 data_uri = "https://api-trestle.corelogic.com/trestle/odata/Property"
-load_dotenv(verbose=True)
-mongoConnectionString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') 
-client = MongoClient(mongoConnectionString)
+client = getClient("sync") # Our database connector
 db = client["housing-prices"]
 Collection = db["trestle"]
+limiter = getLimiter("TRESTLE")
 
 listings_uploaded = 0
 
@@ -45,18 +48,19 @@ def uploadListings(listings):
             )
         )
     replacementResult = Collection.bulk_write(bulkRequests, ordered=False)
+    listingsWritten(Collection, listings) # Clean the listings for the dashboard and tell it its caches are stale
     latestTime = listings[-1]['ModificationTimestamp']
     logging.info(f'    TRESTLE: Inserted: {replacementResult.inserted_count}, upserted: {replacementResult.upserted_count}, modified: {replacementResult.modified_count} listings for skip {skip} with most recent time {latestTime}')
     return latestTime
 
 def getRequest(session, query):
-    # A wrapper around requests.get in order to catch errors
+    # A wrapper around session.get in order to catch errors. Throttled requests are waited out by the limiter
     try:
-        return session.get(query)
+        return limiter.get(query, session)
     except (urllib3.exceptions.MaxRetryError, requests.exceptions.ConnectionError):
         logging.info(f"Max retries exceeded for query {query}. Waiting 10 seconds and trying again...")
-        time.sleep(10)
-        return session.get(query)
+        limiter.backoff(10)
+        return limiter.get(query, session)
 
 def update(timeDelta):
     seedTrestle(None, timeDelta)
@@ -87,7 +91,7 @@ def seedTrestle(skip=None, timeDelta: datetime.timedelta=None,  oldestTimestamp=
     
 
     # Make the first API call
-    result = session.get(str)
+    result = getRequest(session, str)
     resJson = result.json()
     
     
@@ -104,14 +108,14 @@ def seedTrestle(skip=None, timeDelta: datetime.timedelta=None,  oldestTimestamp=
         if session.token: # Check if token expired
             oldestTimestamp = uploadListings(resJson['value'])
             if '@odata.nextLink' in resJson:
-                result = session.get(resJson['@odata.nextLink'])
+                result = getRequest(session, resJson['@odata.nextLink'])
                 logging.info(f"Next Request Link: {resJson['@odata.nextLink']}")
                 resJson = result.json()
             else:
                 resJson = None
         else: # Access Token Expired: Get token and call next
             session = getAccessToken()
-            result = session.get(resJson['@odata.nextLink'])
+            result = getRequest(session, resJson['@odata.nextLink'])
             resJson = result.json()
     logging.info(f"    TRESTLE: Sync finished. Skip: {skip}, oldestTimestamp: {oldestTimestamp}, final status code: {result.status_code}")
     if not result.ok:
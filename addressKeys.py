@@ -0,0 +1,95 @@
+# Author: Andrew Pantera for TLCengine
+# Normalized address keys for point lookups by address. propertyTaxApi used
+# to match the address typed in the URL against the raw address fields, with
+# case munging rebuilt in every route. Every record now carries its address
+# normalized the same way the API normalizes the URL: upper case,
+# punctuation and underscores as spaces, runs of spaces collapsed. Each
+# collection has a compound index on the key and the fields looked up with it.
+# The BRIDGE sync keys listings as it writes them. The tax collections are
+# loaded outside this repo, so run this file after loading them to key their
+# new records, store their LAST-YEAR-TAX as a number so the API doesn't
+# parse it on every request, build the indexes and tell the API its cached
+# responses are stale:
+#   python3 addressKeys.py
+
+import logging
+import re
+
+from pymongo import ASCENDING, UpdateOne
+
+from dataVersions import publishVersion
+from mongoClients import getClient, taxConnectionString
+
+taxDatabase = 'housing-tax-prices'
+taxKeyField = 'ADDRESS-KEY' # The key of STREET-ADDRESS in the tax collections
+taxIndex = [(taxKeyField, ASCENDING), ("ZIP-CODE", ASCENDING)]
+sequenceIndex = [("RECORD-KEY", ASCENDING), ("year", ASCENDING)] # Lets propertyTax_RNN's $sort of each property's records by year walk the index instead of sorting in memory
+taxAmountField = 'LAST-YEAR-TAX-AMOUNT' # LAST-YEAR-TAX as a number
+bridgeDatabase = 'housing-prices'
+bridgeCollection = 'bridge'
+bridgeKeyField = 'AddressKey' # The key of "StreetNumber StreetName" in bridge
+bridgeIndex = [(bridgeKeyField, ASCENDING), ("PostalCode", ASCENDING), ("CountyOrParish", ASCENDING)]
+
+separators = re.compile(r"[\W_]+")
+nonDigits = re.compile(r"\D+")
+
+def addressKey(address) -> str:
+    # "12 Main_st." and "12 MAIN ST" both become "12 MAIN ST"
+    if address is None:
+        return None
+    return separators.sub(" ", str(address)).strip().upper() or None
+
+def bridgeAddressKey(listing: dict) -> str:
+    # Bridge listings are looked up by street number and name, the suffix and unit aren't part of the key
+    if not listing.get("StreetNumber") or not listing.get("StreetName"):
+        return None
+    return addressKey(f'{listing["StreetNumber"]} {listing["StreetName"]}')
+
+def taxAmount(tax) -> int:
+    # The digits of a LAST-YEAR-TAX like "$12,345" as a number, None when there are none. Numbers are kept as they are
+    if isinstance(tax, int) or tax is None:
+        return tax
+    digits = nonDigits.sub("", str(tax))
+    return int(digits) if digits else None
+
+def keyCollection(collection, keyField: str, fields: list, keyOf, batchSize: int = 5000) -> int:
+    """Set keyField on the records of collection that don't have it yet
+
+    Args:
+        collection (pymongo.collection.Collection): The collection to key
+        keyField (str): The field the key is stored in
+        fields (list): The fields keyOf needs
+        keyOf (Callable): Returns the key of a record holding fields
+
+    Returns:
+        int: The number of records keyed
+    """
+    keyed = 0
+    batch = []
+    for record in collection.find({keyField: {"$exists": False}}, dict.fromkeys(fields, 1), batch_size=batchSize):
+        batch.append(UpdateOne({"_id": record["_id"]}, {"$set": {keyField: keyOf(record)}}))
+        if len(batch) >= batchSize:
+            keyed += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        keyed += collection.bulk_write(batch, ordered=False).modified_count
+    return keyed
+
+def main() -> None:
+    client = getClient("seed", taxConnectionString()) # The server propertyTaxApi reads the tax records and bridge listings from
+    taxes = client[taxDatabase]
+    for county in taxes.list_collection_names(filter={"type": "collection", "name": {"$not": {"$regex": r"^system\."}}}):
+        keyed = keyCollection(taxes[county], taxKeyField, ["STREET-ADDRESS"], lambda record: addressKey(record.get("STREET-ADDRESS")))
+        keyCollection(taxes[county], taxAmountField, ["LAST-YEAR-TAX"], lambda record: taxAmount(record.get("LAST-YEAR-TAX")))
+        taxes[county].create_index(taxIndex)
+        taxes[county].create_index(sequenceIndex)
+        publishVersion(taxes[county]) # propertyTaxApi's cached responses for the county are stale
+        logging.info(f"    {taxDatabase}.{county}: Keyed {keyed} records")
+    bridge = client[bridgeDatabase][bridgeCollection]
+    keyed = keyCollection(bridge, bridgeKeyField, ["StreetNumber", "StreetName"], bridgeAddressKey)
+    bridge.create_index(bridgeIndex)
+    logging.info(f"    {bridgeDatabase}.{bridgeCollection}: Keyed {keyed} listings")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -2,8 +2,8 @@
 # Last Updated: 10/12/2024
 # Streamlit app to serve as a front end for two housing prices databases (NJ and MA) to provide an interactive dashboard of MLS data
 
+import collections
 import json
-import math
 import os
 from datetime import datetime, timedelta
 from typing import Any, Callable, Sequence
@@ -13,24 +13,22 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
-from pandas.tseries.offsets import MonthEnd
 from pymongo import MongoClient
 from scipy import stats
 
 import MLS
+from mongoClients import getClient
 
 load_dotenv(verbose=True) 
 st.set_page_config(page_title='TLC Housing Prices Dashboard', page_icon ='https://pbs.twimg.com/profile_images/1068265299932114944/8Mvh266i.jpg', layout = 'wide')
 st.sidebar.image("https://static1.squarespace.com/static/5bd66859c2ff616bbd26a33b/t/5bd66e6db208fc08df43271f/1610621824459/?format=1500w") # Display TLC logo
-mongoString = (f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/') # Assemble string used to connect to mongodb from geo2
-client = MongoClient(mongoString)
+client = getClient("dashboard")
 pd.set_option('mode.chained_assignment', None) # Turn off a pandas warning 
 #MLSDict = MLS.getMLSs()
 
 months = ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December')
 maxYears = 20
-listings_group = []
-filteredListings_group = [None, None, None, None]
+datasets_group = [None, None, None, None]
 dataset_names = {}
 
 def vaidateQueryParam(paramName: str, paramType: type, default, validationFunction: Callable[[Any], bool] = lambda x: True):
@@ -253,13 +251,13 @@ def makeChart(chart, title, data, rolling, description=None, sumTotalData=True,
                     )
                 )
 
-def getListings(dataset):
-    listings = None
+def getQuery(dataset):
     states = tuple(MLSDict)
 
     # load choices from query paramaters
     target_State = st.selectbox(
         "State", states, key="target_State"+str(dataset), index=states.index(vaidateQueryParam(f"d{dataset}state", str, states[0], lambda x: x in states)))
+    MLSDict[target_State].refresh() # Pick up counties, cities and zip codes the ETL added since they were read
     unit = vaidateQueryParam(f"d{dataset}unit", str, None, lambda x: x in ('CountyOrParish', 'City', 'PostalCode'))
     target_counties = None if unit != 'CountyOrParish' else vaidateQueryParam(f"d{dataset}target_units", list, None, lambda x: all(map(lambda y: isinstance(y, str), x)))
     target_cities = None if unit != 'City' else vaidateQueryParam(f"d{dataset}target_units", list, None, lambda x: all(map(lambda y: isinstance(y, str), x)))
@@ -298,227 +296,252 @@ def getListings(dataset):
             target_units = target_zip_codes
             unit = "PostalCode"
 
-    listings = MLSDict[target_State].getListings(unit, target_units)
-    return target_State, unit, target_units, listings
+    return target_State, unit, target_units
+
+def getFilters(dataset, state, unit, targetUnits):
+    """Show the dataset's filters, starting from the values its listings have
 
-def filterListings(listings, dataset):
-    # Filter listings
+    Returns:
+        tuple: The filters as JSON for the query paramaters, the filters keyed by RESO field for MLS.aggregateMonthly, and the outlier filter (method, tails, field, limit), or None when it isn't used
+    """
     filtersPossibilities = ["Property Type", "Listing Status", "List Price", "Bathrooms Count", "Bedrooms Count", "Lot Size Square Feet", "Price Per Square Foot", "Outliers", "Year Built"]
-    filteredListings = listings
     filtersDict = json.loads(vaidateQueryParam(f"d{dataset}filter", str, "{}"))
     filtersParamList = list(filter(lambda x: x in filtersPossibilities, filtersDict))
     filtersList = st.multiselect("Data Filters", filtersPossibilities, filtersParamList if filtersParamList else ["Property Type"], key="filtersList"+str(dataset))
-    if listings is not None and not listings.empty:
-        if filtersList:
-            # This would be a good spot for another expander if nesting them was allowed, maybe revisit later if the feature changes
-            if "Property Type" in filtersList:
-                dictType = filtersDict.get("Property Type")
-                typesPresent = list(filter(bool, set(listings.PropertyType.tolist()))) # The filter removes "None" from the list
-                dictType = dictType if dictType and isinstance(dictType, list) and all(map(lambda x: x in typesPresent, dictType)) else None
-                typesExcludingRent = list(filter(lambda x: "rent" not in x.lower() and "lease" not in x.lower(), typesPresent)) if typesPresent else []
-                if 'S-Closed/Rented' in typesPresent: # This property type includes the word rent, but can also mean just any closed listing
-                    typesExcludingRent.append('S-Closed/Rented')
-                types = st.multiselect("Property Type", typesPresent, default=dictType if dictType else (None if filtersDict else typesExcludingRent), key="types"+str(dataset))
-                filteredListings = filteredListings.loc[filteredListings["PropertyType"].isin(types)]
-                filtersDict["Property Type"] = types
-
-            if "List Price" in filtersList:
-                dictPrice = filtersDict.get("List Price")
-                dictPrice = dictPrice if dictPrice and isinstance(dictPrice, list) and len(dictPrice) == 2 and isinstance(dictPrice[0], int) and isinstance(dictPrice[1], int) and dictPrice[0] <= dictPrice[1] else None
-                min_price = st.number_input(
-                    "Min List Price", value=dictPrice[0] if dictPrice else 0, step=50000, key="min_price"+str(dataset))
-                max_price = st.number_input(
-                    'Max List Price', value=dictPrice[1] if dictPrice else int(max(1, filteredListings['ListPrice'].max())), step=50000, key="max_price"+str(dataset))
-                filteredListings = filteredListings[filteredListings['ListPrice'] <= max_price][filteredListings['ListPrice'] >= min_price]
-                filtersDict["List Price"] = (min_price, max_price)
-
-            if "Bathrooms Count" in filtersList:
-                dictBathCount = filtersDict.get("Bathrooms Count")
-                dictBathCount = dictBathCount if dictBathCount and isinstance(dictBathCount, list) and len(dictBathCount) == 2 and isinstance(dictBathCount[0], int) and isinstance(dictBathCount[1], int) and 0 <= dictBathCount[0] <= dictBathCount[1] <= 10 else None
-                (min_bathrooms, max_bathrooms) = st.slider("Bathrooms Count", 0.0, 10.0, dictBathCount if dictBathCount else (0.0, 10.0), 0.5, key="bathrooms"+str(dataset))
-                filteredListings = filteredListings[filteredListings['BathroomsTotalDecimal'] <= max_bathrooms][filteredListings['BathroomsTotalDecimal'] >= min_bathrooms]
-                filtersDict["Bathrooms Count"] = (min_bathrooms, max_bathrooms)
-
-            if "Bedrooms Count" in filtersList:
-                dictBedCount = filtersDict.get("Bedrooms Count")
-                dictBedCount = dictBedCount if dictBedCount and isinstance(dictBedCount, list) and len(dictBedCount) == 2 and isinstance(dictBedCount[0], int) and isinstance(dictBedCount[1], int) and 0 <= dictBedCount[0] <= dictBedCount[1] <= 10 else None
-                (min_bedrooms, max_bedrooms) = st.slider("Bedrooms Count", 0, 10, dictBedCount if dictBedCount else (0, 10), 1, key="bedrooms"+str(dataset))
-                filteredListings = filteredListings[filteredListings['BedroomsTotal'] <= max_bedrooms][filteredListings['BedroomsTotal'] >= min_bedrooms]
-                filtersDict["Bedrooms Count"] = (min_bedrooms, max_bedrooms)
-
-            if "Lot Size Square Feet" in filtersList:
-                dictLSSqft = filtersDict.get("Lot Size Square Feet")
-                dictLSSqft = dictLSSqft if dictLSSqft and isinstance(dictLSSqft, list) and len(dictLSSqft) == 2 and isinstance(dictLSSqft[0], int) and isinstance(dictLSSqft[1], int) and dictLSSqft[0] <= dictLSSqft[1] else None
-                min_sqft = st.number_input(
-                    "Min Square Feet", value=dictLSSqft[0] if dictLSSqft else 0, step=50, key="min_sqft"+str(dataset))
-                max_sqft = st.number_input(
-                    'Max Square Feet', value=dictLSSqft[1] if dictLSSqft else int(10000 if str(filteredListings['LotSizeSquareFeet'].max()) == 'nan' else filteredListings['LotSizeSquareFeet'].max()), step=50, key="max_sqft"+str(dataset))
-                filteredListings = filteredListings[filteredListings['LotSizeSquareFeet'] <= max_sqft][filteredListings['LotSizeSquareFeet'] >= min_sqft]
-                filtersDict["Lot Size Square Feet"] = (min_sqft, max_sqft)
-
-            if "Price Per Square Foot" in filtersList:
-                dictPPSqft = filtersDict.get("Price Per Square Foot")
-                dictPPSqft = dictPPSqft if dictPPSqft and isinstance(dictPPSqft, list) and len(dictPPSqft) == 2 and isinstance(dictPPSqft[0], float) and isinstance(dictPPSqft[1], float) and dictPPSqft[0] <= dictPPSqft[1] else None
-                filteredListings = filteredListings[filteredListings['ListPricePerSQFT'] != np.Inf]
-                min_ppsqft = st.number_input(
-                    "Min Price Per Square Feet", value=dictPPSqft[0] if dictPPSqft else 0.0, step=0.01, key="min_ppsqft"+str(dataset))
-                max_ppsqft = st.number_input(
-                    'Max Price PerSquare Feet', value=dictPPSqft[1] if dictPPSqft else filteredListings['ListPricePerSQFT'].max(), step=0.01, key="max_ppsqft"+str(dataset)) # It is possible to get a value of infinity for the mmax ListPricePerSQFT, so we need to cap the max possible value. 
-                filteredListings = filteredListings[filteredListings['ListPricePerSQFT'] <= max_ppsqft][filteredListings['ListPricePerSQFT'] >= min_ppsqft]
-                filtersDict["Price Per Square Foot"] = (min_ppsqft, max_ppsqft)
-
-            if "Year Built" in filtersList:
-                dictYearBuilt = filtersDict.get("Year Built")
-                dictYearBuilt = dictYearBuilt if dictYearBuilt and isinstance(dictYearBuilt, list) and len(dictYearBuilt) == 2 and isinstance(dictYearBuilt[0], float) and isinstance(dictYearBuilt[1], float) and dictYearBuilt[0] <= dictYearBuilt[1] else None
-                min_yearBuilt = st.number_input(
-                    "Min Year Built", value=dictYearBuilt[0] if dictYearBuilt else 1920, step=10, key="min_yearBuilt"+str(dataset))
-                max_yearBuilt = st.number_input(
-                    'Max Year Built', value=dictYearBuilt[1] if dictYearBuilt else int(2100 if str(filteredListings['YearBuilt'].max()) == 'nan' else filteredListings['YearBuilt'].max()), step=10, key="max_yearBuilt"+str(dataset))
-                filteredListings = filteredListings[filteredListings['YearBuilt'] <= max_yearBuilt][filteredListings['YearBuilt'] >= min_yearBuilt]
-                filtersDict["Year Built"] = (min_yearBuilt, max_yearBuilt)
-
-            if "Listing Status" in filtersList:
-                dictStatus = filtersDict.get("Listing Status")
-                statusesPresent = list(set(listings.StandardStatus.tolist()))
-                dictStatus = dictStatus if dictStatus and isinstance(dictStatus, list) and all(map(lambda x: x in statusesPresent, dictStatus)) else None
-                status = st.multiselect("Listing Status", statusesPresent, key="status"+str(dataset), default=statusesPresent if statusesPresent else None)
-                filteredListings = filteredListings.loc[filteredListings["StandardStatus"].isin(status)]
-                filtersDict["Listing Status"] = status
-
-            if "Outliers" in filtersList: 
-                # This filters out univariate outliers from a single field. If a cell value in the selected field column is an outlier in that column, the whole row is removed. This does not remove outliers month to month 
-                methods = ["IQRs", "Standard Deviations"]
-                tails = ["Both", "Low Outliers", "High Outliers"]
-                fields = list(set(filteredListings.columns)-set(("_id", "StandardStatus", "OffMarketDate", "City", "OnMarketDate", "YearBuilt", "CloseDate", "StateOrProvince", "PostalCode", "Latitude", "Longitude", "CountyOrParish", "PropertyType")))
-
-                dictOutliers = filtersDict.get("Outliers") # Takes the form (method:str, tails: str, field: str, limit:float)
-                dictOutliers = dictOutliers if dictOutliers and isinstance(dictOutliers, Sequence) and len(dictOutliers) == 4 and dictOutliers[0] in methods and dictOutliers[1] in tails and dictOutliers[2] in fields and isinstance(dictOutliers[3], float) else None
-
-
-                method = st.selectbox("Filter out outliers by", methods, index=methods.index(dictOutliers[0]) if dictOutliers else 0)
-                tails = st.selectbox("Remove", tails, index=tails.index(dictOutliers[1]) if dictOutliers else 0)
-                field = st.selectbox("Filter all listings by field", fields, index=fields.index(dictOutliers[2]) if dictOutliers else 0) # There is probably a better way to do this instead of hardcoding, like excluding listings that aren't numerical by data type, or a mapping between fields and whether they're quantitative or categorical
-                # The z score is a measure of how many standard deviations below or above the population mean a raw score is
-                limit = st.number_input(method, value=dictOutliers[3] if dictOutliers else (1.5 if method == "IQRs" else 3.0))
-                
-                # filteredListings[field] = filteredListings[field].dropna()
-                filteredListings = filteredListings.loc[filteredListings[field] != 0.0]
-                iqr = stats.iqr(filteredListings[field])
-                q25, q75 = np.percentile(filteredListings[field], 25), np.percentile(filteredListings[field], 75)
-                lower, upper = q25 - limit*iqr, q75 + limit*iqr
-  
-                filteredListings = filteredListings.loc[
-                    {
-                        "Both": (lambda fl: (fl[field] > lower) & (fl[field] < upper)) if method == 'IQRs' else 
-                            (lambda fl: ((stats.zscore(fl[field]) > -limit) & (stats.zscore(fl[field]) < limit))), 
-                        "Low Outliers": (filteredListings[field] > lower) if method == 'IQRs' else 
-                            (stats.zscore(filteredListings[field]) > -limit), 
-                        "High Outliers": (filteredListings[field] < upper) if method == 'IQRs' else 
-                            (stats.zscore(filteredListings[field]) < limit)
-                    }[tails]
-                ]
-                filtersDict["Outliers"] = (method, tails, field, limit)
-
-
-            # filterOnMarketDate
-            # filterDaysOnMarket
-    return json.dumps(filtersDict), filteredListings
-
-def getConfidenceRegion(grouped: pd.core.groupby.generic.DataFrameGroupBy, interval: int) -> Sequence[Sequence[float]]:
-    """Creates two lists, one for the low confidence region, and one for the high confidence region
+    options = MLSDict[state].getFilterOptions(unit, targetUnits) # The property types, statuses and largest values present, found without loading the listings
+    outliers = None
+    # This would be a good spot for another expander if nesting them was allowed, maybe revisit later if the feature changes
+    if "Property Type" in filtersList:
+        dictType = filtersDict.get("Property Type")
+        typesPresent = options["PropertyType"]
+        dictType = dictType if dictType and isinstance(dictType, list) and all(map(lambda x: x in typesPresent, dictType)) else None
+        typesExcludingRent = list(filter(lambda x: "rent" not in x.lower() and "lease" not in x.lower(), typesPresent)) if typesPresent else []
+        if 'S-Closed/Rented' in typesPresent: # This property type includes the word rent, but can also mean just any closed listing
+            typesExcludingRent.append('S-Closed/Rented')
+        types = st.multiselect("Property Type", typesPresent, default=dictType if dictType else (None if filtersDict else typesExcludingRent), key="types"+str(dataset))
+        filtersDict["Property Type"] = types
+
+    if "List Price" in filtersList:
+        dictPrice = filtersDict.get("List Price")
+        dictPrice = dictPrice if dictPrice and isinstance(dictPrice, list) and len(dictPrice) == 2 and isinstance(dictPrice[0], int) and isinstance(dictPrice[1], int) and dictPrice[0] <= dictPrice[1] else None
+        min_price = st.number_input(
+            "Min List Price", value=dictPrice[0] if dictPrice else 0, step=50000, key="min_price"+str(dataset))
+        max_price = st.number_input(
+            'Max List Price', value=dictPrice[1] if dictPrice else int(max(1, options["ListPrice"] or 1)), step=50000, key="max_price"+str(dataset))
+        filtersDict["List Price"] = (min_price, max_price)
+
+    if "Bathrooms Count" in filtersList:
+        dictBathCount = filtersDict.get("Bathrooms Count")
+        dictBathCount = dictBathCount if dictBathCount and isinstance(dictBathCount, list) and len(dictBathCount) == 2 and isinstance(dictBathCount[0], int) and isinstance(dictBathCount[1], int) and 0 <= dictBathCount[0] <= dictBathCount[1] <= 10 else None
+        (min_bathrooms, max_bathrooms) = st.slider("Bathrooms Count", 0.0, 10.0, dictBathCount if dictBathCount else (0.0, 10.0), 0.5, key="bathrooms"+str(dataset))
+        filtersDict["Bathrooms Count"] = (min_bathrooms, max_bathrooms)
+
+    if "Bedrooms Count" in filtersList:
+        dictBedCount = filtersDict.get("Bedrooms Count")
+        dictBedCount = dictBedCount if dictBedCount and isinstance(dictBedCount, list) and len(dictBedCount) == 2 and isinstance(dictBedCount[0], int) and isinstance(dictBedCount[1], int) and 0 <= dictBedCount[0] <= dictBedCount[1] <= 10 else None
+        (min_bedrooms, max_bedrooms) = st.slider("Bedrooms Count", 0, 10, dictBedCount if dictBedCount else (0, 10), 1, key="bedrooms"+str(dataset))
+        filtersDict["Bedrooms Count"] = (min_bedrooms, max_bedrooms)
+
+    if "Lot Size Square Feet" in filtersList:
+        dictLSSqft = filtersDict.get("Lot Size Square Feet")
+        dictLSSqft = dictLSSqft if dictLSSqft and isinstance(dictLSSqft, list) and len(dictLSSqft) == 2 and isinstance(dictLSSqft[0], int) and isinstance(dictLSSqft[1], int) and dictLSSqft[0] <= dictLSSqft[1] else None
+        min_sqft = st.number_input(
+            "Min Square Feet", value=dictLSSqft[0] if dictLSSqft else 0, step=50, key="min_sqft"+str(dataset))
+        max_sqft = st.number_input(
+            'Max Square Feet', value=dictLSSqft[1] if dictLSSqft else int(options["LotSizeSquareFeet"] or 10000), step=50, key="max_sqft"+str(dataset))
+        filtersDict["Lot Size Square Feet"] = (min_sqft, max_sqft)
+
+    if "Price Per Square Foot" in filtersList:
+        dictPPSqft = filtersDict.get("Price Per Square Foot")
+        dictPPSqft = dictPPSqft if dictPPSqft and isinstance(dictPPSqft, list) and len(dictPPSqft) == 2 and isinstance(dictPPSqft[0], float) and isinstance(dictPPSqft[1], float) and dictPPSqft[0] <= dictPPSqft[1] else None
+        min_ppsqft = st.number_input(
+            "Min Price Per Square Feet", value=dictPPSqft[0] if dictPPSqft else 0.0, step=0.01, key="min_ppsqft"+str(dataset))
+        max_ppsqft = st.number_input(
+            'Max Price PerSquare Feet', value=dictPPSqft[1] if dictPPSqft else float(options["ListPricePerSQFT"] or 0.0), step=0.01, key="max_ppsqft"+str(dataset)) # The largest value leaves out infinite prices per square foot, of listings without a building area
+        filtersDict["Price Per Square Foot"] = (min_ppsqft, max_ppsqft)
+
+    if "Year Built" in filtersList:
+        dictYearBuilt = filtersDict.get("Year Built")
+        dictYearBuilt = dictYearBuilt if dictYearBuilt and isinstance(dictYearBuilt, list) and len(dictYearBuilt) == 2 and isinstance(dictYearBuilt[0], int) and isinstance(dictYearBuilt[1], int) and dictYearBuilt[0] <= dictYearBuilt[1] else None
+        min_yearBuilt = st.number_input(
+            "Min Year Built", value=dictYearBuilt[0] if dictYearBuilt else 1920, step=10, key="min_yearBuilt"+str(dataset))
+        max_yearBuilt = st.number_input(
+            'Max Year Built', value=dictYearBuilt[1] if dictYearBuilt else int(options["YearBuilt"] or 2100), step=10, key="max_yearBuilt"+str(dataset))
+        filtersDict["Year Built"] = (min_yearBuilt, max_yearBuilt)
+
+    if "Listing Status" in filtersList:
+        dictStatus = filtersDict.get("Listing Status")
+        statusesPresent = options["StandardStatus"]
+        dictStatus = dictStatus if dictStatus and isinstance(dictStatus, list) and all(map(lambda x: x in statusesPresent, dictStatus)) else None
+        status = st.multiselect("Listing Status", statusesPresent, key="status"+str(dataset), default=dictStatus if dictStatus else statusesPresent if statusesPresent else None)
+        filtersDict["Listing Status"] = status
+
+    if "Outliers" in filtersList:
+        # This filters out univariate outliers from a single field. If a cell value in the selected field column is an outlier in that column, the whole row is removed. This does not remove outliers month to month 
+        methods = ["IQRs", "Standard Deviations"]
+        tails = ["Both", "Low Outliers", "High Outliers"]
+        fields = sorted(field for field, (_, kind) in MLS.listingFields.items() if kind is float and field not in ("Latitude", "Longitude"))
+
+        dictOutliers = filtersDict.get("Outliers") # Takes the form (method:str, tails: str, field: str, limit:float)
+        dictOutliers = dictOutliers if dictOutliers and isinstance(dictOutliers, Sequence) and len(dictOutliers) == 4 and dictOutliers[0] in methods and dictOutliers[1] in tails and dictOutliers[2] in fields and isinstance(dictOutliers[3], float) else None
+
+        method = st.selectbox("Filter out outliers by", methods, index=methods.index(dictOutliers[0]) if dictOutliers else 0, key="outlierMethod"+str(dataset))
+        tails = st.selectbox("Remove", tails, index=tails.index(dictOutliers[1]) if dictOutliers else 0, key="outlierTails"+str(dataset))
+        field = st.selectbox("Filter all listings by field", fields, index=fields.index(dictOutliers[2]) if dictOutliers else 0, key="outlierField"+str(dataset))
+        # The z score is a measure of how many standard deviations below or above the population mean a raw score is
+        limit = st.number_input(method, value=dictOutliers[3] if dictOutliers else (1.5 if method == "IQRs" else 3.0), key="outlierLimit"+str(dataset))
+        outliers = (method, tails, field, limit)
+        filtersDict["Outliers"] = outliers
+
+    # filterOnMarketDate
+    # filterDaysOnMarket
+    filters = {monthlyFilterFields[name]: filtersDict[name] for name in filtersList if name in monthlyFilterFields}
+    if "YearBuilt" in filters: # YearBuilt is stored as a date
+        filters["YearBuilt"] = (datetime(int(filters["YearBuilt"][0]), 1, 1), datetime(int(filters["YearBuilt"][1]), 12, 31))
+    filters = {field: tuple(allowed) if isinstance(allowed, tuple) else list(allowed) for field, allowed in filters.items()}
+    return json.dumps(filtersDict), filters, outliers
+
+def removeOutliers(listings: pd.DataFrame, outliers: Sequence) -> pd.DataFrame:
+    # Remove the listings whose value of the field is an outlier, see the Outliers filter
+    method, tails, field, limit = outliers
+    listings = listings.loc[listings[field] != 0.0]
+    iqr = stats.iqr(listings[field])
+    q25, q75 = np.percentile(listings[field], 25), np.percentile(listings[field], 75)
+    lower, upper = q25 - limit*iqr, q75 + limit*iqr
+    return listings.loc[
+        {
+            "Both": (lambda fl: (fl[field] > lower) & (fl[field] < upper)) if method == 'IQRs' else 
+                (lambda fl: ((stats.zscore(fl[field]) > -limit) & (stats.zscore(fl[field]) < limit))), 
+            "Low Outliers": (listings[field] > lower) if method == 'IQRs' else 
+                (stats.zscore(listings[field]) > -limit), 
+            "High Outliers": (listings[field] < upper) if method == 'IQRs' else 
+                (stats.zscore(listings[field]) < limit)
+        }[tails]
+    ]
+
+def getConfidenceRegion(mean: pd.Series, std: pd.Series, count: pd.Series, interval: int) -> Sequence[pd.Series]:
+    """Creates two series, one for the high confidence region, and one for the low confidence region
 
     Args:
-        grouped (pandas.core.groupby.generic.DataFrameGroupBy): [description]
+        mean (pd.Series): The monthly means
+        std (pd.Series): The monthly standard deviations
+        count (pd.Series): The monthly number of values the means are of
         interval (int): The confidence interval, an int between 1 and 99
 
     Returns:
-        Sequence[Sequence[float]]: returns a tuple containing 2 lists, the first of which is the High confidence region, the second is the low
+        Sequence[pd.Series]: returns a tuple containing 2 series, the first of which is the High confidence region, the second is the low
     """
     # sourced from https://stackoverflow.com/questions/53519823/confidence-interval-in-python-dataframe
-    stat = grouped.agg(['mean', 'count', 'std'])
-    ci_hi = []
-    ci_lo = []
-    for i in stat.index:
-        # This is never how this should be done, its so much slower than handing everything over to pandas or numpy to do it
-        m, c, s = stat.loc[i]
-        ci_hi.append(m + stats.norm.ppf(1-((100-confidenceInterval)/2)/100)*s/math.sqrt(c))
-        ci_lo.append(m - stats.norm.ppf(1-((100-confidenceInterval)/2)/100)*s/math.sqrt(c))
-    return (ci_hi, ci_lo)
+    margin = stats.norm.ppf(1-((100-interval)/2)/100)*std/np.sqrt(count)
+    return (mean + margin, mean - margin)
+
+# The dashboard's filters the database applies, keyed to the RESO field they filter. Outliers are removed from the listings in pandas
+monthlyFilterFields = {
+    "Property Type": "PropertyType",
+    "Listing Status": "StandardStatus",
+    "List Price": "ListPrice",
+    "Bathrooms Count": "BathroomsTotalDecimal",
+    "Bedrooms Count": "BedroomsTotal",
+    "Lot Size Square Feet": "LotSizeSquareFeet",
+    "Price Per Square Foot": "ListPricePerSQFT",
+    "Year Built": "YearBuilt",
+}
+
+# A dataset in the sidebar: the MLS state, the unit and units it's queried by, the filters the database applies, and its listings
+# when it filters out outliers, which needs the listings themselves. None when it doesn't
+Dataset = collections.namedtuple("Dataset", ["state", "unit", "targetUnits", "filters", "listings"])
+
+def getDataset(dataset: int, state: str, unit: str, targetUnits: Sequence[str]) -> tuple:
+    """Show the dataset's filters and build the dataset the charts are made from
+
+    Returns:
+        tuple: The filters as JSON for the query paramaters, and the Dataset, or None when none of its listings pass its filters
+    """
+    filtersJson, filters, outliers = getFilters(dataset, state, unit, targetUnits)
+    if not MLSDict[state].getFilterOptions(unit, targetUnits)["count"]:
+        return filtersJson, None
+    listings = None
+    if outliers is not None: # Only the outlier filter needs the listings loaded
+        listings = removeOutliers(MLS.applyFilters(MLSDict[state].getListings(unit, targetUnits), filters), outliers)
+        if listings.empty:
+            return filtersJson, None
+    return filtersJson, Dataset(state, unit, targetUnits, filters, listings)
+
+def getMonthly(dataset: Dataset, metrics: Sequence[str]) -> pd.DataFrame:
+    """Chart metrics per month of a dataset, aggregated by the database from its query and filters unless it has listings
+
+    Args:
+        dataset (Dataset): The dataset to chart
+        metrics (Sequence[str]): Keys of MLS.monthlyMetrics
+
+    Returns:
+        pd.DataFrame: A 'Month' column with the first day of each month, and a column for each metric
+    """
+    if dataset.listings is not None:
+        return MLS.monthlyFromListings(dataset.listings, metrics)
+    # Every chart asks for every metric, so the charts of a dataset share one aggregation from the MLS's cache
+    monthly = MLSDict[dataset.state].aggregateMonthly(dataset.unit, dataset.targetUnits, dataset.filters)
+    return monthly[["Month", *metrics]]
 
 def processAndLabel(function, df, label):
     processedDf = function(df)
     processedDf["Label"] = label
     return processedDf
 
+
 with st.sidebar.expander("Dataset 1", expanded=True):
-    listings = None
-    filteredListings = None
-    d1state, d1unit, d1target_units, listings = getListings(1)
+    d1state, d1unit, d1target_units = getQuery(1)
     d1name = st.text_input("Dataset 1 Name", value=vaidateQueryParam("d1name", str, "Dataset 1", lambda x: 1 <= len(x)))
     dataset_names["Dataset 1"] = d1name
-    if listings is not None:
-        d1filter, filteredListings = filterListings(listings, 1)
-        listings_group.append(listings)
-        filteredListings_group[0] = filteredListings
+    if d1target_units:
+        d1filter, datasets_group[0] = getDataset(1, d1state, d1unit, d1target_units)
         if datasets == 1:
             # mabelo: changed experimental_set_query_params to query_params
             # st.experimental_set_query_params(datasets=datasets, d1name=d1name, d1unit=d1unit, d1target_units=d1target_units, d1state=d1state, d1filter=d1filter)
             # st.query_params
             st.query_params.update(datasets=datasets, d1name=d1name, d1unit=d1unit, d1target_units=d1target_units, d1state=d1state, d1filter=d1filter)
     else:
-        filteredListings_group[0] = None
+        datasets_group[0] = None
 
 if datasets >= 2: # I think i might benefit from implementing an object oriented structure here (update, I should make many things objects: the filters, the states, the datasets)
     with st.sidebar.expander("Dataset 2", expanded=True):
-        listings2 = None
-        filteredListings2 = None
-        d2state, d2unit, d2target_units, listings2 = getListings(2)
+        d2state, d2unit, d2target_units = getQuery(2)
         d2name = st.text_input("Dataset 2 Name", value=vaidateQueryParam("d2name", str, "Dataset 2", lambda x: 1 <= len(x)))
         dataset_names["Dataset 2"] = d2name
-        if listings2 is not None:
-            d2filter, filteredListings2 = filterListings(listings2, 2)
-            listings_group.append(listings2)
-            filteredListings_group[1] = filteredListings2
+        if d2target_units:
+            d2filter, datasets_group[1] = getDataset(2, d2state, d2unit, d2target_units)
             if datasets == 2:
                 st.experimental_set_query_params(datasets=datasets, d1name=d1name, d1unit=d1unit, d1target_units=d1target_units, d1state=d1state, d1filter=d1filter, d2name=d2name, d2unit=d2unit, d2target_units=d2target_units, d2state=d2state, d2filter=d2filter)
         else:
-            filteredListings_group[1] = None
+            datasets_group[1] = None
 
 if datasets >= 3: 
     with st.sidebar.expander("Dataset 3", expanded=True):
-        listings3 = None
-        filteredListings3 = None
-        d3state, d3unit, d3target_units, listings3 = getListings(3)
+        d3state, d3unit, d3target_units = getQuery(3)
         d3name = st.text_input("Dataset 3 Name", value=vaidateQueryParam("d3name", str, "Dataset 3", lambda x: 1 <= len(x)))
         dataset_names["Dataset 3"] = d3name
-        if listings3 is not None:
-            d3filter, filteredListings3 = filterListings(listings3, 3)
-            listings_group.append(listings3)
-            filteredListings_group[2] = filteredListings3
+        if d3target_units:
+            d3filter, datasets_group[2] = getDataset(3, d3state, d3unit, d3target_units)
             if datasets == 3:
                 st.experimental_set_query_params(datasets=datasets, d1name=d1name, d1unit=d1unit, d1target_units=d1target_units, d1state=d1state, d1filter=d1filter, d2name=d2name, d2unit=d2unit, d2target_units=d2target_units, d2state=d2state, d2filter=d2filter, d3name=d3name, d3unit=d3unit, d3target_units=d3target_units, d3state=d3state, d3filter=d3filter)
         else:
-            filteredListings_group[2] = None
+            datasets_group[2] = None
 
 if datasets >= 4: 
     with st.sidebar.expander("Dataset 4", expanded=True):
-        listings4 = None
-        filteredListings4 = None
-        d4state, d4unit, d4target_units, listings4 = getListings(4)
+        d4state, d4unit, d4target_units = getQuery(4)
         d4name = st.text_input("Dataset 4 Name", value=vaidateQueryParam("d4name", str, "Dataset 4", lambda x: 1 <= len(x)))
         dataset_names["Dataset 4"] = d4name
-        if listings4 is not None:
-            d4filter, filteredListings4 = filterListings(listings4, 4)
-            listings_group.append(listings4)
-            filteredListings_group[3] = filteredListings4
+        if d4target_units:
+            d4filter, datasets_group[3] = getDataset(4, d4state, d4unit, d4target_units)
             if datasets == 4:
                 st.experimental_set_query_params(datasets=datasets, d1name=d1name, d1unit=d1unit, d1target_units=d1target_units, d1state=d1state, d1filter=d1filter, d2name=d2name, d2unit=d2unit, d2target_units=d2target_units, d2state=d2state, d2filter=d2filter, d3name=d3name, d3unit=d3unit, d3target_units=d3target_units, d3state=d3state, d3filter=d3filter, d4name=d4name, d4unit=d4unit, d4target_units=d4target_units, d4state=d4state, d4filter=d4filter)
         else:
-            filteredListings_group[3] = None
+            datasets_group[3] = None
 
-filteredListings_group = list(filter(lambda x: x is not None and not x.empty, filteredListings_group))
+datasets_group = list(filter(lambda x: x is not None, datasets_group))
 
-if filteredListings_group != [] and all(map(lambda x: x is not None and not x.empty, filteredListings_group)):
+if datasets_group != []:
 # if filteredListings is not None:
     # Select which types of charts to display
     chartViews = st.sidebar.multiselect("Chart Type Views", ["Time Series Line Chart", "Stacked Line Chart", "Grouped Bar Chart"], default=["Time Series Line Chart", "Stacked Line Chart", "Grouped Bar Chart"])
@@ -559,14 +582,11 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "New Listings"
         title = "New Listings Per Month"
         description = "A count of the properties that have been newly listed on the market in a given month."
-        def getNewListings(filteredListings):
-            newListings = filteredListings.groupby([filteredListings['OnMarketDate'].dt.year.rename('year'), filteredListings['OnMarketDate'].dt.month.rename('month')], as_index=False).agg({'count'})[["_id"]]
-            newListings["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), newListings.index)))
-            newListings.columns = ['New Listings', 'Month']
-            return newListings
+        def getNewListings(dataset):
+            return getMonthly(dataset, ["New Listings"])
         newListings = pd.concat(map(
             lambda x, y: processAndLabel(getNewListings, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))
         ))
         makeChart(chart, title, newListings, rolling, description)
@@ -578,36 +598,16 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Homes for Sale"
         title = chart
         description = "The number of homes that were for sale at at least one point during the given month."
-        def getHomesForSale(filteredListings):
-            dr = pd.date_range(
-                end=datetime.today(),
-                periods=12*maxYears+2, # + 2 because the max time for rolling average is 24 months
-                freq="MS",
-                normalize=True,
-                name="Month"
-            )
-            homesForSale = pd.DataFrame(dr)
-            def getHomesForSaleMonth(givenMonth):
-                # return the number of listings that were put on market before the last day of the month, and that closed after the first day of the month
-                # If a listing has not closed, its close date will be 1800-01-01, so we need to account for that too. 
-                givenMonth = pd.to_datetime(givenMonth)
-                allHomesForSale = filteredListings.loc[
-                    lambda filteredListings: 
-                        (filteredListings["OnMarketDate"] <= givenMonth + MonthEnd(1)) & 
-                        ((filteredListings["CloseDate"] >= givenMonth) | (~filteredListings["StandardStatus"].isin(["Closed", "Sold", "Expired", "Canceled", "Cancelled", "Killed", "Under Agreement", "Rented", "Deposit", "S-Closed/Rented", 'T-Temp Off Market', 'X-Expired', 'Sold-REO', 'Rented-Leased', 'Sold-Short Sale', 'Withdrawn']))),
-                    ["OnMarketDate", "CloseDate", "DaysOnMarket", "StandardStatus"]
-                ]
-                return allHomesForSale.shape[0]
-            homesForSale["Homes for Sale"] = homesForSale["Month"].apply(getHomesForSaleMonth)
-            emptyMonths = homesForSale.loc[homesForSale["Homes for Sale"] == 0].index
-            homesForSale.drop(emptyMonths, axis=0, inplace=True)
-            return homesForSale
+        def getHomesForSale(dataset):
+            # The number of listings that were put on market by the end of the month, and that closed after the first day of the month or haven't closed
+            homesForSale = getMonthly(dataset, ["Homes for Sale"])
+            return homesForSale.loc[homesForSale["Homes for Sale"] > 0]
         
         processHomesForSale = lambda x, y: processAndLabel(getHomesForSale, x, y) # more readable than processHomesForSale = functools.partial(processAndLabel, getHomesForSale)
         homesForSale = pd.concat(
             map(
                 processHomesForSale,
-                filteredListings_group,
+                datasets_group,
                 map(lambda x: "Dataset " + str(x), range(1,datasets+1)) #TODO
             )
         )
@@ -620,14 +620,11 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Closed Sales"
         title = chart
         description = "The number of homes that have closed during the given month"
-        def getClosedSales(filteredListings):
-            closedSales = filteredListings.groupby([filteredListings['CloseDate'].dt.year.rename('year'), filteredListings['CloseDate'].dt.month.rename('month')], as_index=False).agg({'count'})[["_id"]]
-            closedSales["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), closedSales.index)))
-            closedSales.columns = ['Closed Sales', 'Month']
-            return closedSales
+        def getClosedSales(dataset):
+            return getMonthly(dataset, ["Closed Sales"])
         closedSales = pd.concat(map(
             lambda x, y: processAndLabel(getClosedSales, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1)) #TODO
         ))
         if "Closed Sales" in views:
@@ -644,23 +641,15 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = 'Absorption Rate'
         title = chart
         description = 'The ratio of the total number of homes sold in a month to the total number of homes on market that month. AKA Sales Lead to Close Ratio'
-        def getAbsorptionRate(filteredListings):
-            homesForSale = getHomesForSale(filteredListings)
-            closedSales = getClosedSales(filteredListings)
-            closeRatio = pd.DataFrame(homesForSale['Month'])
-            homesForSale.index = homesForSale["Month"]
-            closedSales.index = closedSales["Month"]
-            def getAbsorptionRateMonth(month):
-                try:
-                    return closedSales.loc[month, 'Closed Sales'] / homesForSale.loc[month, 'Homes for Sale']
-                except:
-                    # There can be indices present in closeRatio that arent present in either closedSales or homesForSale
-                    return None
-            closeRatio[chart] = closeRatio["Month"].apply(getAbsorptionRateMonth).dropna()
+        def getAbsorptionRate(dataset):
+            monthly = getMonthly(dataset, ["Homes for Sale", "Closed Sales"])
+            monthly = monthly.loc[monthly["Homes for Sale"] > 0]
+            closeRatio = monthly[["Month"]]
+            closeRatio[chart] = monthly["Closed Sales"] / monthly["Homes for Sale"] # Months without closed sales are left empty
             return closeRatio
         closeRatio = pd.concat(map(
             lambda x, y: processAndLabel(getAbsorptionRate, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))
         ))
         if chart in views:
@@ -677,25 +666,15 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = 'Months Supply'
         title = chart
         description = 'The rate at which the market eliminates inventory measured in months to absorb current inventory. Rate based on yearly average sales. For a given month, the months supply is the listings for sale that month dividied by the yearly average closed sales.'
-        def getMonthsSupply(filteredListings):
-            homesForSale = getHomesForSale(filteredListings)
-            homesForSale.columns = ['Month', 'Homes for Sale']
-            homesForSale.index = homesForSale.Month
-            closedSales = getClosedSales(filteredListings)
-            absorptionRate = pd.DataFrame(homesForSale['Month'])
-            closedSalesRolling = closedSales['Closed Sales'].rolling(window=12).mean()
-            closedSalesRolling.index = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), closedSalesRolling.index)))
-            def getMonthsSupplyMonth(month):
-                try:
-                    return homesForSale.loc[month, 'Homes for Sale'] / closedSalesRolling.loc[month]
-                except:
-                    return None
-
-            absorptionRate[chart] = absorptionRate["Month"].apply(getMonthsSupplyMonth).dropna(how='any')
-            return absorptionRate
+        def getMonthsSupply(dataset):
+            monthly = getMonthly(dataset, ["Homes for Sale", "Closed Sales"])
+            closedSalesRolling = monthly.set_index("Month")["Closed Sales"].dropna().rolling(window=12).mean()
+            absorptionRate = monthly.loc[monthly["Homes for Sale"] > 0, ["Month", "Homes for Sale"]]
+            absorptionRate[chart] = absorptionRate["Homes for Sale"] / absorptionRate["Month"].map(closedSalesRolling)
+            return absorptionRate[["Month", chart]]
         absorptionRate = pd.concat(map(
             lambda x, y: processAndLabel(getMonthsSupply, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))# TODO
         ))
         makeChart(chart, title, absorptionRate, rolling, description, sumTotalData=False)
@@ -707,15 +686,11 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Pending Sales "
         title = "Monthly Total Pending Sales"
         description = "The number of properties put on market each month with a current status of Pending"
-        def getPendingSales(filteredListings):
-            pendingSales = filteredListings.loc[filteredListings["StandardStatus"].isin(["Pending", 'P-Pending Sale'])]
-            pendingSales = pendingSales.groupby([pendingSales['OnMarketDate'].dt.year.rename('year'), pendingSales['OnMarketDate'].dt.month.rename('month')], as_index=True).agg({'count'})[['OnMarketDate']]
-            pendingSales["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), pendingSales.index)))
-            pendingSales.columns = [chart, 'Month']
-            return pendingSales
+        def getPendingSales(dataset):
+            return getMonthly(dataset, ["Pending Sales"]).rename(columns={"Pending Sales": chart})
         pendingSales = pd.concat(map(
             lambda x, y: processAndLabel(getPendingSales, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
         ))
         makeChart(chart, title, pendingSales, rolling, description, sumTotalData=True)
@@ -727,22 +702,15 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Days on Market"
         title = "Median Days on Market per Month" if not confidenceRegion else "Mean Days on Market per Month"
         description = "The median number of days on market for listings closed each month" if not confidenceRegion else "The mean number of days on market for listings closed each month"
-        def getDaysOnMarket(filteredListings):
-            grouped = filteredListings.groupby([filteredListings['CloseDate'].dt.year.rename('year'), filteredListings['CloseDate'].dt.month.rename('month')], as_index=True)[['DaysOnMarket']]
-            if confidenceRegion:
-                daysOnMarket = grouped.mean()
-                ci_hi, ci_lo = getConfidenceRegion(grouped, confidenceInterval)
-            else:
-                daysOnMarket = grouped.median()
-            daysOnMarket["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), daysOnMarket.index)))
-            daysOnMarket.columns = [chart, 'Month']
-            if confidenceRegion:
-                daysOnMarket['ci_hi'] = ci_hi
-                daysOnMarket['ci_lo'] = ci_lo
-            return daysOnMarket
+        def getDaysOnMarket(dataset):
+            if not confidenceRegion:
+                return getMonthly(dataset, ["Days on Market"])
+            daysOnMarket = getMonthly(dataset, ["Mean Days on Market", "Days on Market Std", "Days on Market Count"])
+            daysOnMarket['ci_hi'], daysOnMarket['ci_lo'] = getConfidenceRegion(daysOnMarket["Mean Days on Market"], daysOnMarket["Days on Market Std"], daysOnMarket["Days on Market Count"], confidenceInterval)
+            return daysOnMarket.rename(columns={"Mean Days on Market": chart})[["Month", chart, "ci_hi", "ci_lo"]]
         daysOnMarket = pd.concat(map(
             lambda x, y: processAndLabel(getDaysOnMarket, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
         ))
         makeChart(chart, title, daysOnMarket, rolling, description, sumTotalData=False)
@@ -753,22 +721,15 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Sales Price"  
         title = "Median Sales Price" if not confidenceRegion else "Mean Sales Price"
         description = "The median close price for listings closed each month" if not confidenceRegion else "The mean close price for listings closed each month"
-        def getSalesPrice(filteredListings):
-            grouped = filteredListings.groupby([filteredListings['CloseDate'].dt.year.rename('year'), filteredListings['CloseDate'].dt.month.rename('month')], as_index=True)[['ClosePrice']]
-            if confidenceRegion:
-                salesPrice = grouped.mean(numeric_only=True)
-                ci_hi, ci_lo = getConfidenceRegion(grouped, confidenceInterval)
-            else:
-                salesPrice = grouped.median(numeric_only=True)
-            salesPrice["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), salesPrice.index)))
-            salesPrice.columns = [chart, 'Month']
-            if confidenceRegion:
-                salesPrice['ci_hi'] = ci_hi
-                salesPrice['ci_lo'] = ci_lo
-            return salesPrice
+        def getSalesPrice(dataset):
+            if not confidenceRegion:
+                return getMonthly(dataset, ["Sales Price"])
+            salesPrice = getMonthly(dataset, ["Mean Sales Price", "Sales Price Std", "Sales Price Count"])
+            salesPrice['ci_hi'], salesPrice['ci_lo'] = getConfidenceRegion(salesPrice["Mean Sales Price"], salesPrice["Sales Price Std"], salesPrice["Sales Price Count"], confidenceInterval)
+            return salesPrice.rename(columns={"Mean Sales Price": chart})[["Month", chart, "ci_hi", "ci_lo"]]
         salesPrice = pd.concat(map(
             lambda x, y: processAndLabel(getSalesPrice, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
         ))
         if "Sales Price" in views:
@@ -780,16 +741,13 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Price Per Sq Ft"
         title = "Median List Price Per Building Sq Ft"
         description = "The median list price per square foot of building area for listings closed each month"
-        def getPpsqft(filteredListings):
-            ppsqft = filteredListings[filteredListings["ListPricePerSQFT"] != np.Inf]
-            ppsqft = ppsqft.groupby([ppsqft['CloseDate'].dt.year.rename('year'), ppsqft['CloseDate'].dt.month.rename('month')], as_index=True)[['ListPricePerSQFT']].median(numeric_only=True)
-            ppsqft["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), ppsqft.index)))
-            ppsqft.columns = [chart, 'Month']
+        def getPpsqft(dataset):
+            ppsqft = getMonthly(dataset, ["Price Per Sq Ft"])
             ppsqft = ppsqft.replace(0.000000, np.nan).dropna(axis=0, how="any")
             return ppsqft
         ppsqft = pd.concat(map(
             lambda x, y: processAndLabel(getPpsqft, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
         ))
         makeChart(chart, title, ppsqft, rolling, description=description, sumTotalData=False)
@@ -800,22 +758,17 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Original List Price"
         title = "Median Original List Price"
         description = "The median original list price for listings closed each month"
-        origPrice = None
-        def getOrigPrice(filteredListings):
-            origPrice = filteredListings.groupby([filteredListings['CloseDate'].dt.year.rename('year'), filteredListings['CloseDate'].dt.month.rename('month')], as_index=True)[['OriginalListPrice']].median(numeric_only=True)
-            origPrice["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), origPrice.index)))
-            origPrice.columns = [chart, 'Month']
-            return origPrice
-        try:
-            origPrice = pd.concat(map(
-                lambda x, y: processAndLabel(getOrigPrice, x, y),
-                filteredListings_group,
-                map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
-            ))
-            if "Original List Price" in views:
+        def getOrigPrice(dataset):
+            return getMonthly(dataset, ["Original List Price"])
+        origPrice = pd.concat(map(
+            lambda x, y: processAndLabel(getOrigPrice, x, y),
+            datasets_group,
+            map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
+        ))
+        if "Original List Price" in views:
+            if origPrice[chart].notna().any():
                 makeChart(chart, title, origPrice, rolling, description, sumTotalData=False)
-        except KeyError:
-            if "Original List Price" in views:
+            else:
                 with st.expander(chart):
                     st.text("No original list prices found for selected listings.")
 
@@ -827,22 +780,17 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Percent of Original List Price"
         title = "Median Sale Percent of Original List Price"
         description = "Percentage found when dividing a listing’s sales price by its original list price, then taking the average for all sold listings in a given month. \nSales with a Percent of Original List Price that is less than 50 percent or more than 200 percent are added to the sales count but are not factored into Average Sales Price Percent of Original List Price"
-        def getPop(filteredListings):
-            pop = filteredListings[['CloseDate', 'ClosePrice', 'OriginalListPrice']].replace(0.0, np.nan).dropna(axis=0, how="any") 
-            pop[chart] = (pop.ClosePrice / pop.OriginalListPrice) 
-            pop = pop.loc[ lambda pop: (pop[chart] >= .5) & (pop[chart] <= 2.0) ]
-            pop = pop.groupby([pop['CloseDate'].dt.year.rename('year'), pop['CloseDate'].dt.month.rename('month')], as_index=True)[[chart]].mean(numeric_only=True)
-            pop["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), pop.index)))
-            pop.columns = [chart, 'Month']
-            return pop
-        try:
-            pop = pd.concat(map(
-                lambda x, y: processAndLabel(getPop, x, y),
-                filteredListings_group,
-                map(lambda x: "Dataset " + str(x), range(1,datasets+1))
-            ))
+        def getPop(dataset):
+            # Ratios less than 50 percent or more than 200 percent are left out, see MLS.ratioBounds
+            return getMonthly(dataset, ["Pct of Original Price"]).rename(columns={"Pct of Original Price": chart})
+        pop = pd.concat(map(
+            lambda x, y: processAndLabel(getPop, x, y),
+            datasets_group,
+            map(lambda x: "Dataset " + str(x), range(1,datasets+1))
+        ))
+        if pop[chart].notna().any():
             makeChart(chart, title, pop, rolling, description, sumTotalData=False, zeroScaleYAxis=False, percent=True)
-        except KeyError:
+        else:
             with st.expander(chart):
                 st.text("No original list prices found for selected listings.")
 
@@ -853,17 +801,12 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = 'Percent of Last List Price'
         title = "Average Sales Price Percent of Last List Price"
         description = "Percentage found when dividing a listing’s sales price by its last list price, then taking the average for all sold listings in a given month. \nSales with a Percent of Last List Price that is less than 50 percent or more than 200 percent are added to the sales count but are not factored into Average Sales Price Percent of Last List Price"
-        def getPllp(filteredListings):
-            pllp = filteredListings[['CloseDate', 'ClosePrice', 'ListPrice']].replace(0.0, np.nan).dropna(axis=0, how="any") # Get rid of listings that haven't closed yet (close price will be 0)
-            pllp[chart] = (pllp.ClosePrice / pllp.ListPrice)
-            pllp = pllp.loc[ lambda pllp: (pllp[chart] >= .5) & (pllp[chart] <= 2.0) ]     # * Sales with a Percent of Original Price that is less than 50 percent or more than 200 percent, are added to the sales count but are not factored into price, price per square foot or days on market.   
-            pllp = pllp.groupby([pllp['CloseDate'].dt.year.rename('year'), pllp['CloseDate'].dt.month.rename('month')], as_index=True)[[chart]].mean(numeric_only=True)
-            pllp["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), pllp.index)))
-            pllp.columns = [chart, 'Month']
-            return pllp
+        def getPllp(dataset):
+            # Listings that haven't closed yet have no close price, and ratios less than 50 percent or more than 200 percent are left out, see MLS.ratioBounds
+            return getMonthly(dataset, ["Pct of Last List Price"]).rename(columns={"Pct of Last List Price": chart})
         pllp = pd.concat(map(
             lambda x, y: processAndLabel(getPllp, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
         ))
         makeChart(chart, title, pllp, rolling, description, sumTotalData=False, zeroScaleYAxis=False, percent=True)
@@ -875,14 +818,11 @@ if filteredListings_group != [] and all(map(lambda x: x is not None and not x.em
         chart = "Dollar Volume"
         title = "Monthly Total Dollar Volume"
         description = "The total dollar amount of all sales for listings closed each month"
-        def getDollarVol(filteredListings):
-            dollarVol = filteredListings.groupby([filteredListings['CloseDate'].dt.year.rename('year'), filteredListings['CloseDate'].dt.month.rename('month')], as_index=True)[['ClosePrice']].sum(numeric_only=True)
-            dollarVol["Month"] = pd.to_datetime(tuple(map(lambda x: str(int(x[0])) + '-' + str(int(x[1])), dollarVol.index)))
-            dollarVol.columns = [chart, 'Month']
-            return dollarVol
+        def getDollarVol(dataset):
+            return getMonthly(dataset, ["Dollar Volume"])
         dollarVol = pd.concat(map(
             lambda x, y: processAndLabel(getDollarVol, x, y),
-            filteredListings_group,
+            datasets_group,
             map(lambda x: "Dataset " + str(x), range(1,datasets+1))#TODO
         ))
         makeChart(chart, title, dollarVol, rolling, description, sumTotalData=True)
@@ -0,0 +1,108 @@
+# Author: Andrew Pantera for TLCengine
+# Data versions for the dashboard's caches. Every time a sync writes to a
+# listings collection it bumps that collection's counter in
+# housing-prices.dataVersions. The dashboard keys its caches on a
+# collection's version, so a cache stays valid until the data behind it
+# really changes. Where the server supports change streams (replica sets)
+# the dashboard also watches the collections it reads, so it sees a write
+# as soon as it happens. Otherwise it polls the published counters.
+
+import datetime
+import logging
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+versionsDatabase = 'housing-prices'
+versionsCollection = 'dataVersions'
+
+def versionKey(collection) -> str:
+    return f"{collection.database.name}.{collection.name}"
+
+def publishVersion(collection) -> None:
+    # Called by the syncs after writing to collection, so the dashboard knows its caches of collection are stale
+    collection.database.client[versionsDatabase][versionsCollection].update_one(
+        {"_id": versionKey(collection)},
+        {"$inc": {"version": 1}, "$set": {"updated": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+
+class DataVersions:
+    def __init__(self, client, pollSeconds: float = 60):
+        """The current version of the collections the dashboard reads
+
+        Args:
+            client (MongoClient): The MongoDB client the dashboard reads with
+            pollSeconds (float, optional): Seconds a published version is used before it's read again. Defaults to 60.
+        """
+        self.client = client
+        self.pollSeconds = pollSeconds
+        self.published = {} # key -> (version, time it was read)
+        self.changes = {} # key -> changes seen by the change stream
+        self.watchers = {}
+        self.lock = threading.Lock()
+
+    def version(self, database: str, collection: str, watch: bool = True) -> tuple:
+        """A value that changes whenever the collection is written, to key caches of it on
+
+        Args:
+            database (str): The collection's database
+            collection (str): The collection
+            watch (bool, optional): Also watch the collection's change stream. Pass False for collections named by users, which
+                would each get a watcher thread, the published version is polled either way. Defaults to True.
+
+        Returns:
+            tuple: The published version and the number of changes seen by this process's change stream
+        """
+        key = f"{database}.{collection}"
+        if watch:
+            self.watch(key)
+        with self.lock:
+            published, readAt = self.published.get(key, (None, 0))
+        if time.monotonic() - readAt >= self.pollSeconds:
+            try:
+                document = self.client[versionsDatabase][versionsCollection].find_one({"_id": key})
+                published = document.get("version", 0) if document else 0
+            except PyMongoError as exc:
+                logging.info(f"Could not read the data version of {key}: {exc}")
+            with self.lock:
+                self.published[key] = (published, time.monotonic())
+        with self.lock:
+            return published, self.changes.get(key, 0)
+
+    def watch(self, key: str) -> None:
+        with self.lock:
+            if key in self.watchers:
+                return
+            thread = threading.Thread(target=self.follow, args=(key,), name=f"watch {key}", daemon=True)
+            self.watchers[key] = thread
+        thread.start()
+
+    def follow(self, key: str) -> None:
+        # Count the writes to the collection as they happen. Standalone servers don't have change streams, polling covers those
+        database, collection = key.split('.', 1)
+        while True:
+            try:
+                with self.client[database][collection].watch() as stream:
+                    for _ in stream:
+                        with self.lock:
+                            self.changes[key] = self.changes.get(key, 0) + 1
+            except OperationFailure as exc:
+                logging.info(f"Change streams aren't available for {key}, polling its data version instead: {exc}")
+                return
+            except PyMongoError as exc:
+                logging.info(f"Watching {key} failed, watching it again in {self.pollSeconds} seconds: {exc}")
+                with self.lock:
+                    self.changes[key] = self.changes.get(key, 0) + 1 # Writes could have been missed while disconnected
+                time.sleep(self.pollSeconds)
+
+dataVersions = {}
+dataVersionsLock = threading.Lock()
+
+def getDataVersions(client) -> DataVersions:
+    # One DataVersions per client per process, so every MLS shares the change stream watchers
+    with dataVersionsLock:
+        if id(client) not in dataVersions:
+            dataVersions[id(client)] = DataVersions(client)
+        return dataVersions[id(client)]
@@ -0,0 +1,117 @@
+# Author: Andrew Pantera for TLCengine
+# The RETS syncs get Decimal values from the rets library, which pymongo can't
+# encode. convert_decimal converts them to Decimal128 as the records are
+# downloaded, walking each record once without recursion. DecimalCodec, which
+# makes pymongo encode Decimal while the document is serialized, is kept to
+# benchmark against: it wasn't reliably faster, so the syncs don't use it.
+# Run this file to benchmark the approaches on synthetic RETS records:
+#   python3 decimalCodec.py [number of records]
+
+import collections
+import datetime
+import decimal
+import sys
+import time
+from decimal import Decimal
+
+from bson.codec_options import CodecOptions, TypeEncoder, TypeRegistry
+from bson.decimal128 import Decimal128
+
+significandContext = decimal.Context(prec=34) # Decimal128 holds up to 34 digits
+
+def toDecimal128(value: Decimal) -> Decimal128:
+    # Decimal128(value) builds the 128 bits one at a time in python, which is most of the cost of converting a record.
+    # Values that fit exactly, which is all of the ones we get from the MLSs, are packed directly instead
+    sign, digits, exponent = value.as_tuple()
+    if type(exponent) is int and len(digits) <= 34 and -6176 <= exponent <= 6111:
+        significand = int(value.copy_abs().scaleb(-exponent, significandContext))
+        high = ((exponent + 6176) << 49) | (significand >> 64)
+        if sign:
+            high |= 1 << 63
+        return Decimal128((high, significand & 0xFFFFFFFFFFFFFFFF))
+    return Decimal128(value) # NaN, Infinity, and values that need rounding
+
+class DecimalCodec(TypeEncoder):
+    python_type = Decimal
+
+    def transform_python(self, value: Decimal) -> Decimal128:
+        return toDecimal128(value)
+
+decimalCodecOptions = CodecOptions(type_registry=TypeRegistry([DecimalCodec()]))
+
+scalarTypes = frozenset((str, int, float, bool, type(None), datetime.datetime, datetime.date, Decimal128))
+
+def convert_decimal(dict_item):
+    # Converts Decimal values to Decimal128 in place, in dictionaries and lists nested to any depth
+    # The nesting is walked with a stack instead of recursion, and values are checked by exact type first because almost all of them are plain scalars
+    if dict_item is None: return None
+    if not isinstance(dict_item, dict): return dict_item
+    stack = [dict_item]
+    while stack:
+        container = stack.pop()
+        for k, v in (container.items() if isinstance(container, dict) else enumerate(container)):
+            valueType = type(v)
+            if valueType in scalarTypes:
+                continue
+            if valueType is Decimal:
+                container[k] = toDecimal128(v) # Replacing a value doesn't change the size of the dictionary, so this is safe while iterating
+            elif isinstance(v, (dict, list)):
+                stack.append(v)
+    return dict_item
+
+def recursiveConvertDecimal(dict_item):
+    # The converter the RETS syncs used to have, kept to benchmark against
+    if dict_item is None: return None
+    if not (isinstance(dict_item, dict) or isinstance(dict_item, collections.OrderedDict)): return dict_item
+    for k, v in list(dict_item.items()):
+        if isinstance(v, dict):
+            recursiveConvertDecimal(v)
+        elif isinstance(v, list):
+            for l in v:
+                recursiveConvertDecimal(l)
+        elif isinstance(v, Decimal):
+            dict_item[k] = Decimal128(str(v))
+    return dict_item
+
+def syntheticRecords(count: int, fields: int = 200) -> list:
+    # Records shaped like COMPACT-DECODED RETS listings: flat OrderedDicts of mostly strings, ints, dates and empty fields, with about 1 in 10 fields decimal
+    records = []
+    for i in range(count):
+        record = collections.OrderedDict()
+        for f in range(fields):
+            kind = f % 10
+            if kind == 0:
+                record[f'Decimal{f}'] = Decimal(f'{i}.{f:02d}')
+            elif kind in (1, 2):
+                record[f'Int{f}'] = i + f
+            elif kind == 3:
+                record[f'Date{f}'] = datetime.datetime(2021, 1 + f % 12, 1 + i % 28)
+            elif kind in (4, 5):
+                record[f'Empty{f}'] = None
+            else:
+                record[f'Text{f}'] = f'value {i} {f}'
+        records.append(record)
+    return records
+
+def benchmark(count: int = 100000, repeat: int = 3) -> None:
+    # Every approach converts and encodes fresh records repeat times and its fastest run is reported, so one slow run on a busy machine doesn't decide
+    import bson
+    approaches = {
+        "recursive convert_decimal + encode": lambda record: bson.encode(recursiveConvertDecimal(record)),
+        "iterative convert_decimal + encode": lambda record: bson.encode(convert_decimal(record)),
+        "DecimalCodec encode": lambda record: bson.encode(record, codec_options=decimalCodecOptions),
+    }
+    results = {}
+    for name, encode in approaches.items():
+        for _ in range(repeat):
+            records = syntheticRecords(count)
+            st = time.time()
+            for record in records:
+                encode(record)
+            results[name] = min(results.get(name, float("inf")), time.time()-st)
+
+    for name, seconds in results.items():
+        print(f"{name}: {round(seconds, 2)} seconds for {count} records, {round(count/seconds)} records per second")
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,184 @@
+# Author: Andrew Pantera for TLCengine
+# County -> City -> Zip code hierarchy for every MLS. The hierarchy is built
+# from the listing data of each MLS plus a reference table that maps cities
+# (and through them, zip codes) to counties, and is stored in the 'geography'
+# collection of the 'housing-prices' database. MLS objects use it to turn a
+# county query into a precomputed set of cities or zip codes, which is needed
+# for MLSs like Paragon that don't have a usable county field.
+# Rebuild it with `python3 geography.py`.
+
+import time
+from typing import Dict, Sequence, Tuple
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+
+caCountyCities = { # Incorporated cities of each California county, used as the reference table for Paragon, whose listings have no usable county field
+    'San Bernardino': ['Adelanto', 'Apple Valley', 'Barstow', 'Big Bear Lake', 'Chino', 'Chino Hills', 'Colton', 'Fontana', 'Grand Terrace', 'Hesperia', 'Highland', 'Loma Linda', 'Montclair', 'Needles', 'Ontario', 'Rancho Cucamonga', 'Redlands', 'Rialto', 'San Bernardino', 'Twentynine Palms', 'Upland', 'Victorville', 'Yucaipa', 'Yucca Valley'],
+    'Los Angeles': ['Agoura Hills', 'Alhambra', 'Arcadia', 'Artesia', 'Avalon', 'Azusa', 'Baldwin Park', 'Bell', 'Bell Gardens', 'Bellflower', 'Beverly Hills', 'Bradbury', 'Burbank', 'Calabasas', 'Carson', 'Cerritos', 'Claremont', 'Commerce', 'Compton', 'Covina', 'Cudahy', 'Culver City', 'Diamond Bar', 'Downey', 'Duarte', 'El Monte', 'El Segundo', 'Gardena', 'Glendale', 'Glendora', 'Hawaiian Gardens', 'Hawthorne', 'Hermosa Beach', 'Hidden Hills', 'Huntington Park', 'Industry', 'Inglewood', 'Irwindale', 'La Cañada Flintridge', 'La Habra Heights', 'La Mirada', 'La Puente', 'La Verne', 'Lakewood', 'Lancaster', 'Lawndale', 'Lomita', 'Long Beach', 'Los Angeles', 'Lynwood', 'Malibu', 'Manhattan Beach', 'Maywood', 'Monrovia', 'Montebello', 'Monterey Park', 'Norwalk', 'Palmdale', 'Palos Verdes Estates', 'Paramount', 'Pasadena', 'Pico Rivera', 'Pomona', 'Rancho Palos Verdes', 'Redondo Beach', 'Rolling Hills', 'Rolling Hills Estates', 'Rosemead', 'San Dimas', 'San Fernando', 'San Gabriel', 'San Marino', 'Santa Clarita', 'Santa Fe Springs', 'Santa Monica', 'Sierra Madre', 'Signal Hill', 'South El Monte', 'South Gate', 'South Pasadena', 'Temple City', 'Torrance', 'Vernon', 'Walnut', 'West Covina', 'West Hollywood', 'Westlake Village', 'Whittier'],
+    'Alameda': ['Alameda', 'Albany', 'Berkeley', 'Dublin', 'Emeryville', 'Fremont', 'Hayward', 'Livermore', 'Newark', 'Oakland', 'Piedmont', 'Pleasanton', 'San Leandro', 'Union City'],
+    'Orange': ['Aliso Viejo', 'Anaheim', 'Brea', 'Buena Park', 'Costa Mesa', 'Cypress', 'Dana Point', 'Fountain Valley', 'Fullerton', 'Garden Grove', 'Huntington Beach', 'Irvine', 'La Habra', 'La Palma', 'Laguna Beach', 'Laguna Hills', 'Laguna Niguel', 'Laguna Woods', 'Lake Forest', 'Los Alamitos', 'Mission Viejo', 'Newport Beach', 'Orange', 'Placentia', 'Rancho Santa Margarita', 'San Clemente', 'San Juan Capistrano', 'Santa Ana', 'Seal Beach', 'Stanton', 'Tustin', 'Villa Park', 'Westminster', 'Yorba Linda'],
+    'Modoc': ['Alturas'],
+    'Amador': ['Amador City', 'Ione', 'Jackson', 'Plymouth', 'Sutter Creek'],
+    'Napa': ['American Canyon', 'Calistoga', 'Napa', 'St. Helena', 'Yountville'],
+    'Shasta': ['Anderson', 'Redding', 'Shasta Lake'],
+    'Calaveras': ['Angels Camp'],
+    'Contra Costa': ['Antioch', 'Brentwood', 'Clayton', 'Concord', 'Danville', 'El Cerrito', 'Hercules', 'Lafayette', 'Martinez', 'Moraga', 'Oakley', 'Orinda', 'Pinole', 'Pittsburg', 'Pleasant Hill', 'Richmond', 'San Pablo', 'San Ramon', 'Walnut Creek'],
+    'Humboldt': ['Arcata', 'Blue Lake', 'Eureka', 'Ferndale', 'Fortuna', 'Rio Dell', 'Trinidad'],
+    'San Luis Obispo': ['Arroyo Grande', 'Atascadero', 'Grover Beach', 'Morro Bay', 'Paso Robles', 'Pismo Beach', 'San Luis Obispo'],
+    'Kern': ['Arvin', 'Bakersfield', 'California City', 'Delano', 'Maricopa', 'McFarland', 'Ridgecrest', 'Shafter', 'Taft', 'Tehachapi', 'Wasco'],
+    'San Mateo': ['Atherton', 'Belmont', 'Brisbane', 'Burlingame', 'Colma', 'Daly City', 'East Palo Alto', 'Foster City', 'Half Moon Bay', 'Hillsborough', 'Menlo Park', 'Millbrae', 'Pacifica', 'Portola Valley', 'Redwood City', 'San Bruno', 'San Carlos', 'San Mateo', 'South San Francisco', 'Woodside'],
+    'Merced': ['Atwater', 'Dos Palos', 'Gustine', 'Livingston', 'Los Banos', 'Merced'],
+    'Placer': ['Auburn', 'Colfax', 'Lincoln', 'Loomis', 'Rocklin', 'Roseville'],
+    'Kings': ['Avenal', 'Corcoran', 'Hanford', 'Lemoore'],
+    'Riverside': ['Banning', 'Beaumont', 'Blythe', 'Calimesa', 'Canyon Lake', 'Cathedral City', 'Coachella', 'Corona', 'Desert Hot Springs', 'Eastvale', 'Hemet', 'Indian Wells', 'Indio', 'Jurupa Valley', 'La Quinta', 'Lake Elsinore', 'Menifee', 'Moreno Valley', 'Murrieta', 'Norco', 'Palm Desert', 'Palm Springs', 'Perris', 'Rancho Mirage', 'Riverside', 'San Jacinto', 'Temecula', 'Wildomar'],
+    'Marin': ['Belvedere', 'Corte Madera', 'Fairfax', 'Larkspur', 'Mill Valley', 'Novato', 'Ross', 'San Anselmo', 'San Rafael', 'Sausalito', 'Tiburon'],
+    'Solano': ['Benicia', 'Dixon', 'Fairfield', 'Rio Vista', 'Suisun City', 'Vacaville', 'Vallejo'],
+    'Butte': ['Biggs', 'Chico', 'Gridley', 'Oroville', 'Paradise'],
+    'Inyo': ['Bishop'],
+    'Imperial': ['Brawley', 'Calexico', 'Calipatria', 'El Centro', 'Holtville', 'Imperial', 'Westmorland'],
+    'Santa Barbara': ['Buellton', 'Carpinteria', 'Goleta', 'Guadalupe', 'Lompoc', 'Santa Barbara', 'Santa Maria', 'Solvang'],
+    'Ventura': ['Camarillo', 'Fillmore', 'Moorpark', 'Ojai', 'Oxnard', 'Port Hueneme', 'Santa Paula', 'Simi Valley', 'Thousand Oaks', 'Ventura'],
+    'Santa Clara': ['Campbell', 'Cupertino', 'Gilroy', 'Los Altos', 'Los Altos Hills', 'Los Gatos', 'Milpitas', 'Monte Sereno', 'Morgan Hill', 'Mountain View', 'Palo Alto', 'San Jose', 'Santa Clara', 'Saratoga', 'Sunnyvale'],
+    'Santa Cruz': ['Capitola', 'Santa Cruz', 'Scotts Valley', 'Watsonville'],
+    'San Diego': ['Carlsbad', 'Chula Vista', 'Coronado', 'Del Mar', 'El Cajon', 'Encinitas', 'Escondido', 'Imperial Beach', 'La Mesa', 'Lemon Grove', 'National City', 'Oceanside', 'Poway', 'San Diego', 'San Marcos', 'Santee', 'Solana Beach', 'Vista'],
+    'Monterey': ['Carmel-by-the-Sea', 'Del Rey Oaks', 'Gonzales', 'Greenfield', 'King City', 'Marina', 'Monterey', 'Pacific Grove', 'Salinas', 'Sand City', 'Seaside', 'Soledad'],
+    'Stanislaus': ['Ceres', 'Hughson', 'Modesto', 'Newman', 'Oakdale', 'Patterson', 'Riverbank', 'Turlock', 'Waterford'],
+    'Madera': ['Chowchilla', 'Madera'],
+    'Sacramento': ['Citrus Heights', 'Elk Grove', 'Folsom', 'Galt', 'Isleton', 'Rancho Cordova', 'Sacramento'],
+    'Lake': ['Clearlake', 'Lakeport'],
+    'Sonoma': ['Cloverdale', 'Cotati', 'Healdsburg', 'Petaluma', 'Rohnert Park', 'Santa Rosa', 'Sebastopol', 'Sonoma', 'Windsor'],
+    'Fresno': ['Clovis', 'Coalinga', 'Firebaugh', 'Fowler', 'Fresno', 'Huron', 'Kerman', 'Kingsburg', 'Mendota', 'Orange Cove', 'Parlier', 'Reedley', 'San Joaquin', 'Sanger', 'Selma'],
+    'Colusa': ['Colusa', 'Williams'],
+    'Tehama': ['Corning', 'Red Bluff', 'Tehama'],
+    'Del Norte': ['Crescent City'],
+    'Yolo': ['Davis', 'West Sacramento', 'Winters', 'Woodland'],
+    'Tulare': ['Dinuba', 'Exeter', 'Farmersville', 'Lindsay', 'Porterville', 'Tulare', 'Visalia', 'Woodlake'],
+    'Siskiyou': ['Dorris', 'Dunsmuir', 'Etna', 'Fort Jones', 'Montague', 'Mount Shasta', 'Tulelake', 'Weed', 'Yreka'],
+    'San Joaquin': ['Escalon', 'Lathrop', 'Lodi', 'Manteca', 'Ripon', 'Stockton', 'Tracy'],
+    'Mendocino': ['Fort Bragg', 'Point Arena', 'Ukiah', 'Willits'],
+    'Nevada': ['Grass Valley', 'Nevada City', 'Truckee'],
+    'San Benito': ['Hollister', 'San Juan Bautista'],
+    'Sutter': ['Live Oak', 'Yuba City'],
+    'Sierra': ['Loyalton'],
+    'Mono': ['Mammoth Lakes'],
+    'Yuba': ['Marysville', 'Wheatland'],
+    'Glenn': ['Orland', 'Willows'],
+    'El Dorado': ['Placerville', 'South Lake Tahoe'],
+    'Plumas': ['Portola'],
+    'San Francisco': ['San Francisco'],
+    'Tuolumne': ['Sonora'],
+    'Lassen': ['Susanville'],
+}
+
+referenceTables = { # Keyed by MLS state, the county -> cities reference tables for MLSs whose county field can't be trusted
+    "California": caCountyCities,
+}
+
+class GeographyIndex:
+    def __init__(self, client: MongoClient, state: str, database: str = 'housing-prices', collection: str = 'geography'):
+        """A County -> City -> Zip code hierarchy for one MLS, loaded lazily from MongoDB
+
+        Args:
+            client (MongoClient): The MongoDB client pointing to the MongoDB database on TFS
+            state (str): The state of the MLS this hierarchy belongs to, the same as MLS.state
+            database (str, optional): The database holding the geography collection. Defaults to 'housing-prices'.
+            collection (str, optional): The geography collection. Defaults to 'geography'.
+        """
+        self.client = client
+        self.state = state
+        self.database = database
+        self.collection = collection
+        self._counties = None # {county: {"cities": tuple, "zips": tuple}}, populated on first use
+
+    def _load(self) -> Dict[str, dict]:
+        if self._counties is None:
+            cities, zips = {}, {}
+            for doc in self.client[self.database][self.collection].find({"state": self.state}, {"_id": 0, "county": 1, "city": 1, "zip": 1}):
+                if doc.get("city"):
+                    cities.setdefault(doc["county"], set()).add(doc["city"].upper())
+                if doc.get("zip"):
+                    zips.setdefault(doc["county"], set()).add(doc["zip"])
+            # Fall back on the reference table so that we can still answer county queries before the first build
+            for county, countyCities in referenceTables.get(self.state, {}).items():
+                cities.setdefault(county, set()).update(map(str.upper, countyCities))
+            self._counties = {
+                county: {"cities": tuple(sorted(cities.get(county, ()))), "zips": tuple(sorted(zips.get(county, ())))}
+                for county in set(cities) | set(zips)
+            }
+        return self._counties
+
+    def counties(self) -> Tuple[str]:
+        return tuple(sorted(self._load()))
+
+    def citiesForCounty(self, county: str) -> Tuple[str]:
+        # City names are stored upper case, which is how Paragon reports them
+        return self._load().get(county, {}).get("cities", ())
+
+    def zipsForCounty(self, county: str) -> Tuple[str]:
+        return self._load().get(county, {}).get("zips", ())
+
+    def resolve(self, queryField: str, targetUnits: Sequence[str]) -> Tuple[str, Tuple[str]]:
+        """Translate a county query into an equivalent query on cities, or on zip codes if
+        none of the counties has known cities. Other queries are returned unchanged.
+
+        Returns:
+            Tuple[str, Tuple[str]]: The RESO field to query and the values to query it for
+        """
+        if queryField != "CountyOrParish":
+            return queryField, targetUnits
+        # Cities are preferred because that is how a county is assigned to a listing when building the index, so the city set matches exactly the listings of the county
+        cities = tuple(city for county in targetUnits for city in self.citiesForCounty(county))
+        if cities:
+            return "City", cities
+        return "PostalCode", tuple(zipCode for county in targetUnits for zipCode in self.zipsForCounty(county))
+
+    def build(self, mls) -> int:
+        """Rebuild this state's hierarchy from the listings of the MLS and the reference table, removing the
+        entries that are no longer in either, and make sure the MLS collection has indexes on the fields resolved queries use
+
+        Args:
+            mls (MLS.MLS): The MLS whose listings the hierarchy is built from
+
+        Returns:
+            int: The number of (county, city, zip) entries written
+        """
+        fields = mls.fieldConversions
+        reference = referenceTables.get(self.state, {})
+        built = time.time() # Every entry written by this build is stamped with it, the ones left with an older stamp are stale
+        cityToCounty = {city.upper(): county for county, cities in reference.items() for city in cities}
+        groups = mls.client[mls.database][mls.collection].aggregate([
+            {"$match": {fields["StateOrProvince"]: mls.stateMLSName}},
+            {"$group": {"_id": {"county": f"${fields['CountyOrParish']}", "city": f"${fields['City']}", "zip": f"${fields['PostalCode']}"}}}
+        ], allowDiskUse=True)
+
+        requests = []
+        for group in groups:
+            city = group["_id"].get("city")
+            zipCode = group["_id"].get("zip")
+            if not isinstance(city, str) or not city:
+                continue
+            county = group["_id"].get("county") if mls.countyFieldReliable else cityToCounty.get(city.upper())
+            if not isinstance(county, str) or not county:
+                continue
+            zipCode = zipCode if isinstance(zipCode, str) and len(zipCode) == 5 and zipCode.isnumeric() else None
+            key = {"state": self.state, "county": county, "city": city.upper(), "zip": zipCode}
+            requests.append(UpdateOne(key, {"$set": {**key, "built": built}}, upsert=True))
+        for county, cities in reference.items():
+            for city in cities:
+                key = {"state": self.state, "county": county, "city": city.upper(), "zip": None}
+                requests.append(UpdateOne(key, {"$set": {**key, "built": built}}, upsert=True))
+
+        geography = self.client[self.database][self.collection]
+        geography.create_index([("state", ASCENDING), ("county", ASCENDING)])
+        if requests:
+            geography.bulk_write(requests, ordered=False)
+        geography.delete_many({"state": self.state, "built": {"$ne": built}}) # Cities and zip codes that no listing has anymore
+        for field in ("PostalCode", "City"):
+            mls.client[mls.database][mls.collection].create_index([(fields["StateOrProvince"], ASCENDING), (fields[field], ASCENDING)])
+        self._counties = None
+        return len(requests)
+
+if __name__ == "__main__":
+    import MLS
+    for state, mls in MLS.getMLSs().items():
+        print(f"Built {mls.geography.build(mls)} geography entries for {state}")
@@ -0,0 +1,37 @@
+# Author: Andrew Pantera for TLCengine
+# Production serving of propertyTaxApi:
+#   gunicorn propertyTaxApi:app
+# The app and the tax model are loaded once in the master process before the
+# workers are forked, so every worker shares the model's memory copy on
+# write instead of unpickling its own. Each worker serves TAX_API_THREADS
+# requests at once with its own MongoDB connection pool, sized for those
+# threads by the "api" profile in mongoClients.
+
+import gc
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv(verbose=True)
+
+bind = os.getenv("TAX_API_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("TAX_API_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("TAX_API_THREADS", 8))
+preload_app = True
+timeout = 60
+keepalive = 5
+max_requests = 10000 # Recycle workers now and then so a slow leak can't grow forever
+max_requests_jitter = 1000
+accesslog = "-"
+
+def when_ready(server):
+    # Runs in the master before the first fork
+    import propertyTaxApi
+    model = propertyTaxApi.get_tax_model()
+    server.log.info(f"Loaded tax model version {model.version}")
+
+def pre_fork(server, worker):
+    # Objects created so far are never collected in the workers, so the collector doesn't touch, and copy, their pages
+    gc.freeze()
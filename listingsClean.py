@@ -0,0 +1,150 @@
+# Author: Andrew Pantera for TLCengine
+# The ETL stage that keeps housing-prices.listings up to date. Every batch a
+# sync writes to an MLS collection the dashboard reads is normalized with
+# that MLS's MLS.cleanListings (RESO field names, derived dates, price per
+# square foot, acres to square feet, total bathrooms) and upserted into
+# housing-prices.listings, one compact document per listing across every
+# MLS: only the fields in MLS.listingFields, under their short names, as
+# numbers, dates and strings. The dashboard then reads small typed rows from
+# one collection instead of wide raw ones it normalizes on every read. The
+# syncs only clean what they write, so the dashboard keeps reading an MLS's
+# raw collection until a rebuild has cleaned all of its listings and left a
+# marker in housing-prices.listingsBackfills.
+# Run this file to rebuild housing-prices.listings for MLSs from their
+# collections. It also drops housing-prices.listings_clean, the collection
+# cleaned listings were kept in before:
+#   python3 listingsClean.py [state ...]
+
+import datetime
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, IndexModel, ReplaceOne
+
+import MLS
+from dataVersions import publishVersion
+from mongoClients import getClient
+
+indexedFields = ("CountyOrParish", "City", "PostalCode") # The fields the dashboard queries by
+legacyCollection = 'listings_clean' # Where cleaned listings were kept in their RESO schema before housing-prices.listings, nothing reads it anymore
+
+mlssByCollection = None
+mlssLock = threading.Lock()
+
+def getMLS(collection):
+    # The dashboard's MLS for a collection, if it reads that collection. Built without its metadata, only its cleaning is used
+    global mlssByCollection
+    with mlssLock:
+        if mlssByCollection is None:
+            mlss = MLS.getMLSs(collection.database.client, metadata=False).values()
+            mlssByCollection = {(mls.database, mls.collection): mls for mls in mlss if mls.keyField}
+            cleanCollection(collection.database.client).create_indexes([
+                IndexModel([(MLS.cleanMLSField, ASCENDING), (MLS.listingFields[field][0], ASCENDING)]) for field in indexedFields
+            ])
+        return mlssByCollection.get((collection.database.name, collection.name))
+
+def cleanCollection(client):
+    return client[MLS.cleanDatabase][MLS.cleanCollection]
+
+def toValue(value, kind):
+    # A cleaned value as the type the compact schema stores it as, missing and unparseable values as None
+    if value is None or value is pd.NaT or (isinstance(value, (float, np.floating)) and np.isnan(value)):
+        return None
+    if kind is float:
+        try:
+            value = float(str(value)) # str first for Decimal128
+        except ValueError:
+            return None
+        return None if np.isnan(value) else value
+    if kind is datetime.datetime:
+        value = pd.to_datetime(value, errors='coerce')
+        return None if value is pd.NaT else value.to_pydatetime()
+    value = str(value).strip()
+    return value if value else None
+
+def cleanDocuments(mls, docs) -> list:
+    """Normalize listings as the sync stores them into compact documents
+
+    Args:
+        mls (MLS.MLS): The MLS the listings belong to
+        docs (Iterable[dict]): The listings, with at least the MLS's requested fields and key field
+
+    Returns:
+        list: One document per listing in the MLS's state, with the fields of MLS.listingFields it has under their short names, the MLS's state and "<state>:<key>" as _id
+    """
+    # Syncs write every listing the MLS sends, the dashboard only shows the ones in the MLS's state, like reads of the raw collection do
+    stateField = mls.fieldConversions["StateOrProvince"]
+    fields = set(mls.requestFields) | {mls.keyField}
+    listings = pd.DataFrame([{field: doc.get(field) for field in fields} for doc in docs if doc.get(stateField) == mls.stateMLSName])
+    if listings.empty:
+        return []
+    keys = listings[mls.keyField].tolist()
+    listings = mls.cleanListings(listings)
+    columns = [column for column in listings.columns if column in MLS.listingFields]
+    schema = [MLS.listingFields[column] for column in columns]
+    cleaned = []
+    for key, row in zip(keys, listings[columns].itertuples(index=False, name=None)):
+        doc = {"_id": f"{mls.state}:{key}", MLS.cleanMLSField: mls.state}
+        for (short, kind), value in zip(schema, row):
+            value = toValue(value, kind)
+            if value is not None:
+                doc[short] = value
+        cleaned.append(doc)
+    return cleaned
+
+def writeClean(mls, docs) -> int:
+    cleaned = cleanDocuments(mls, docs)
+    if not cleaned:
+        return 0
+    result = cleanCollection(mls.client).bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in cleaned], ordered=False)
+    return result.upserted_count + result.modified_count
+
+def listingsWritten(collection, docs) -> None:
+    # Called by the syncs after writing docs to collection: clean them for the dashboard, then tell the dashboard its caches are stale
+    try:
+        mls = getMLS(collection)
+        if mls is not None:
+            writeClean(mls, docs)
+    except Exception as exc: # A listing that can't be cleaned must not fail the sync, rebuilding the MLS picks it up again
+        logging.info(f"    {collection.database.name}.{collection.name}: Cleaning {len(docs)} listings failed: {exc}")
+    publishVersion(collection)
+
+def rebuild(mls, batchSize: int = 5000) -> int:
+    # Clean every listing of an MLS, after a staged seed or when the cleaning changes
+    st = time.time()
+    fields = dict.fromkeys(set(mls.requestFields) | {mls.keyField}, 1)
+    cursor = mls.client[mls.database][mls.collection].find({mls.fieldConversions["StateOrProvince"]: mls.stateMLSName}, fields, batch_size=batchSize)
+    written = 0
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batchSize:
+            written += writeClean(mls, batch)
+            batch = []
+    written += writeClean(mls, batch)
+    # Every listing is cleaned now, so the dashboard can read this MLS from the clean collection
+    mls.client[MLS.cleanDatabase][MLS.cleanBackfills].update_one(
+        {"_id": mls.state},
+        {"$set": {"version": MLS.cleanVersion, "finished": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+    publishVersion(mls.client[mls.database][mls.collection])
+    logging.info(f"    {mls.state}: Cleaned {written} listings in {round(time.time()-st, 1)} seconds")
+    return written
+
+def main(states) -> None:
+    client = getClient("seed")
+    if legacyCollection in client[MLS.cleanDatabase].list_collection_names():
+        client[MLS.cleanDatabase].drop_collection(legacyCollection) # Its indexes go with it
+        logging.info(f"    Dropped {MLS.cleanDatabase}.{legacyCollection}")
+    for state, mls in MLS.getMLSs(client, metadata=False).items():
+        if mls.keyField and (not states or state in states):
+            rebuild(mls)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+# Author: Andrew Pantera for TLCengine
+# Load test for propertyTaxApi. Runs concurrent requests against the read
+# routes and reports requests per second and the p50 and p99 latency.
+# By default the app runs in this process against an in-memory mock of the
+# tax and bridge collections, so the API's own overhead can be measured and
+# compared between changes without a database. The mock's records come in
+# the forms the real ones do, taxes as strings, numbers or parsed at ingest,
+# so the run also checks every route handles them: it exits with an error
+# when any request failed. Pass --url to load test a running deployment
+# instead, for example one served by gunicorn.
+#   python3 loadTestTaxApi.py [--url http://localhost:5000] [--requests 5000] [--concurrency 16] [--no-cache]
+
+import argparse
+import random
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from addressKeys import addressKey, bridgeKeyField, taxAmountField, taxKeyField
+
+counties = ["morris", "essex"]
+zipCodes = [7960, 7042]
+streets = ["MAIN ST", "OAK AVE", "ELM ST", "PARK PL"]
+houses = 2000 # Addresses per county in the mock
+
+class MockCursor(list):
+    def batch_size(self, size):
+        return self
+
+def project(record, projection):
+    if not projection:
+        return dict(record)
+    included = {field for field, include in projection.items() if include}
+    return {field: value for field, value in record.items() if field in included or (field == "_id" and projection.get("_id", 1))}
+
+def matches(record, query):
+    if "$or" in query:
+        return any(matches(record, part) for part in query["$or"])
+    return all(record.get(field) == value for field, value in query.items())
+
+class MockCollection:
+    # The find and find_one the API uses, over records indexed by their address key like the real collections
+    def __init__(self, records, keyField):
+        self.byKey = {}
+        for record in records:
+            self.byKey.setdefault(record[keyField], []).append(record)
+        self.keyField = keyField
+
+    def candidates(self, query):
+        if "$or" in query:
+            return [record for part in query["$or"] for record in self.byKey.get(part.get(self.keyField), [])]
+        return self.byKey.get(query.get(self.keyField), [])
+
+    def find(self, query, projection=None):
+        return MockCursor(project(record, projection) for record in self.candidates(query) if matches(record, query))
+
+    def find_one(self, query, projection=None):
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+class MockDatabase(dict):
+    # The tax database's county collections by name
+    def list_collection_names(self):
+        return list(self)
+
+class MockModel:
+    # Stands in for the trained model when there is no artifact to load
+    version = "mock"
+    features = ['LAND-VALUE', "SALE-PRICE", "CALCULATED-ACREAGE", "NET-VALUE"]
+    mae = 1000.0
+    def predict(self, features):
+        return np.asarray(features, dtype=np.float64) @ np.array([.01, .005, 100, .02])
+
+class MockVersions:
+    def version(self, database, collection, watch=True):
+        return (0, 0)
+
+def mockRecords():
+    rng = random.Random(42)
+    taxes = {county: [] for county in counties}
+    listings = []
+    for county, zipCode in zip(counties, zipCodes):
+        for number in range(1, houses + 1):
+            address = f"{number} {streets[number % len(streets)]}"
+            for year in range(2015, 2021):
+                tax = rng.randint(4000, 20000)
+                record = {
+                    "_id": f"{county}:{number}:{year}", taxKeyField: addressKey(address), "STREET-ADDRESS": address, "ZIP-CODE": zipCode, "year": year,
+                    "LAST-YEAR-TAX": f"${tax:,}", "LAND-VALUE": rng.randint(50000, 400000), "SALE-PRICE": rng.randint(100000, 900000),
+                    "CALCULATED-ACREAGE": round(rng.uniform(.1, 2), 2), "NET-VALUE": rng.randint(100000, 900000), "BathroomsTotalInteger": rng.randint(1, 4),
+                    "BedroomsTotal": rng.randint(1, 6), "LotSizeSquareFeet": rng.randint(2000, 40000), "YearBuilt": rng.randint(1900, 2015),
+                    "TRANSACTION-DATE-MMDDYY": "010116", "Longitude": -74.5, "Latitude": 40.8,
+                }
+                # Like the real collections, some taxes were loaded as numbers, some were parsed by addressKeys.py and some fields are missing
+                if year % 3 == 0:
+                    record["LAST-YEAR-TAX"] = tax
+                elif year % 3 == 1:
+                    record[taxAmountField] = tax
+                if number % 5 == 0:
+                    del record["YearBuilt"]
+                taxes[county].append(record)
+            listings.append({"_id": f"{county}:{number}", bridgeKeyField: addressKey(address.rsplit(" ", 1)[0]), "PostalCode": f"{zipCode:05d}",
+                "CountyOrParish": county.capitalize(), "Latitude": 40.8, "Longitude": -74.5})
+    return taxes, listings
+
+def mockApi(cache):
+    # The app with its collections, model and data versions replaced by mocks
+    import propertyTaxApi
+    import propertyTaxModel
+
+    taxes, listings = mockRecords()
+    propertyTaxApi.db = MockDatabase({county: MockCollection(records, taxKeyField) for county, records in taxes.items()})
+    propertyTaxApi.bridgedb = {"bridge": MockCollection(listings, bridgeKeyField)}
+    propertyTaxApi.data_versions = MockVersions()
+    try:
+        propertyTaxModel.get_tax_model()
+    except (OSError, KeyError, ValueError):
+        propertyTaxModel.tax_model = MockModel()
+    if not cache:
+        propertyTaxApi.response_cache.maxBytes = 0
+    return propertyTaxApi.app
+
+def paths(count):
+    rng = random.Random(7)
+    routes = ["prediction", "data", "tax-data", "coords"]
+    for _ in range(count):
+        county = rng.randrange(len(counties))
+        number = rng.randint(1, houses)
+        address = f"{number} {streets[number % len(streets)]}".replace(" ", "_")
+        yield f"/{rng.choice(routes)}/{counties[county]}/{address}/{zipCodes[county]:05d}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test propertyTaxApi")
+    parser.add_argument("--url", help="Test a running server instead of the app in this process against mocked collections")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--no-cache", action="store_true", help="Turn off the response cache of the in process app")
+    args = parser.parse_args()
+
+    if args.url:
+        def get(path):
+            with urllib.request.urlopen(args.url.rstrip("/") + path) as response:
+                response.read()
+                return response.status
+    else:
+        app = mockApi(cache=not args.no_cache)
+        local = threading.local()
+        def get(path):
+            if not hasattr(local, "client"):
+                local.client = app.test_client()
+            return local.client.get(path).status_code
+
+    def timed(path):
+        st = time.perf_counter()
+        try:
+            status = get(path)
+        except Exception as exc:
+            status = str(exc)
+        return time.perf_counter() - st, status
+
+    st = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(timed, paths(args.requests)))
+    elapsed = time.perf_counter() - st
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    failures = sum(status != 200 for _, status in results)
+    print(f"{len(results)} requests, {args.concurrency} at a time, {failures} failed")
+    print(f"{len(results)/elapsed:.1f} requests/sec, p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
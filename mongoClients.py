@@ -0,0 +1,63 @@
+# Author: Andrew Pantera for TLCengine
+# One MongoClient per workload per process, built from the credentials in
+# .env. The syncs and the dashboard used to each assemble the connection
+# string and build their own client with the driver defaults. Each profile
+# here tunes the client for how it is used: routine sync updates, bulk
+# seeds that trade write acknowledgement for throughput, dashboard reads
+# that can be served by secondaries, and the property tax API's workers.
+# The property tax records live on their own server, TAX_MONGODB_* in .env,
+# which the tax API, model and address keys connect to with
+# getClient(profile, taxConnectionString()).
+
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+# Compressors are used in this order when both the server and the client support them. zstd and snappy need
+# the packages of the pymongo[snappy,zstd] extras in requirements.txt, zlib is built into Python
+compressors = "zstd,snappy,zlib"
+
+load_dotenv(verbose=True) # Profiles are sized from .env
+
+profiles = {
+    # ETL updates: acknowledged writes, connections for every writer thread
+    "sync": {"w": 1, "maxPoolSize": 32, "compressors": compressors, "retryWrites": True},
+    # Full seeds: writes are acknowledged by the primary alone, instead of the majority replica sets default to, without waiting for
+    # the journal. Not w=0: unacknowledged writes never report errors, and the seed ledger and staged swaps only record work whose
+    # writes didn't fail. The writer pool sizes each seed's batches to the write times it sees, so the profile doesn't
+    "seed": {"w": 1, "journal": False, "maxPoolSize": 64, "compressors": compressors, "retryWrites": True, "socketTimeoutMS": 600000},
+    # The dashboard: reads from secondaries when there are any, and fails fast instead of hanging the page
+    "dashboard": {"readPreference": "secondaryPreferred", "maxPoolSize": 20, "minPoolSize": 2, "serverSelectionTimeoutMS": 5000, "connectTimeoutMS": 5000, "socketTimeoutMS": 60000, "compressors": compressors, "connect": False},
+    # A property tax API worker: a connection for each request thread and the data version watcher. connect=False so a client
+    # created before gunicorn forks its workers doesn't connect until a worker uses it
+    "api": {"readPreference": "secondaryPreferred", "maxPoolSize": int(os.getenv("TAX_API_THREADS", 8)) + 2, "serverSelectionTimeoutMS": 5000, "connectTimeoutMS": 5000, "socketTimeoutMS": 30000, "compressors": compressors, "connect": False},
+}
+
+clients = {}
+clientsLock = threading.Lock()
+
+def connectionString() -> str:
+    load_dotenv(verbose=True) # Load db credentials from .env
+    return f'mongodb://{os.getenv("MONGODB_USERNAME")}:{os.getenv("MONGODB_PASSWORD")}@{os.getenv("MONGODB_URL")}/' # Assemble string used to connect to mongodb from geo2
+
+def taxConnectionString() -> str:
+    # The server of the property tax records and the bridge listings the tax API reads. The MONGODB_* server when TAX_MONGODB_URL isn't set
+    load_dotenv(verbose=True)
+    if not os.getenv("TAX_MONGODB_URL"):
+        return connectionString()
+    return f'mongodb://{os.getenv("TAX_MONGODB_USERNAME")}:{os.getenv("TAX_MONGODB_PASSWORD")}@{os.getenv("TAX_MONGODB_URL")}/'
+
+def getClient(profile: str = "sync", url: str = None) -> MongoClient:
+    """The process's client for a workload on a server, created the first time it's asked for
+
+    Args:
+        profile (str, optional): One of the keys of profiles: "sync", "seed", "dashboard" or "api". Defaults to "sync".
+        url (str, optional): The connection string of the server, for example taxConnectionString(). Defaults to the MONGODB_* server in .env.
+    """
+    url = url or connectionString()
+    with clientsLock:
+        if (profile, url) not in clients:
+            clients[(profile, url)] = MongoClient(url, **profiles[profile])
+        return clients[(profile, url)]
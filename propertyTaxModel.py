@@ -0,0 +1,109 @@
+# Training and loading of the tax prediction model served by propertyTaxApi.
+# Training reads the 2016 class 2 sales of every county, fits the model and
+# writes a versioned artifact, the pickled model with its features and its
+# mean absolute error on the training and test sets, to models/. A small
+# pointer file names the artifact the API serves, so the API only unpickles
+# one file at startup instead of scanning the counties.
+# Train and publish a new version with:
+#   python3 propertyTaxModel.py [alpha]
+
+import json
+import os
+import pickle
+import sys
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+model_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "models") # Beside this file, whichever directory the API or training runs from
+model_pointer = os.path.join(model_directory, "tax_prediction_model.json") # Names the artifact the API serves
+counties = ["morris", "atlantic", "hudson", "essex"]
+feature_columns = ['LAND-VALUE', "SALE-PRICE", "CALCULATED-ACREAGE", "NET-VALUE"]
+target_column = 'LAST-YEAR-TAX'
+training_query = {"SALE-PRICE": {'$gt': 100}, "year": 2016, "PROPERTY-CLASS": 2}
+
+def load_training_data(db):
+    # The features and taxes of the training sales of every county, with the records missing a numeric feature dropped
+    projection = dict.fromkeys(feature_columns + [target_column], 1)
+    projection["_id"] = 0
+    frames = []
+    for county in counties:
+        records = pd.DataFrame(list(db[county].find(training_query, projection)), columns=feature_columns + [target_column])
+        print(f"{county}: {len(records)} records")
+        frames.append(records)
+    data = pd.concat(frames, ignore_index=True)
+    data[feature_columns] = data[feature_columns].apply(pd.to_numeric, errors='coerce')
+    data = data.dropna()
+    data[feature_columns] = data[feature_columns].astype('int')
+    return data[feature_columns].to_numpy(np.float64), data[target_column].to_numpy(np.float64)
+
+def train(X, y, alpha=0.1):
+    # Fit the model on 80% of the sales and measure it on both parts. Returns the model and its metrics
+    from sklearn import linear_model
+    from sklearn.model_selection import train_test_split
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2, random_state = 42)
+    model = linear_model.Lasso(alpha=alpha).fit(X_train, y_train)
+    metrics = {
+        "train_mae": float(np.mean(np.abs(model.predict(X_train) - y_train))),
+        "test_mae": float(np.mean(np.abs(model.predict(X_test) - y_test))),
+        "train_rows": int(len(y_train)),
+        "test_rows": int(len(y_test)),
+        "alpha": alpha,
+    }
+    return model, metrics
+
+def save_model(model, metrics):
+    # Write a new version of the model and point the API at it. Returns the version
+    version = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    os.makedirs(model_directory, exist_ok=True)
+    path = os.path.join(model_directory, f"tax_prediction_model-{version}.pkl")
+    with open(path, 'wb') as file:
+        pickle.dump({"model": model, "version": version, "features": feature_columns, "metrics": metrics}, file)
+    pointer = model_pointer + ".tmp"
+    with open(pointer, 'w') as file:
+        json.dump({"version": version, "path": os.path.basename(path), "metrics": metrics}, file, indent=4)
+    os.replace(pointer, model_pointer) # A running API never reads a half written pointer
+    return version
+
+class TaxModel:
+    # A trained model as the API serves it: one artifact unpickled once, with the error measured when it was trained
+    def __init__(self, pointer=model_pointer):
+        with open(pointer) as file:
+            published = json.load(file)
+        with open(os.path.join(os.path.dirname(pointer), published["path"]), 'rb') as file:
+            artifact = pickle.load(file)
+        self.model = artifact["model"]
+        self.version = artifact["version"]
+        self.features = artifact["features"]
+        self.metrics = artifact["metrics"]
+        self.mae = self.metrics["train_mae"]
+
+    def predict(self, features):
+        # One prediction per row of features, in a single call to the model
+        return self.model.predict(features)
+
+tax_model = None
+tax_model_lock = threading.Lock()
+
+def get_tax_model():
+    # One TaxModel per process. TAX_MODEL in .env names another pointer file to serve
+    global tax_model
+    with tax_model_lock:
+        if tax_model is None:
+            tax_model = TaxModel(os.getenv("TAX_MODEL", model_pointer))
+        return tax_model
+
+def main(args):
+    from mongoClients import getClient, taxConnectionString
+
+    alpha = float(args[0]) if args else 0.1
+    X, y = load_training_data(getClient("seed", taxConnectionString())["housing-tax-prices"])
+    model, metrics = train(X, y, alpha)
+    version = save_model(model, metrics)
+    print(f"Saved version {version}: {metrics}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
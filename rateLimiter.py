@@ -0,0 +1,200 @@
+# Author: Andrew Pantera for TLCengine
+# Token bucket rate limiting for the MLS API clients. A bucket refills at a
+# fixed rate up to its capacity, and every request takes a token, waiting
+# until one is available. The same bucket can be used from threads and from
+# asyncio code. Every provider gets one RateLimiter per process, shared by
+# all the syncs that talk to it, see getLimiter.
+
+import asyncio
+import datetime
+import email.utils
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """Construct a token bucket
+
+        Args:
+            rate (float): Tokens added per second, the sustained number of requests per second allowed
+            capacity (float, optional): The most tokens the bucket can hold, the size of the largest burst allowed. Defaults to rate.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self, tokens: float = 1) -> float:
+        # Take the tokens now, possibly going into debt, and return how many seconds the caller has to wait for the debt to be paid off
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return max(0, -self.tokens / self.rate)
+
+    def acquire(self, tokens: float = 1) -> None:
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def acquireAsync(self, tokens: float = 1) -> None:
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+# Published (or observed safe) limits for each provider. RETS servers don't publish request rates, they
+# reject with "Too many outstanding queries" instead, so those are kept low and backed off when rejected
+providerLimits = {
+    "BRIDGE": {"requestsPerSecond": 1.3, "burst": 5}, # 5000 requests per hour
+    "MLSGRID": {"requestsPerSecond": 2, "bytesPerHour": 4 * 1024**3}, # 2 requests per second, 4GB per hour
+    "REBNY": {"requestsPerSecond": 2},
+    "TRESTLE": {"requestsPerSecond": 2, "burst": 4}, # 7200 requests per hour
+    "MLSPIN": {"requestsPerSecond": 5},
+    "CTMLS": {"requestsPerSecond": 2},
+    "MLSMATRIX": {"requestsPerSecond": 2},
+    "PARAGON": {"requestsPerSecond": 2},
+}
+stateFile = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'rateLimits.json')
+saveInterval = 5 # Seconds between writes of a limiter's state to stateFile
+stateFileLock = threading.Lock() # Between the threads of a process, the lock file below is held between processes
+stateLockFile = stateFile + '.lock'
+
+class RateLimiter:
+    def __init__(self, name: str, requestsPerSecond: float, burst: float = None, bytesPerHour: float = None, defaultBackoff: float = 10):
+        """A provider's request and bandwidth budget. Its state is saved to rateLimits.json so that a
+        restarted sync doesn't start with a full budget while the provider is still counting the last run.
+
+        Args:
+            name (str): The provider, the key of this limiter in rateLimits.json
+            requestsPerSecond (float): The sustained number of requests per second allowed
+            burst (float, optional): The most requests allowed at once. Defaults to requestsPerSecond.
+            bytesPerHour (float, optional): The number of response bytes allowed per hour. Defaults to no limit.
+            defaultBackoff (float, optional): Seconds to wait after a 429 response with no Retry-After header. Defaults to 10.
+        """
+        self.name = name
+        self.requests = TokenBucket(requestsPerSecond, burst)
+        self.bytes = TokenBucket(bytesPerHour / 3600, bytesPerHour) if bytesPerHour else None
+        self.defaultBackoff = defaultBackoff
+        self.blockedUntil = 0 # Wall clock time before which no requests should be made
+        self.savedAt = 0
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(stateFile) as json_file:
+                state = json.load(json_file).get(self.name)
+        except (FileNotFoundError, ValueError):
+            state = None
+        if not state:
+            return
+        self.blockedUntil = state.get("blockedUntil", 0)
+        elapsed = max(0, time.time() - state.get("timestamp", 0))
+        # Refill the buckets for the time that passed since the state was saved
+        self.requests.tokens = min(self.requests.capacity, state.get("requestTokens", self.requests.capacity) + elapsed * self.requests.rate)
+        if self.bytes:
+            self.bytes.tokens = min(self.bytes.capacity, state.get("byteTokens", self.bytes.capacity) + elapsed * self.bytes.rate)
+
+    def save(self, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self.savedAt < saveInterval:
+            return
+        self.savedAt = now
+        # Every sync process saves its providers into the same file, so the whole read, update and write holds the lock file.
+        # Otherwise two processes read the same states and the last to write drops the other's provider
+        with stateFileLock, open(stateLockFile, 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX) # Released when the file is closed
+            try:
+                with open(stateFile) as json_file:
+                    states = json.load(json_file)
+            except (FileNotFoundError, ValueError):
+                states = {}
+            states[self.name] = {
+                "timestamp": now,
+                "blockedUntil": self.blockedUntil,
+                "requestTokens": self.requests.tokens,
+                "byteTokens": self.bytes.tokens if self.bytes else None
+            }
+            # Other processes read the file while we save, so they get the old or the new states and never half of them
+            temporary = f"{stateFile}.{os.getpid()}.tmp"
+            with open(temporary, 'w') as outfile:
+                json.dump(states, outfile)
+            os.replace(temporary, stateFile)
+
+    def _wait(self) -> float:
+        # Seconds until a request may be made: the provider's Retry-After, then the request budget, then any bandwidth debt
+        wait = max(0, self.blockedUntil - time.time())
+        wait = max(wait, self.requests._reserve(1))
+        if self.bytes:
+            wait = max(wait, self.bytes._reserve(0))
+        return wait
+
+    def acquire(self) -> None:
+        wait = self._wait()
+        if wait:
+            time.sleep(wait)
+
+    async def acquireAsync(self) -> None:
+        wait = self._wait()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def backoff(self, seconds: float) -> None:
+        # Block every request to this provider for the next number of seconds
+        self.blockedUntil = max(self.blockedUntil, time.time() + seconds)
+        logging.info(f"    {self.name}: Backing off requests for {round(seconds, 1)} seconds")
+        self.save(force=True)
+
+    def record(self, response: requests.Response) -> bool:
+        """Charge a response against the bandwidth budget, and back off if the provider said to slow down
+
+        Returns:
+            bool: True if the request was throttled by the provider and should be made again
+        """
+        if self.bytes:
+            self.bytes._reserve(len(response.content))
+        throttled = response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers)
+        if throttled:
+            self.backoff(parseRetryAfter(response.headers.get("Retry-After"), self.defaultBackoff))
+        else:
+            self.save()
+        return throttled
+
+    def get(self, url: str, session: requests.Session = None, retries: int = 5, **kwargs) -> requests.Response:
+        # GET a url within this provider's budget, waiting out and repeating requests the provider throttled
+        for _ in range(retries):
+            self.acquire()
+            response = (session or requests).get(url, **kwargs)
+            if not self.record(response):
+                break
+        return response
+
+def parseRetryAfter(value: str, default: float) -> float:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return default
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, (email.utils.parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+limiters = {}
+limitersLock = threading.Lock()
+
+def getLimiter(name: str) -> RateLimiter:
+    # One limiter per provider per process, so that every sync talking to a provider shares its budget
+    with limitersLock:
+        if name not in limiters:
+            limiters[name] = RateLimiter(name, **providerLimits[name])
+        return limiters[name]
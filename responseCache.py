@@ -0,0 +1,60 @@
+# Author: Andrew Pantera for TLCengine
+# An in-process cache of rendered responses, for API routes whose answers
+# only change when the data behind them does. Entries expire after a time
+# to live, and the least recently used ones are dropped to keep the cache
+# under a memory budget. Callers put the versions of the data a response
+# was built from in its key, so a new version of the data misses the cache
+# instead of serving the stale response.
+
+import collections
+import threading
+import time
+
+class ResponseCache:
+    def __init__(self, maxBytes: int = 64 * 2**20, ttlSeconds: float = 86400):
+        """Construct an empty response cache
+
+        Args:
+            maxBytes (int, optional): The most bytes of responses kept. Defaults to 64 MiB.
+            ttlSeconds (float, optional): Seconds a response is served before it's built again. Defaults to a day.
+        """
+        self.maxBytes = maxBytes
+        self.ttlSeconds = ttlSeconds
+        self.entries = collections.OrderedDict() # key -> (expires, size, value), least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        # The value stored for key, or None when there is none or it expired
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, size: int) -> None:
+        # Store value, size bytes large, dropping the least recently used values until the cache fits its budget
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + self.ttlSeconds, size, value)
+            self.size += size
+            while self.size > self.maxBytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key) -> None:
+        # Called with the lock held
+        self.size -= self.entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,163 @@
+# Author: Andrew Pantera for TLCengine
+# Bounded retries for the MLS syncs and the ETL. A RetryExecutor calls a
+# function until it succeeds, sleeping with exponential backoff and jitter
+# between attempts, with a separate RetryPolicy for each class of error.
+# Errors without a policy are raised right away. Every MLS has a circuit
+# breaker that opens after too many consecutive retryable failures, so that an MLS
+# that is down is skipped until it has had time to recover instead of
+# being hammered by every sync.
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+class CircuitOpenError(Exception):
+    pass
+
+class RetryPolicy:
+    def __init__(self, maxAttempts: int = 5, baseDelay: float = 1, maxDelay: float = 60, jitter: float = .5):
+        """How to retry one class of error
+
+        Args:
+            maxAttempts (int, optional): The most times the function is called, including the first. Defaults to 5.
+            baseDelay (float, optional): Seconds to wait after the first failure, doubled after every failure after that. Defaults to 1.
+            maxDelay (float, optional): The longest wait between attempts in seconds. Defaults to 60.
+            jitter (float, optional): The fraction of each wait that is randomized, so that syncs that failed together don't retry together. Defaults to .5.
+        """
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        # Seconds to wait after the given failed attempt, starting at 1
+        delay = min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+class CircuitBreaker:
+    def __init__(self, name: str, failureThreshold: int = 10, resetTimeout: float = 300):
+        """Stop calling an MLS after failureThreshold consecutive failures. After resetTimeout seconds
+        one call is let through, and the circuit closes again if it succeeds.
+
+        Args:
+            name (str): The MLS this breaker protects
+            failureThreshold (int, optional): Consecutive failures before the circuit opens. Defaults to 10.
+            resetTimeout (float, optional): Seconds the circuit stays open. Defaults to 300, one ETL cycle.
+        """
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if time.monotonic() - self.openedAt >= self.resetTimeout:
+                # Half open: let this call through, a failure opens the circuit again right away
+                self.openedAt = None
+                self.failures = self.failureThreshold - 1
+                return True
+            return False
+
+    def recordSuccess(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+
+    def recordFailure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failureThreshold and self.openedAt is None:
+                self.openedAt = time.monotonic()
+                logging.warning(f"    {self.name}: {self.failures} consecutive failures, pausing requests for {self.resetTimeout} seconds")
+
+breakers = {}
+breakersLock = threading.Lock()
+
+def getBreaker(name: str) -> CircuitBreaker:
+    # One breaker per MLS per process, shared by everything that talks to that MLS
+    with breakersLock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name)
+        return breakers[name]
+
+class RetryExecutor:
+    def __init__(self, name: str, policies: Dict[type, RetryPolicy]):
+        """Call functions for an MLS, retrying the errors that have a policy
+
+        Args:
+            name (str): The MLS, used for logging and to find its circuit breaker
+            policies (Dict[type, RetryPolicy]): Keyed by exception class. The first class the error is an instance of decides the policy, so list specific classes before general ones
+        """
+        self.name = name
+        self.policies = policies
+        self.breaker = getBreaker(name)
+
+    def policyFor(self, exc: Exception) -> RetryPolicy:
+        for errorClass, policy in self.policies.items():
+            if isinstance(exc, errorClass):
+                return policy
+        return None
+
+    def run(self, function: Callable, *args, onRetry: Callable[[Exception, int], None] = None, **kwargs):
+        """Call function(*args, **kwargs) until it succeeds or its error runs out of attempts
+
+        Args:
+            function (Callable): The function to call
+            onRetry (Callable[[Exception, int], None], optional): Called with the error and the attempt number before every retry, for example to log in again. Defaults to None.
+
+        Raises:
+            CircuitOpenError: If the MLS has failed too many times in a row recently
+            Exception: The last error, if it has no policy or ran out of attempts
+
+        Returns:
+            The result of the function
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.name} is failing, not calling {getattr(function, '__name__', function)}")
+            attempt += 1
+            try:
+                result = function(*args, **kwargs)
+            except Exception as exc:
+                policy = self.policyFor(exc)
+                if policy is None:
+                    # Errors without a policy are problems with the call, not with the MLS, so they don't count towards the breaker
+                    raise
+                self.breaker.recordFailure()
+                if attempt >= policy.maxAttempts:
+                    raise
+                delay = policy.delay(attempt)
+                logging.info(f"    {self.name}: {type(exc).__name__} on attempt {attempt}, retrying in {round(delay, 1)} seconds: {exc}")
+                time.sleep(delay)
+                if onRetry:
+                    onRetry(exc, attempt)
+            else:
+                self.breaker.recordSuccess()
+                return result
+
+def runUpdate(name: str, updateMethod: Callable, timeDelta) -> bool:
+    """Run an MLS's ETL update, retrying a failed update a few times with backoff and then skipping that MLS
+    until the next run instead of retrying forever. The retries have the "<name> ETL" breaker, not the one
+    the sync's own searches use, which is named after the MLS
+
+    Args:
+        name (str): The MLS, for logging and to name the breaker
+        updateMethod (Callable): The sync's update, called with timeDelta
+        timeDelta (datetime.timedelta): How far back the update goes
+
+    Returns:
+        bool: Whether the update succeeded
+    """
+    try:
+        RetryExecutor(f"{name} ETL", {Exception: RetryPolicy(maxAttempts=3, baseDelay=30, maxDelay=300)}).run(updateMethod, timeDelta)
+        return True
+    except Exception as e:
+        logging.error(f'Exception in the ETL: {name} update failed, skipping it until the next run: {e}')
+        return False
@@ -0,0 +1,266 @@
+# Author: Andrew Pantera for TLCengine
+# Logged in RETS sessions that are kept and reused by the RETS syncs
+# (MLSPIN, CTMLS, PARAGON, MLSMATRIX) across ETL runs. Logging in, capability
+# discovery and the metadata requests needed to find a resource class are
+# done once per session instead of once per search, the resource and class
+# metadata is cached on disk so new sessions don't request it again, and a
+# session only logs in again when the server answers 401 Unauthorized.
+# streamSearch pages through large searches so that only one page of
+# records is held in memory at a time, and keysetSearch pages through Matrix
+# servers by Matrix_Unique_ID.
+
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List
+
+import requests
+from rets.client import RetsClient
+
+metadataCacheDirectory = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'retsMetadata')
+metadataValidSeconds = 24 * 3600 # Metadata rarely changes, refresh it daily
+
+def isUnauthorized(exc: Exception) -> bool:
+    # True if the error is the server rejecting our session, which is fixed by logging in again
+    response = getattr(exc, 'response', None)
+    return isinstance(exc, requests.exceptions.HTTPError) and response is not None and response.status_code == 401
+
+class RetsSession:
+    def __init__(self, pool):
+        """One logged in RETS client, and the resource classes already found with it"""
+        self.pool = pool
+        self.client = None
+        self.classes = {}
+        self.logIn()
+
+    def logIn(self) -> None:
+        self.client = self.pool.newClient()
+        self.classes = {}
+
+    def getClass(self, resource: str, className: str):
+        if (resource, className) not in self.classes:
+            self.classes[(resource, className)] = self.client.get_resource(resource).get_class(className)
+        return self.classes[(resource, className)]
+
+    def getClasses(self, resource: str) -> tuple:
+        classes = tuple(self.client.get_resource(resource).classes)
+        for rClass in classes:
+            self.classes.setdefault((resource, rClass.name), rClass)
+        return classes
+
+class RetsSessionPool:
+    def __init__(self, name: str, size: int = 1, **clientOptions):
+        """A pool of logged in sessions for one RETS server. Sessions are created as they are needed,
+        up to size, which should stay within the number of concurrent sessions the server allows.
+
+        Args:
+            name (str): The MLS, the prefix of its _LOGIN_URL, _USERNAME and _PASSWORD variables in .env
+            size (int, optional): The most sessions open at once. Defaults to 1.
+            clientOptions: Passed on to RetsClient, for example auth_type='basic'
+        """
+        self.name = name
+        self.size = size
+        self.clientOptions = clientOptions
+        self.idle = queue.LifoQueue() # Reuse the most recently used session, it is the least likely to have timed out
+        self.created = 0
+        self.lock = threading.Lock()
+        self.metadataFile = os.path.join(metadataCacheDirectory, f'{name}.pickle')
+        self.metadata = self.loadMetadata()
+
+    def loadMetadata(self) -> dict:
+        try:
+            with open(self.metadataFile, 'rb') as cacheFile:
+                cache = pickle.load(cacheFile)
+            if time.time() - cache.get("timestamp", 0) < metadataValidSeconds:
+                return cache["metadata"]
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, KeyError, AttributeError):
+            pass
+        return {}
+
+    def saveMetadata(self) -> None:
+        os.makedirs(metadataCacheDirectory, exist_ok=True)
+        with self.lock:
+            with open(self.metadataFile, 'wb') as cacheFile:
+                pickle.dump({"timestamp": time.time(), "metadata": dict(self.metadata)}, cacheFile)
+
+    def newClient(self) -> RetsClient:
+        logging.info(f"    {self.name}: Logging in to RETS")
+        client = RetsClient(
+            login_url=os.getenv(f"{self.name}_LOGIN_URL"),
+            username=os.getenv(f"{self.name}_USERNAME"),
+            password=os.getenv(f"{self.name}_PASSWORD"),
+            **self.clientOptions
+        )
+        self.cacheMetadata(client)
+        return client
+
+    def cacheMetadata(self, client: RetsClient) -> None:
+        # Answer the client's resource and class metadata requests from the disk cache when we can
+        http = getattr(client, '_http', None)
+        if http is None or not hasattr(http, 'get_metadata'):
+            return
+        fetch = http.get_metadata
+
+        def get_metadata(type_, *args, **kwargs):
+            key = repr((type_, args, sorted(kwargs.items())))
+            if key not in self.metadata:
+                self.metadata[key] = fetch(type_, *args, **kwargs)
+                try:
+                    self.saveMetadata()
+                except (pickle.PicklingError, TypeError, AttributeError) as exc:
+                    logging.info(f"    {self.name}: Could not cache RETS metadata: {exc}")
+            return self.metadata[key]
+        http.get_metadata = get_metadata
+
+    def acquire(self) -> RetsSession:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+        if not create:
+            return self.idle.get() # Wait for another thread to give a session back
+        try:
+            return RetsSession(self)
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def resize(self, size: int) -> None:
+        # Allow up to size sessions at once. When shrinking, idle sessions over the size are dropped now and busy ones as they're released
+        with self.lock:
+            self.size = size
+            while self.created > self.size:
+                try:
+                    self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                self.created -= 1
+
+    def release(self, session: RetsSession) -> None:
+        with self.lock:
+            if self.created > self.size:
+                self.created -= 1
+                return
+        self.idle.put(session)
+
+    @contextlib.contextmanager
+    def session(self):
+        session = self.acquire()
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+def streamSearch(search: Callable, pageSize: int = 5000, batchSize: int = 1000, convert: Callable[[dict], dict] = None) -> Iterator[List[dict]]:
+    """Page through a RETS search with Limit and Offset, yielding the records in batches as they are
+    downloaded, so memory holds one page no matter how many records the query matches
+
+    Args:
+        search (Callable): Called as search(limit, offset) to get one page, for example a rClass.search for one query
+        pageSize (int, optional): Records requested per search. Defaults to 5000.
+        batchSize (int, optional): Records per yielded batch. Defaults to 1000.
+        convert (Callable[[dict], dict], optional): Applied to each record's data as its batch is yielded. Defaults to None.
+
+    Yields:
+        List[dict]: The data of up to batchSize records
+    """
+    offset = None # RETS offsets start at 1, the first page is requested without one
+    received = 0
+    firstRecord = None
+    while True:
+        result = search(pageSize, offset)
+        records = result.data
+        if not records:
+            return
+        if firstRecord is not None and repr(records[0].data) == firstRecord:
+            logging.warning("    RETS: The server ignored the search Offset, stopping instead of downloading the first page again")
+            return
+        firstRecord = repr(records[0].data)
+        received += len(records)
+        for start in range(0, len(records), batchSize):
+            batch = [record.data for record in records[start:start+batchSize]]
+            yield list(map(convert, batch)) if convert else batch
+        # Servers can return fewer records than the limit when they have their own maximum, so stop on the count when it's known
+        count = getattr(result, 'count', None)
+        if (count is not None and received >= count) or (count is None and len(records) < pageSize and not getattr(result, 'max_rows', False)):
+            return
+        offset = received + 1
+        del records, result
+
+def keysetSearch(search: Callable[[str], List[dict]], query: str = "", key: str = "Matrix_Unique_ID", start: int = 0, pageSize: int = 5000, isolateSpan: int = 5000) -> Iterator[List[dict]]:
+    """Page through a search in order of an integer key, each page starting after the last key of the one before.
+    The next page is downloaded while the caller handles the current one. When the rets library can't parse a
+    page (it raises TypeError on some malformed records), the next isolateSpan keys are bisected down to the records
+    that fail, so only those are skipped
+
+    Args:
+        search (Callable[[str], List[dict]]): Called with a DMQL query, returns the data of the matching records sorted by key
+        query (str, optional): Conditions added to every search. Defaults to "", every record.
+        key (str, optional): The field to page by. Defaults to "Matrix_Unique_ID".
+        start (int, optional): The first key to get. Defaults to 0.
+        pageSize (int, optional): The most records the server returns for one search. Defaults to 5000.
+        isolateSpan (int, optional): Keys searched by bisection after a page fails to parse. Defaults to 5000.
+
+    Yields:
+        List[dict]: The data of one page of records
+    """
+    def keyQuery(low: int, high: int = None) -> str:
+        condition = f"({key}={low}+)" if high is None else f"({key}={low}-{high})"
+        return f"{query}, {condition}" if query else condition
+
+    def fetch(low: int):
+        try:
+            return search(keyQuery(low)), None
+        except TypeError as exc:
+            return None, exc
+
+    def isolate(low: int, high: int) -> Iterator[List[dict]]:
+        # Search ranges in key order, halving the ones that fail until the single keys that can't be parsed are found
+        ranges = [(low, high)]
+        while ranges:
+            low, high = ranges.pop()
+            try:
+                page = search(keyQuery(low, high))
+            except TypeError as exc:
+                if low == high:
+                    logging.warning(f"    RETS: Skipped the record with {key} {low}, it could not be parsed: {exc}")
+                    continue
+                middle = (low + high) // 2
+                ranges.append((middle + 1, high))
+                ranges.append((low, middle))
+                continue
+            if len(page) >= pageSize: # The range had more records than one search returns
+                ranges.append((page[-1][key] + 1, high))
+            if page:
+                yield page
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        low = start
+        nextPage = prefetcher.submit(fetch, low)
+        while True:
+            page, exc = nextPage.result()
+            if exc is not None:
+                logging.info(f"    RETS: The page starting at {key} {low} could not be parsed, searching {key} {low} to {low+isolateSpan-1} in smaller ranges: {exc}")
+                yield from isolate(low, low + isolateSpan - 1)
+                low += isolateSpan
+                nextPage = prefetcher.submit(fetch, low)
+                continue
+            if not page:
+                return
+            full = len(page) >= pageSize
+            if full:
+                low = page[-1][key] + 1
+                nextPage = prefetcher.submit(fetch, low)
+            yield page
+            if not full:
+                return
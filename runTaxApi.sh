@@ -0,0 +1,2 @@
+#!/bin/bash
+nohup gunicorn propertyTaxApi:app &
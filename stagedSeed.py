@@ -0,0 +1,94 @@
+# Author: Andrew Pantera for TLCengine
+# Staged seeds. Instead of upserting every listing into the live collection,
+# which looks each one up in its indexes while the dashboard is reading it, a
+# staged seed inserts unordered into a fresh <collection>_staging collection
+# with no indexes other than _id. When the seed is done the duplicate
+# listings from overlapping searches are removed, the live collection's
+# indexes are built on the staging collection, and it is renamed over the
+# live collection in one step, so readers never see a half loaded collection.
+# Listings the ETL updated in the live collection while the seed ran are lost
+# with it, so the sync's update is run for the time since the seed started
+# right after the swap.
+
+import datetime
+import logging
+import time
+from typing import Callable
+
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError
+
+from dataVersions import publishVersion
+from listingsClean import getMLS, rebuild
+from retry import runUpdate
+
+duplicateKeyError = 11000
+indexOptions = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'collation')
+
+def stagingCollection(collection, fresh: bool = True):
+    """The staging collection a seed of collection inserts into
+
+    Args:
+        collection (pymongo.collection.Collection): The live collection the seed replaces
+        fresh (bool, optional): Drop what an earlier seed left in the staging collection. Pass False when resuming that seed. Defaults to True.
+    """
+    staging = collection.database[f"{collection.name}_staging"].with_options(codec_options=collection.codec_options)
+    if fresh:
+        staging.drop()
+    return staging
+
+def insertStaged(docs: list, staging) -> int:
+    # Insert without looking anything up. Listings inserted twice by resumed or overlapping searches are removed by swapIn
+    if not docs:
+        return 0
+    try:
+        return len(staging.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as bwe:
+        errors = [error for error in bwe.details.get("writeErrors", []) if error.get("code") != duplicateKeyError]
+        if errors:
+            raise
+        return bwe.details.get("nInserted", 0)
+
+def seedStarted(staging, started: datetime.datetime) -> datetime.datetime:
+    # A resumed seed began when the run that staged its first listing did, which the oldest ObjectId records
+    first = staging.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+    if first is None:
+        return started
+    return min(started, first["_id"].generation_time)
+
+def swapIn(staging, collection, key: str, started: datetime.datetime, update: Callable[[datetime.timedelta], None] = None) -> None:
+    """Replace collection with staging: remove duplicates of key, build collection's indexes and an index on key, rename,
+    then catch up on the listings modified while the seed ran
+
+    Args:
+        staging (pymongo.collection.Collection): The staging collection a seed filled
+        collection (pymongo.collection.Collection): The live collection to replace
+        key (str): The field that identifies a listing, which the syncs' updates look listings up by
+        started (datetime.datetime): When this run of the seed started, timezone aware
+        update (Callable[[datetime.timedelta], None], optional): The sync's update into collection, run for the time since the seed started. Defaults to None, for MLSs nothing else writes to.
+    """
+    st = time.time()
+    started = seedStarted(staging, started)
+    duplicates = staging.aggregate([
+        {"$sort": {"_id": -1}}, # Newest first, so the listing inserted last is the one kept
+        {"$group": {"_id": f"${key}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    removed = 0
+    for duplicate in duplicates:
+        removed += staging.delete_many({"_id": {"$in": duplicate["ids"][1:]}}).deleted_count
+    indexes = []
+    for name, info in collection.index_information().items():
+        if name != '_id_':
+            indexes.append(IndexModel(info['key'], name=name, **{option: info[option] for option in indexOptions if option in info}))
+    if not any(next(iter(index.document['key'])) == key for index in indexes): # The updates after the seed need to find listings by key
+        indexes.append(IndexModel([(key, 1)]))
+    staging.create_indexes(indexes)
+    staging.rename(collection.name, dropTarget=True)
+    if update is not None:
+        runUpdate(f"{collection.database.name} staged seed", update, datetime.datetime.now(datetime.timezone.utc) - started)
+    mls = getMLS(collection)
+    if mls is not None:
+        rebuild(mls) # Staged listings weren't cleaned as they were inserted
+    publishVersion(collection)
+    logging.info(f"    {collection.database.name}.{collection.name}: Swapped in the staged seed, removed {removed} duplicate listings and built {len(indexes)} indexes in {round(time.time()-st, 1)} seconds")
@@ -0,0 +1,67 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of the normalized address keys the tax API looks records up by.
+# Run with: python3 -m pytest
+
+import pytest
+
+from addressKeys import addressKey, bridgeAddressKey, keyCollection, taxAmount
+
+@pytest.mark.parametrize("address", ["12 MAIN ST", "12 Main_st.", "  12   main st  ", "12-Main, St", "12_MAIN_ST"])
+def test_addressKeyNormalizes(address):
+    assert addressKey(address) == "12 MAIN ST"
+
+def test_addressKeyOfNothing():
+    assert addressKey(None) is None
+    assert addressKey("") is None
+    assert addressKey(" .,_ ") is None # Nothing but punctuation isn't an address
+    assert addressKey(12) == "12"
+
+def test_bridgeAddressKey():
+    assert bridgeAddressKey({"StreetNumber": "12", "StreetName": "Main", "StreetSuffix": "St"}) == "12 MAIN"
+    assert bridgeAddressKey({"StreetNumber": 7, "StreetName": "o'neil"}) == "7 O NEIL"
+    assert bridgeAddressKey({"StreetNumber": "", "StreetName": "Main"}) is None
+    assert bridgeAddressKey({"StreetName": "Main"}) is None
+
+def test_theApiUrlAndBridgeKeysMatch():
+    # The API looks bridge up by the first two underscore separated parts of the address in the URL
+    url = "12_Main_St"
+    assert addressKey(" ".join(url.split("_")[:2])) == bridgeAddressKey({"StreetNumber": "12", "StreetName": "main"})
+
+def test_taxAmount():
+    assert taxAmount("$12,345") == 12345
+    assert taxAmount(12345) == 12345
+    assert taxAmount("N/A") is None
+    assert taxAmount(None) is None
+
+class FakeResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+class FakeCollection:
+    # Just enough of a pymongo collection for keyCollection
+    def __init__(self, records):
+        self.records = {record["_id"]: record for record in records}
+        self.batches = []
+
+    def find(self, query, projection, batch_size):
+        (keyField, condition), = query.items()
+        assert condition == {"$exists": False}
+        return [{field: record[field] for field in ["_id", *projection] if field in record} for record in self.records.values() if keyField not in record]
+
+    def bulk_write(self, updates, ordered):
+        self.batches.append(len(updates))
+        for update in updates:
+            self.records[update._filter["_id"]].update(update._doc["$set"])
+        return FakeResult(len(updates))
+
+def test_keyCollectionKeysOnlyUnkeyedRecords():
+    collection = FakeCollection([
+        {"_id": 1, "STREET-ADDRESS": "1 Elm St."},
+        {"_id": 2, "STREET-ADDRESS": "2 Elm St", "ADDRESS-KEY": "2 ELM ST"},
+        {"_id": 3, "STREET-ADDRESS": "3 elm_st"},
+        {"_id": 4, "STREET-ADDRESS": "4 Elm St"},
+    ])
+    keyed = keyCollection(collection, "ADDRESS-KEY", ["STREET-ADDRESS"], lambda record: addressKey(record["STREET-ADDRESS"]), batchSize=2)
+    assert keyed == 3
+    assert collection.batches == [2, 1]
+    assert [record["ADDRESS-KEY"] for record in collection.records.values()] == ["1 ELM ST", "2 ELM ST", "3 ELM ST", "4 ELM ST"]
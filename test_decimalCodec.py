@@ -0,0 +1,54 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of the Decimal to Decimal128 conversion on the RETS syncs' write path.
+# Run with: python3 -m pytest
+
+import collections
+import decimal
+from decimal import Decimal
+
+import bson
+import pytest
+from bson.decimal128 import Decimal128
+
+from decimalCodec import convert_decimal, decimalCodecOptions, recursiveConvertDecimal, syntheticRecords, toDecimal128
+
+@pytest.mark.parametrize("value", [
+    "0", "-0", "1", "-1", "0.00", "123.45", "-98765.4321", "1E+3", "2.5E-10",
+    "9" * 34, "-" + "9" * 34, "1E+6111", "1E-6176", "0.000001",
+])
+def test_toDecimal128PacksLikePymongo(value):
+    packed = toDecimal128(Decimal(value))
+    assert packed.bid == Decimal128(Decimal(value)).bid
+    assert str(packed.to_decimal()) == str(Decimal(value)) # The exponent is kept, so "0.00" stays "0.00"
+
+@pytest.mark.parametrize("value", ["NaN", "-Infinity", "sNaN"])
+def test_toDecimal128FallsBackForSpecialValues(value):
+    assert toDecimal128(Decimal(value)).bid == Decimal128(Decimal(value)).bid
+
+@pytest.mark.parametrize("value", ["1" * 40, "1E+7000"])
+def test_toDecimal128RejectsValuesThatNeedRounding(value):
+    with pytest.raises(decimal.DecimalException): # Like pymongo, rather than storing a different value
+        toDecimal128(Decimal(value))
+
+def test_convertDecimalNested():
+    record = collections.OrderedDict(
+        ListPrice=Decimal("500000.00"),
+        Rooms=[{"Area": Decimal("12.5")}, [Decimal("1.1")], "Den"],
+        Remarks="Sunny",
+        Beds=3,
+        Empty=None,
+    )
+    assert convert_decimal(record) is record # Converted in place
+    assert record["ListPrice"] == Decimal128("500000.00")
+    assert record["Rooms"] == [{"Area": Decimal128("12.5")}, [Decimal128("1.1")], "Den"]
+    assert (record["Remarks"], record["Beds"], record["Empty"]) == ("Sunny", 3, None)
+
+def test_convertDecimalIgnoresNonDictionaries():
+    assert convert_decimal(None) is None
+    assert convert_decimal(Decimal("1")) == Decimal("1")
+
+def test_approachesEncodeTheSameBson():
+    records = syntheticRecords(20)
+    converted = bson.encode(convert_decimal(syntheticRecords(20)[0]))
+    assert converted == bson.encode(recursiveConvertDecimal(syntheticRecords(20)[0]))
+    assert converted == bson.encode(records[0], codec_options=decimalCodecOptions)
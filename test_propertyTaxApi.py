@@ -0,0 +1,102 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of the tax API's response cache, ETags and 304s, against the
+# in-memory collections loadTestTaxApi mocks. Run with: python3 -m pytest
+
+import pytest
+
+import responseCache
+from responseCache import ResponseCache
+
+pytest.importorskip("flask")
+import loadTestTaxApi
+import propertyTaxApi
+
+class Versions:
+    # The data versions of loadTestTaxApi.MockVersions, but they can be changed
+    def __init__(self):
+        self.current = (0, 0)
+
+    def version(self, database, collection, watch=True):
+        return self.current
+
+@pytest.fixture
+def api(monkeypatch):
+    app = loadTestTaxApi.mockApi(True)
+    monkeypatch.setattr(propertyTaxApi, "data_versions", Versions())
+    monkeypatch.setattr(propertyTaxApi, "response_cache", ResponseCache())
+    monkeypatch.setattr(propertyTaxApi, "known_counties", set())
+    monkeypatch.setattr(propertyTaxApi, "known_counties_read", 0.0)
+    return app.test_client()
+
+path = "/tax-data/morris/4_MAIN_ST/07960"
+
+def test_responsesHaveAnETag(api):
+    response = api.get(path)
+    assert response.status_code == 200
+    assert response.get_json()["taxes"]
+    assert response.headers["ETag"]
+    assert "max-age=" in response.headers["Cache-Control"]
+
+def test_aMatchingETagIsNotModified(api):
+    etag = api.get(path).headers["ETag"]
+    response = api.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert api.get(path, headers={"If-None-Match": '"stale"'}).status_code == 200
+
+def test_theSameAddressIsCachedOnce(api):
+    first = api.get(path)
+    second = api.get("/tax-data/Morris/4_main_st./07960") # Normalized to the same county and address key
+    assert second.data == first.data
+    assert propertyTaxApi.response_cache.stats()["entries"] == 1
+    assert propertyTaxApi.response_cache.stats()["hits"] == 1
+
+def test_newDataMissesTheCache(api):
+    api.get(path)
+    propertyTaxApi.data_versions.current = (1, 0)
+    api.get(path)
+    assert propertyTaxApi.response_cache.stats()["misses"] == 2
+
+def test_unknownCountiesAreNotFound(api):
+    response = api.get("/tax-data/atlantis/4_MAIN_ST/07960")
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "Unknown county: atlantis"}
+    assert propertyTaxApi.response_cache.stats()["entries"] == 0
+
+def test_bridgeRoutesAnswerAnyCounty(api):
+    assert api.get("/coords/atlantis/4_MAIN_ST/07960").get_json() == {"coords": []} # Bridge isn't split by county collection
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_cacheDropsTheLeastRecentlyUsed():
+    cache = ResponseCache(maxBytes=10)
+    cache.put("a", "A", 4)
+    cache.put("b", "B", 4)
+    assert cache.get("a") == "A" # "b" is now the least recently used
+    cache.put("c", "C", 4)
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.stats()["bytes"] == 8
+
+def test_cacheSkipsResponsesOverTheBudget():
+    cache = ResponseCache(maxBytes=10)
+    cache.put("a", "A", 4)
+    cache.put("big", "BIG", 11)
+    assert cache.get("big") is None
+    assert cache.get("a") == "A" # Not dropped to make room for a response that can't fit anyway
+
+def test_cacheEntriesExpire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(responseCache.time, "monotonic", clock)
+    cache = ResponseCache(ttlSeconds=60)
+    cache.put("a", "A", 1)
+    clock.now += 59
+    assert cache.get("a") == "A"
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 0
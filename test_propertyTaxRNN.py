@@ -0,0 +1,49 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of how propertyTax_RNN packs each property's records into padded
+# sequences for the LSTM. Run with: python3 -m pytest
+
+import numpy as np
+import pytest
+from pandas import DataFrame
+
+pytest.importorskip("sklearn")
+pytest.importorskip("keras")
+from propertyTax_RNN import cols, pack_sequences
+
+def records(*rows):
+    # rows of (RECORD-KEY, year, tax), with features derived from the year so each one can be told apart
+    return DataFrame([{"RECORD-KEY": key, "year": year, **{col: year * 10 + index for index, col in enumerate(cols)}, "LAST-YEAR-TAX": tax}
+        for key, year, tax in rows])
+
+def test_sequencesArePaddedAtTheEnd():
+    X, y, mask = pack_sequences(records(("A", 2018, 100), ("A", 2019, 110), ("A", 2020, 120), ("B", 2019, 200)))
+    assert X.shape == (2, 3, len(cols))
+    assert y.tolist() == [[100, 110, 120], [200, 0, 0]]
+    assert mask.tolist() == [[True, True, True], [True, False, False]]
+    assert X[1, 0].tolist() == [20190, 20191, 20192, 20193]
+    assert not X[1, 1:].any()
+
+def test_propertiesKeepTheirOrder():
+    _, y, _ = pack_sequences(records(("B", 2019, 200), ("A", 2019, 100)))
+    assert y[:, 0].tolist() == [200, 100]
+
+def test_maxYearsKeepsTheMostRecent():
+    X, y, mask = pack_sequences(records(("A", 2017, 90), ("A", 2018, 100), ("A", 2019, 110), ("B", 2019, 200)), max_years=2)
+    assert y.tolist() == [[100, 110], [200, 0]]
+    assert mask.tolist() == [[True, True], [True, False]]
+    assert X[0, 0, 0] == 20180
+
+def test_recordsMissingAValueAreLeftOut():
+    frame = records(("A", 2018, 100), ("A", 2019, 110), ("B", 2019, 200))
+    frame[cols[0]] = frame[cols[0]].astype(object) # As the records come from Mongo, any field can hold a string
+    frame.loc[0, cols[0]] = "N/A"
+    frame.loc[2, "LAST-YEAR-TAX"] = None
+    X, y, mask = pack_sequences(frame)
+    assert y.tolist() == [[110]] # B had no usable record, so it has no sequence
+    assert mask.all()
+
+def test_noRecords():
+    X, y, mask = pack_sequences(records(("A", 2018, None)))
+    assert X.shape == (0, 0, len(cols))
+    assert y.shape == mask.shape == (0, 0)
+    assert X.dtype == y.dtype == np.float32 and mask.dtype == bool
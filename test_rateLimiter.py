@@ -0,0 +1,111 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of the token buckets the MLS API clients are rate limited by, and of
+# the state the limiters save between runs. Run with: python3 -m pytest
+
+import asyncio
+import json
+import multiprocessing
+
+import pytest
+
+import rateLimiter
+from rateLimiter import TokenBucket, parseRetryAfter
+
+class Clock:
+    # Stands in for time.monotonic, so the tests don't wait for buckets to refill
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rateLimiter.time, "monotonic", clock)
+    return clock
+
+def test_burstUpToCapacity(clock):
+    bucket = TokenBucket(rate=10, capacity=5)
+    assert [bucket._reserve() for _ in range(5)] == [0] * 5
+    assert bucket._reserve() == pytest.approx(0.1) # One token into debt waits for one token's refill
+
+def test_debtAddsUp(clock):
+    bucket = TokenBucket(rate=2, capacity=1)
+    bucket._reserve()
+    assert bucket._reserve() == pytest.approx(0.5)
+    assert bucket._reserve() == pytest.approx(1.0) # Each caller waits behind the ones that took tokens before it
+
+def test_refillIsCappedAtCapacity(clock):
+    bucket = TokenBucket(rate=10, capacity=5)
+    for _ in range(5):
+        bucket._reserve()
+    clock.now += 60
+    assert [bucket._reserve() for _ in range(5)] == [0] * 5
+    assert bucket._reserve() > 0
+
+def test_capacityDefaultsToRate(clock):
+    bucket = TokenBucket(rate=3)
+    assert bucket.capacity == 3
+    assert [bucket._reserve() for _ in range(3)] == [0] * 3
+    assert bucket._reserve() == pytest.approx(1 / 3)
+
+def test_acquireSleepsForTheDebt(clock, monkeypatch):
+    slept = []
+    monkeypatch.setattr(rateLimiter.time, "sleep", slept.append)
+    bucket = TokenBucket(rate=4, capacity=1)
+    bucket.acquire()
+    bucket.acquire()
+    assert slept == [pytest.approx(0.25)]
+
+def test_acquireAsyncSleepsForTheDebt(clock, monkeypatch):
+    slept = []
+    async def sleep(seconds):
+        slept.append(seconds)
+    monkeypatch.setattr(rateLimiter.asyncio, "sleep", sleep)
+    bucket = TokenBucket(rate=4, capacity=1)
+    async def acquireTwice():
+        await bucket.acquireAsync()
+        await bucket.acquireAsync()
+    asyncio.run(acquireTwice())
+    assert slept == [pytest.approx(0.25)]
+
+def test_parseRetryAfter():
+    assert parseRetryAfter("120", 10) == 120
+    assert parseRetryAfter("-5", 10) == 0
+    assert parseRetryAfter(None, 10) == 10
+    assert parseRetryAfter("soon", 10) == 10
+    assert parseRetryAfter("Wed, 21 Oct 2015 07:28:00 GMT", 10) == 0 # A date in the past doesn't wait
+
+@pytest.fixture
+def stateFile(tmp_path, monkeypatch):
+    path = str(tmp_path / "rateLimits.json")
+    monkeypatch.setattr(rateLimiter, "stateFile", path)
+    monkeypatch.setattr(rateLimiter, "stateLockFile", path + ".lock")
+    return path
+
+def test_stateSurvivesARestart(stateFile):
+    limiter = rateLimiter.RateLimiter("TEST", requestsPerSecond=1, burst=10)
+    for _ in range(10):
+        limiter.requests._reserve()
+    limiter.backoff(60)
+    restarted = rateLimiter.RateLimiter("TEST", requestsPerSecond=1, burst=10)
+    assert restarted.requests.tokens < 5 # Not a full budget while the provider still counts the last run
+    assert restarted.blockedUntil == pytest.approx(limiter.blockedUntil)
+
+def saveRepeatedly(name, saves):
+    limiter = rateLimiter.RateLimiter(name, requestsPerSecond=1)
+    for _ in range(saves):
+        limiter.save(force=True)
+
+def test_processesKeepEachOthersProviders(stateFile):
+    context = multiprocessing.get_context("fork") # The children inherit the patched stateFile
+    names = [f"PROVIDER{index}" for index in range(6)]
+    processes = [context.Process(target=saveRepeatedly, args=(name, 30)) for name in names]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    with open(stateFile) as json_file:
+        assert set(json.load(json_file)) == set(names)
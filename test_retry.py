@@ -0,0 +1,123 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of the bounded retries and circuit breakers the syncs and the ETL
+# call MLSs through. Run with: python3 -m pytest
+
+import pytest
+
+import retry
+from retry import CircuitBreaker, CircuitOpenError, RetryExecutor, RetryPolicy, runUpdate
+
+class Clock:
+    # Stands in for time.monotonic and time.sleep, so the tests don't wait out backoffs or breakers
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(retry.time, "sleep", clock.sleep)
+    monkeypatch.setattr(retry, "breakers", {}) # Every test gets fresh breakers
+    return clock
+
+class Flaky:
+    # Raises the errors it's given, one per call, then returns "done"
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+def test_retriesUntilSuccess(clock):
+    flaky = Flaky(ConnectionError(), ConnectionError())
+    executor = RetryExecutor("TEST", {ConnectionError: RetryPolicy(maxAttempts=5, baseDelay=1, jitter=0)})
+    assert executor.run(flaky) == "done"
+    assert flaky.calls == 3
+    assert clock.slept == [1, 2] # Doubling after every failure
+
+def test_raisesTheLastErrorAfterMaxAttempts(clock):
+    flaky = Flaky(*[ConnectionError(str(attempt)) for attempt in range(1, 10)])
+    executor = RetryExecutor("TEST", {ConnectionError: RetryPolicy(maxAttempts=3, jitter=0)})
+    with pytest.raises(ConnectionError, match="3"):
+        executor.run(flaky)
+    assert flaky.calls == 3
+
+def test_errorsWithoutAPolicyAreRaisedRightAway(clock):
+    flaky = Flaky(ValueError())
+    executor = RetryExecutor("TEST", {ConnectionError: RetryPolicy()})
+    with pytest.raises(ValueError):
+        executor.run(flaky)
+    assert flaky.calls == 1
+    assert executor.breaker.failures == 0 # A bad call isn't the MLS failing
+
+def test_theFirstMatchingPolicyDecides(clock):
+    flaky = Flaky(ConnectionRefusedError(), ConnectionRefusedError())
+    executor = RetryExecutor("TEST", {
+        ConnectionRefusedError: RetryPolicy(maxAttempts=2, jitter=0),
+        ConnectionError: RetryPolicy(maxAttempts=10, jitter=0),
+    })
+    with pytest.raises(ConnectionRefusedError):
+        executor.run(flaky)
+    assert flaky.calls == 2
+
+def test_onRetryIsCalledBeforeEveryRetry(clock):
+    retried = []
+    executor = RetryExecutor("TEST", {ConnectionError: RetryPolicy(jitter=0)})
+    executor.run(Flaky(ConnectionError(), ConnectionError()), onRetry=lambda exc, attempt: retried.append(attempt))
+    assert retried == [1, 2]
+
+def test_delayIsCappedAndJittered(monkeypatch):
+    policy = RetryPolicy(baseDelay=10, maxDelay=60, jitter=.5)
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    assert policy.delay(1) == 10
+    assert policy.delay(10) == 60
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: low)
+    assert policy.delay(10) == 30
+
+def test_breakerOpensAfterTheThreshold(clock):
+    breaker = CircuitBreaker("TEST", failureThreshold=3, resetTimeout=300)
+    for _ in range(2):
+        breaker.recordFailure()
+    assert breaker.allow()
+    breaker.recordFailure()
+    assert not breaker.allow()
+
+def test_breakerLetsOneCallThroughAfterTheTimeout(clock):
+    breaker = CircuitBreaker("TEST", failureThreshold=3, resetTimeout=300)
+    for _ in range(3):
+        breaker.recordFailure()
+    clock.now += 300
+    assert breaker.allow()
+    breaker.recordFailure() # The half open call failed, so the circuit opens again right away
+    assert not breaker.allow()
+    clock.now += 300
+    assert breaker.allow()
+    breaker.recordSuccess()
+    breaker.recordFailure()
+    assert breaker.allow() # A success closes the circuit and clears the failures
+
+def test_anOpenBreakerStopsTheExecutor(clock):
+    executor = RetryExecutor("TEST", {ConnectionError: RetryPolicy(maxAttempts=100, jitter=0)})
+    executor.breaker.failureThreshold = 4
+    flaky = Flaky(*[ConnectionError()] * 10)
+    with pytest.raises(CircuitOpenError):
+        executor.run(flaky)
+    assert flaky.calls == 4
+    assert RetryExecutor("TEST", {}).breaker is executor.breaker # Every executor of an MLS shares its breaker
+
+def test_runUpdate(clock):
+    assert runUpdate("TEST", Flaky(RuntimeError()), 1)
+    assert not runUpdate("FAILING", Flaky(*[RuntimeError()] * 3), 1) # Skipped until the next run after 3 attempts
+    assert "FAILING ETL" in retry.breakers and "FAILING" not in retry.breakers
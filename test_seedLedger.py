@@ -0,0 +1,65 @@
+# Author: Andrew Pantera for TLCengine
+# Tests of the ledger a PARAGON seed resumes from after a restart.
+# Run with: python3 -m pytest
+
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("rets") # PARAGONsync logs in through the rets library
+import PARAGONsync
+from PARAGONsync import SeedLedger
+
+@pytest.fixture
+def ledgerFile(tmp_path, monkeypatch):
+    path = str(tmp_path / "paragonSeed.json")
+    monkeypatch.setattr(PARAGONsync, "seedLedgerFile", path)
+    return path
+
+def test_aNewSeedStartsEmpty(ledgerFile):
+    assert SeedLedger(4).done == set()
+
+def test_resumeSkipsFinishedUnits(ledgerFile):
+    ledger = SeedLedger(4)
+    ledger.finish("RE_1 (L_ListingID=0-12500000)")
+    ledger.finish("RE_1 (L_ListingID=0-)")
+    restarted = SeedLedger(4)
+    assert restarted.finished("RE_1 (L_ListingID=0-12500000)")
+    assert restarted.finished("RE_1 (L_ListingID=0-)")
+    assert not restarted.finished("RE_2 (L_ListingID=0-)")
+
+@pytest.mark.parametrize("batches, staged", [(8, False), (4, True)])
+def test_aDifferentSeedStartsOver(ledgerFile, batches, staged):
+    SeedLedger(4).finish("RE_1 (L_ListingID=0-)")
+    assert SeedLedger(batches, staged).done == set() # The windows, or the collection they went to, don't match
+
+def test_anUnreadableLedgerStartsOver(ledgerFile):
+    with open(ledgerFile, 'w') as outfile:
+        outfile.write('{"batches": 4, "done": ["RE_1') # Killed mid write by an older version
+    assert SeedLedger(4).done == set()
+
+def test_finishWritesTheWholeLedger(ledgerFile):
+    ledger = SeedLedger(2, staged=True)
+    ledger.finish("RE_2 (L_ListingID=0-)")
+    ledger.finish("RE_1 (L_ListingID=0-)")
+    with open(ledgerFile) as json_file:
+        assert json.load(json_file) == {"batches": 2, "staged": True, "done": ["RE_1 (L_ListingID=0-)", "RE_2 (L_ListingID=0-)"]}
+
+def test_threadsFinishingAtOnceKeepEachOthersUnits(ledgerFile):
+    ledger = SeedLedger(1)
+    units = [f"RE_{index} (L_ListingID=0-)" for index in range(50)]
+    threads = [threading.Thread(target=ledger.finish, args=(unit,)) for unit in units]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SeedLedger(1).done == set(units)
+
+def test_clearStartsTheNextSeedOver(ledgerFile):
+    ledger = SeedLedger(4)
+    ledger.finish("RE_1 (L_ListingID=0-)")
+    ledger.clear()
+    assert ledger.done == set()
+    assert SeedLedger(4).done == set()
+    ledger.clear() # Clearing with no ledger file is fine
@@ -0,0 +1,144 @@
+# Author: Andrew Pantera for TLCengine
+# One pool of MongoDB writer threads per process, shared by every sync.
+# Writes wait in a bounded queue, so a search that downloads faster than
+# the database can take the listings is slowed down instead of piling the
+# whole result up in memory. Each sync's batches are split to a size that
+# is adjusted from how long its recent bulk writes took, and the pool logs
+# its queue depth and throughput while it is busy.
+
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, List
+
+class WriterPool:
+    def __init__(self, writers: int = 16, queueSize: int = 64, batchSize: int = 1000, minBatchSize: int = 100, maxBatchSize: int = 5000, targetSeconds: float = 1, reportSeconds: float = 60):
+        """Construct a writer pool. Its threads are started by the first write
+
+        Args:
+            writers (int, optional): The number of writer threads, the most bulk writes running at once. Defaults to 16.
+            queueSize (int, optional): The most batches waiting for a writer before submit blocks. Defaults to 64.
+            batchSize (int, optional): The starting number of documents per write. Defaults to 1000.
+            minBatchSize (int, optional): The smallest batch size adapting can reach. Defaults to 100.
+            maxBatchSize (int, optional): The largest batch size adapting can reach. Defaults to 5000.
+            targetSeconds (float, optional): How long one write should take. Batches shrink when writes are slower and grow when they are much faster. Defaults to 1.
+            reportSeconds (float, optional): Seconds between logs of queue depth and throughput. Defaults to 60.
+        """
+        self.writers = writers
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.startBatchSize = batchSize
+        self.minBatchSize = minBatchSize
+        self.maxBatchSize = maxBatchSize
+        self.targetSeconds = targetSeconds
+        self.reportSeconds = reportSeconds
+        self.batchSizes = {} # The current batch size of each sync
+        self.threads = []
+        self.lock = threading.Lock()
+        self.written = 0 # Documents written since the last report
+        self.writeSeconds = 0
+        self.reportedAt = time.monotonic()
+
+    def start(self) -> None:
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.writers):
+                thread = threading.Thread(target=self.work, name=f"mongoWriter{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def batchSize(self, name: str) -> int:
+        return self.batchSizes.get(name, self.startBatchSize)
+
+    def submit(self, name: str, write: Callable, docs: list, *args) -> List[concurrent.futures.Future]:
+        """Queue docs to be written by write(batch, *args) in batches, blocking while the queue is full
+
+        Args:
+            name (str): The sync doing the write, which batch size to use
+            write (Callable): Called with a list of documents and args, for example a function that bulk upserts them
+            docs (list): The documents to write
+
+        Returns:
+            List[concurrent.futures.Future]: One future per batch, holding the result of write or the error it raised
+        """
+        self.start()
+        futures = []
+        start = 0
+        while start < len(docs):
+            size = self.batchSize(name)
+            future = concurrent.futures.Future()
+            self.queue.put((future, name, write, docs[start:start+size], args))
+            futures.append(future)
+            start += size
+        return futures
+
+    def work(self) -> None:
+        while True:
+            future, name, write, batch, args = self.queue.get()
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                st = time.monotonic()
+                try:
+                    result = write(batch, *args)
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+                self.record(name, len(batch), time.monotonic() - st)
+            finally:
+                self.queue.task_done()
+
+    def record(self, name: str, count: int, seconds: float) -> None:
+        # Adjust the sync's batch size toward writes that take targetSeconds, and report throughput now and then
+        with self.lock:
+            size = self.batchSize(name)
+            if seconds > self.targetSeconds:
+                size = max(self.minBatchSize, int(size * .75))
+            elif seconds < self.targetSeconds / 2 and count >= size: # Only a full batch shows that a bigger one would be fast enough
+                size = min(self.maxBatchSize, int(size * 1.25))
+            self.batchSizes[name] = size
+            self.written += count
+            self.writeSeconds += seconds
+            now = time.monotonic()
+            if now - self.reportedAt < self.reportSeconds:
+                return
+            elapsed = now - self.reportedAt
+            logging.info(f"    Writers: {round(self.written/elapsed)} documents per second, {self.queue.qsize()} batches queued, {round(self.writeSeconds/elapsed/self.writers*100)}% busy, batch sizes {self.batchSizes}")
+            self.written = 0
+            self.writeSeconds = 0
+            self.reportedAt = now
+
+    def stats(self) -> dict:
+        with self.lock:
+            elapsed = max(time.monotonic() - self.reportedAt, 1e-9)
+            return {
+                "queued": self.queue.qsize(),
+                "documentsPerSecond": self.written / elapsed,
+                "batchSizes": dict(self.batchSizes),
+            }
+
+def waitFor(futures, name: str) -> int:
+    # Wait for writes to finish, logging the ones that failed instead of raising. Returns the number that failed
+    failed = 0
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            future.result()
+        except Exception as exc:
+            failed += 1
+            logging.info(f'    {name}: Exception: {exc}')
+    return failed
+
+writerPool = None
+writerPoolLock = threading.Lock()
+
+def getWriterPool() -> WriterPool:
+    # One pool per process. MONGODB_WRITERS in .env sets the number of writer threads
+    global writerPool
+    with writerPoolLock:
+        if writerPool is None:
+            writerPool = WriterPool(writers=int(os.getenv("MONGODB_WRITERS", 16)))
+        return writerPool